@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+from network.led import Led
+from network.sensor import Sensor
+from network.blind import Blind
+from network.codec import CODECS, encode_payload
+from network.store import create_store
+from network.controller import numpy
+import websimulator
+from log import logger
+
+SIZES = [100, 1000, 10000]
+# Fleet share of each driver type
+SHARES = [("led", 0.8), ("sensor", 0.1), ("blind", 0.1)]
+
+
+def message(topic, payload):
+    result = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    result.payload = encode_payload(payload)
+    return result
+
+
+# Simulated fleet grown in place from one size to the next, the drivers are plugged but not started
+class Fleet(object):
+
+    def __init__(self, switch, group_size, store=None):
+        self.switch = switch
+        self.codec = switch.codec
+        self.store = store
+        self.group_size = group_size
+        self.drivers = {"led": [], "sensor": [], "blind": []}
+        self.groups = []
+        self.models = {
+            "led": (Led, 2.3, switch.plug_led),
+            "sensor": (Sensor, 2.3, switch.plug_sensor),
+            "blind": (Blind, 3.1, switch.plug_blind)
+        }
+
+    def size(self):
+        return sum(len(drivers) for drivers in self.drivers.values())
+
+    def create(self, driver_type):
+        model, version, plug = self.models[driver_type]
+        mac = "%012X" % (self.size() + 1)
+        if driver_type == "led" and self.store:
+            driver = self.store.create(mac, version)
+        else:
+            driver = model(self.switch.broker_ip, mac, version, clock=self.switch.clock, codec=self.codec)
+        driver.is_configured = True
+        plug(driver)
+        self.drivers[driver_type].append(driver)
+        return driver
+
+    def grow(self, size):
+        # Fill rooms of group_size drivers with the fleet shares of every type
+        while self.size() < size:
+            room = min(self.group_size, size - self.size())
+            members = {"led": [], "sensor": [], "blind": []}
+            for driver_type, share in SHARES:
+                for _ in range(max(1, int(round(room * share)))):
+                    members[driver_type].append(self.create(driver_type))
+            group_id = len(self.groups) + 1
+            self.switch.create_group(members["led"], members["sensor"], members["blind"], group_id)
+            group = self.switch.get_group_id(group_id)
+            self.groups.append(group)
+            for sensor in members["sensor"]:
+                group.event_received(group.client, None, self.dump(sensor, 0))
+
+    def dump(self, sensor, index):
+        payload = {"mac": sensor.mac, "brightness": 100 + index % 400, "temperature": 180 + index % 60,
+                   "presence": index % 2 == 0}
+        return message("/read/" + sensor.base_topic + "/status/dump", self.codec.encode(payload))
+
+    def hello(self, driver, driver_type):
+        payload = {"mac": driver.mac, "topic": driver.base_topic, "type": driver_type}
+        return message("/read/" + driver.base_topic + "/setup/hello", self.codec.encode(payload))
+
+
+def repeated(items, minimum):
+    # Enough calls per run for the timer resolution on the small fleets
+    return items * int(math.ceil(minimum / float(len(items)))) if items else []
+
+
+def measure(function, items, repeat):
+    # Per call time of function on every item, in nanoseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        timings.append((time.perf_counter() - start) / len(items) * 1e9)
+    return {
+        "calls": len(items),
+        "best_ns": min(timings),
+        "median_ns": statistics.median(timings)
+    }
+
+
+def cases(fleet, api, minimum, requests):
+    # (name, function, items) of every benchmark at the current fleet size
+    leds = repeated(fleet.drivers["led"], minimum)
+    sensors = repeated(fleet.drivers["sensor"], minimum)
+    blinds = repeated(fleet.drivers["blind"], minimum)
+    groups = repeated(fleet.groups, minimum)
+    dumps = []
+    for group in fleet.groups:
+        for index, mac in enumerate(list(group.sensors)):
+            dumps.append((group, fleet.dump(fleet.switch.get_sensor(mac), index + 1)))
+    hellos = [(driver_type, fleet.hello(driver, driver_type))
+              for driver_type, drivers in fleet.drivers.items() for driver in drivers]
+    switch = fleet.switch
+    led = fleet.drivers["led"][0]
+
+    def tick_groups(_):
+        # One control loop tick of every group
+        if switch.controller:
+            switch.controller.tick()
+            return
+        for group in fleet.groups:
+            group.tick()
+
+    def changed_listing(_):
+        # A changed driver invalidates the encoded listing
+        led.brightness = (led.brightness + 1) % 100
+        api.get("/v1/switch").get_data()
+
+    yield "led.serialize", lambda driver: driver.serialize(), leds
+    yield "sensor.serialize", lambda driver: driver.serialize(), sensors
+    yield "blind.serialize", lambda driver: driver.serialize(), blinds
+    yield "group.event_received", lambda item: item[0].event_received(item[0].client, None, item[1]), \
+        repeated(dumps, minimum)
+    yield "group.compute_temperature", lambda group: group.compute_temperature(), groups
+    yield "group.compute_brightness", lambda group: group.compute_brightness(), groups
+    yield "group.compute_presence", lambda group: group.compute_presence(), groups
+    yield "groups.tick", tick_groups, [None] * max(1, minimum // max(1, len(fleet.groups)))
+    yield "switch.event_received.hello", lambda item: switch.event_received(switch.client, None, item[1]), \
+        repeated(hellos, minimum)
+    yield "api.switch", lambda _: api.get("/v1/switch").get_data(), [None] * requests
+    yield "api.switch.changed", changed_listing, [None] * requests
+    yield "api.switch.page", lambda _: api.get("/v1/switch?limit=100").get_data(), [None] * requests
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+
+def compare(results, baseline):
+    reference = {(result["case"], result["size"]): result for result in baseline["results"]}
+    lines = ["%-30s %8s %12s %12s %8s" % ("case", "size", "baseline ns", "current ns", "change")]
+    for result in results["results"]:
+        previous = reference.get((result["case"], result["size"]))
+        if not previous:
+            continue
+        change = (result["best_ns"] - previous["best_ns"]) / previous["best_ns"] * 100
+        lines.append("%-30s %8d %12.0f %12.0f %+7.1f%%" % (result["case"], result["size"], previous["best_ns"],
+                                                           result["best_ns"], change))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the simulator hot paths with the loopback transport")
+    parser.add_argument("-z", "--sizes",  type=str, default=",".join(str(size) for size in SIZES),
+                        help="comma separated fleet sizes (number of drivers), by default 100,1000,10000")
+    parser.add_argument("-g", "--group-size",  type=int, default=50,
+                        help="number of drivers per group, by default 50")
+    parser.add_argument("-r", "--repeat",  type=int, default=5,
+                        help="number of timed runs of every benchmark, the best and median are reported, by default 5")
+    parser.add_argument("-m", "--min-calls",  type=int, default=2000,
+                        help="minimum number of calls per run of the per driver and per group benchmarks, by default 2000")
+    parser.add_argument("-q", "--requests",  type=int, default=20,
+                        help="number of API requests per run, by default 20")
+    parser.add_argument("-c", "--codec",  type=str, default="json", choices=sorted(CODECS),
+                        help="payload encoding, by default json")
+    parser.add_argument("-F", "--store",  type=str, default="objects", choices=["objects", "columnar"],
+                        help="led state storage, by default objects")
+    parser.add_argument("-G", "--controller",  type=str, default="groups", choices=["groups", "batch"],
+                        help="group control loop, by default groups")
+    parser.add_argument("-o", "--output",  type=str, default="",
+                        help="write the JSON results to this file instead of the standard output")
+    parser.add_argument("-b", "--baseline",  type=str, default="",
+                        help="JSON results of a previous run to compare with, the comparison goes to the standard error")
+    args = parser.parse_args()
+    try:
+        sizes = sorted(int(size) for size in args.sizes.split(","))
+    except ValueError:
+        parser.error("--sizes must be a list of integers")
+    if not sizes or sizes[0] < 1 or args.group_size < 1 or args.repeat < 1 or args.requests < 1:
+        parser.error("sizes, group size, repeat and requests must be at least 1")
+    if args.controller == "batch" and numpy is None:
+        parser.error("numpy package is required by --controller batch")
+
+    # The logs are not part of the measures
+    logger.setLevel(logging.WARNING)
+
+    # Messages delivered in memory: the measures do not include a broker
+    options = argparse.Namespace(broker="loopback", speed=1, codec=args.codec, transport="loopback", record="",
+                                 store=args.store, controller=args.controller, engine="threads", workers=1, mqtt_pool=1, events_size=10000,
+                                 delta_dump=0, connect_rate=100, topology="")
+    switch = websimulator.setup(options)
+    # Nothing ticks behind the measures: the cases tick the groups and the controller themselves
+    switch.scheduler.stop()
+    for thread in switch.scheduler.threads:
+        thread.join()
+    api = websimulator.app.test_client()
+    # The leds are not started: the store needs neither pool nor scheduler
+    fleet = Fleet(switch, args.group_size,
+                  create_store(args.store, pool=None, scheduler=None, clock=switch.clock, codec=switch.codec))
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "codec": args.codec,
+        "store": args.store,
+        "controller": args.controller,
+        "groupSize": args.group_size,
+        "results": []
+    }
+    for size in sizes:
+        fleet.grow(size)
+        for name, function, items in cases(fleet, api, args.min_calls, args.requests):
+            if not items:
+                continue
+            # Warm up
+            for item in items[:10]:
+                function(item)
+            result = dict(case=name, size=size, **measure(function, items, args.repeat))
+            results["results"].append(result)
+            print("%-30s %8d %12.0f ns" % (name, size, result["best_ns"]), file=sys.stderr)
+
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(data + "\n")
+    else:
+        print(data)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            print(compare(results, json.load(baseline)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
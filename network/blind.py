@@ -3,7 +3,7 @@
 
 import paho.mqtt.client as mqtt
 
-from network.driver import Driver, error_management
+from network.driver import Driver, Topic, error_management
 import time
 import json
 from log import logger
@@ -11,8 +11,30 @@ from distutils.util import strtobool
 
 class Blind(Driver):
 
-    def __init__(self, broker_ip, mac, version):
-        Driver.__init__(self, broker_ip, "blind/" + mac, mac, version)
+    url_first_blind = Topic("/base/blind1")
+    url_second_blind = Topic("/base/blind2")
+    url_first_blind_manual = Topic("/base/blind1Manual")
+    url_second_blind_manual = Topic("/base/blind2Manual")
+    url_first_blind_fin_manual = Topic("/base/fin1Manual")
+    url_second_blind_fin_manual = Topic("/base/fin2Manual")
+    url_windows_status = Topic("/base/windowStatus")
+    url_version = Topic("/config/version")
+    url_is_configured = Topic("/config/isConfigured")
+    url_group = Topic("/config/group")
+    url_voltage_input = Topic("/metric/voltageInput")
+    url_time_to_auto = Topic("/metric/timeToAuto")
+    url_auto = Topic("/status/auto")
+    url_watchdog = Topic("/config/watchdog")
+    url_ble = Topic("/config/isBleEnabled")
+    url_daisy_enabled = Topic("/config/isDaisyChainEnabled")
+    url_daisy_position = Topic("/config/daisyChainPosition")
+    url_temperature = Topic("/metric/temperature")
+    url_reset_numbers = Topic("/metric/resetNumbers")
+    url_initial_date = Topic("/metric/initialSetupDate")
+    url_last_reset = Topic("/metric/lastResetDate")
+
+    def __init__(self, broker_ip, mac, version, **options):
+        Driver.__init__(self, broker_ip, "blind/" + mac, mac, version, **options)
         self.first_blind = 0
         self.second_blind = 0
         self.fin1 = "0"
@@ -26,30 +48,6 @@ class Blind(Driver):
         self.temperature = 0
         self.default_position = 1
 
-        self.url_first_blind = self.url_base + "/blind1"
-        self.url_second_blind = self.url_base + "/blind2"
-        self.url_first_blind_manual = self.url_base + "/blind1Manual"
-        self.url_second_blind_manual = self.url_base + "/blind2Manual"
-        self.url_first_blind_fin_manual = self.url_base + "/fin1Manual"
-        self.url_second_blind_fin_manual = self.url_base + "/fin2Manual"
-        self.url_windows_status = self.url_base + "/windowStatus"
-        self.url_version = self.url_config + "/version"
-        self.url_is_configured = self.url_config + "/isConfigured"
-        self.url_group = self.url_config + "/group"
-        self.url_voltage_input = self.url_metric + "/voltageInput"
-        self.url_time_to_auto = self.url_metric + "/timeToAuto"
-        self.url_auto = self.url_status + "/auto"
-        self.url_watchdog = self.url_config + "/watchdog"
-        self.url_ble = self.url_config + "/isBleEnabled"
-        self.url_daisy_enabled = self.url_config + "/isDaisyChainEnabled"
-        self.url_daisy_position = self.url_config + "/daisyChainPosition"
-        self.url_temperature = self.url_metric + "/temperature"
-        self.url_time_to_auto = self.url_metric + "/timeToAuto"
-        self.url_auto = self.url_status + "/auto"
-        self.url_reset_numbers = self.url_metric + "/resetNumbers"
-        self.url_initial_date = self.url_metric + "/initialSetupDate"
-        self.url_last_reset = self.url_metric + "/lastResetDate"
-
     def serialize(self):
         blind = {
             "mac": self.mac,
@@ -82,8 +80,7 @@ class Blind(Driver):
 
     @error_management
     def setup_configuration(self, client, userdata, message):
-        data = message.payload.decode("utf-8")
-        config = json.loads(data)
+        config = self.codec.decode(message.payload)
         logger.info("Not yet implemented setup_configuration for blind %r", config)
         self.is_configured = True
 
@@ -125,7 +122,7 @@ class Blind(Driver):
         # Field used for reset to default
         self.is_configured = strtobool(data) == 1
         self.reset_numbers += 1
-        self.last_reset_date = time.time()
+        self.last_reset_date = self.clock.time()
 
     @error_management
     def update_group(self, client, userdata, message):
@@ -173,7 +170,7 @@ class Blind(Driver):
             self.time_to_auto = self.watchdog
             logger.info("Switch to manual mode, start timer to %r", self.time_to_auto)
 
-    def run(self):
+    def setup(self):
         self.connect()
         self.client.message_callback_add("/write/" + self.url_initial_setup, self.setup_configuration)
         self.client.message_callback_add("/write/" + self.url_watchdog, self.update_watchdog)
@@ -191,21 +188,20 @@ class Blind(Driver):
         self.client.message_callback_add("/write/" + self.url_is_configured, self.update_configuration_status)
         self.client.message_callback_add("/write/" + self.url_first_blind_fin_manual, self.update_fin1_manual)
         self.client.message_callback_add("/write/" + self.url_second_blind_fin_manual, self.update_fin2_manual)
-        while self.is_alive:
-            if not self.is_configured:
-                message = {
-                    "mac": self.mac,
-                    "type": "sensor",
-                    "topic": self.base_topic
-                }
-                self.client.publish("/read/" + self.url_hello, json.dumps(message))
-            else:
-                if self.time_to_auto <= 0:
-                    # Switch back to automatic mode
-                    self.auto = True
-                    logger.info("Switch %r back to automatic mode", self.mac)
-                if self.time_to_auto:
-                    self.time_to_auto -= 1
-                self.client.publish("/read/" + self.url_dump, json.dumps(self.serialize()))
-            time.sleep(1)
-        self.disconnect()
+
+    def tick(self):
+        if not self.is_configured:
+            message = {
+                "mac": self.mac,
+                "type": "sensor",
+                "topic": self.base_topic
+            }
+            self.client.publish("/read/" + self.url_hello, self.codec.encode(message))
+        else:
+            if self.time_to_auto <= 0:
+                # Switch back to automatic mode
+                self.auto = True
+                logger.info("Switch %r back to automatic mode", self.mac)
+            if self.time_to_auto:
+                self.time_to_auto -= 1
+            self.publish_dump()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Condition
+import time
+
+
+# Wall clock: the default time source of the simulation
+class Clock(object):
+
+    lockstep = False
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, condition, seconds):
+        # condition must be acquired by the caller
+        condition.wait(seconds)
+
+    def real_seconds(self, seconds):
+        # Wall clock duration of a simulated duration
+        return seconds
+
+
+# Clock running speed times faster than the wall clock
+class ScaledClock(Clock):
+
+    def __init__(self, speed=1, start=None):
+        self.speed = float(speed)
+        self.real_origin = time.time()
+        self.origin = start if start is not None else self.real_origin
+
+    def time(self):
+        return self.origin + (time.time() - self.real_origin) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def wait(self, condition, seconds):
+        condition.wait(seconds / self.speed)
+
+    def real_seconds(self, seconds):
+        return seconds / self.speed
+
+
+# Clock only moving forward when the scheduler advances it.
+# Time jumps to the next deadline as soon as all the pending ticks are done.
+class VirtualClock(Clock):
+
+    lockstep = True
+
+    def __init__(self, start=None):
+        self.now = start if start is not None else time.time()
+        self.condition = Condition()
+
+    def time(self):
+        return self.now
+
+    def advance(self, now):
+        with self.condition:
+            if now > self.now:
+                self.now = now
+            self.condition.notify_all()
+
+    def sleep(self, seconds):
+        deadline = self.now + seconds
+        with self.condition:
+            while self.now < deadline:
+                self.condition.wait()
+
+    def wait(self, condition, seconds):
+        pass
+
+    def real_seconds(self, seconds):
+        return 0
+
+
+def create_clock(speed):
+    if speed == 1:
+        return Clock()
+    if speed <= 0:
+        return VirtualClock()
+    return ScaledClock(speed)
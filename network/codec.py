@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import json
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Key dictionary shared by the compact codecs: long field names are sent as their index
+KEYS = [
+    "mac", "type", "topic", "isConfigured", "error", "initialSetupDate", "duration", "version",
+    "brightness", "watchdog", "iMax", "group", "thresoldLow", "thresoldHigh", "isBleEnabled",
+    "isDaisyChainEnabled", "daisyChainPosition", "devicePower", "energy", "voltageLed", "voltageInput",
+    "temperature", "linePower", "timeToAuto", "auto", "resetNumbers", "lastResetDate",
+    "defaultBrigthness", "defaultBrightness", "presence", "temperatureOffset",
+    "brightnessCorrectionFactor", "thresoldPresence", "brightnessRaw", "lastMovment", "temperatureRaw",
+    "blind1", "blind2", "blind1Manual", "blind2Manual", "fin1Manual", "fin2Manual"
+]
+
+
+# Payload encoding of the driver telemetry and provisioning messages.
+# The counters tell how much time is spent in encoding and decoding (not locked: approximate values).
+class JsonCodec(object):
+
+    name = "json"
+
+    def __init__(self):
+        self.encoded = 0
+        self.encode_time = 0
+        self.decoded = 0
+        self.decode_time = 0
+
+    def encode(self, data):
+        start = time.perf_counter()
+        payload = self.dumps(data)
+        self.encode_time += time.perf_counter() - start
+        self.encoded += 1
+        return payload
+
+    def decode(self, payload):
+        start = time.perf_counter()
+        data = self.loads(payload)
+        self.decode_time += time.perf_counter() - start
+        self.decoded += 1
+        return data
+
+    def dumps(self, data):
+        return json.dumps(data)
+
+    def loads(self, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        return json.loads(payload)
+
+    def serialize(self):
+        return {
+            "codec": self.name,
+            "encoded": self.encoded,
+            "encodeTime": self.encode_time,
+            "decoded": self.decoded,
+            "decodeTime": self.decode_time
+        }
+
+
+# JSON with the field names replaced by their index in KEYS
+class CompactCodec(JsonCodec):
+
+    name = "compact"
+
+    def __init__(self):
+        JsonCodec.__init__(self)
+        self.keys = {key: str(index) for index, key in enumerate(KEYS)}
+        self.names = {str(index): key for index, key in enumerate(KEYS)}
+
+    def dumps(self, data):
+        return json.dumps({self.keys.get(key, key): value for key, value in data.items()},
+                          separators=(",", ":"))
+
+    def loads(self, payload):
+        data = JsonCodec.loads(self, payload)
+        return {self.names.get(key, key): value for key, value in data.items()}
+
+
+# MessagePack with the field names replaced by their index in KEYS
+class MsgpackCodec(JsonCodec):
+
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack package is required by the msgpack codec")
+        JsonCodec.__init__(self)
+        self.keys = {key: index for index, key in enumerate(KEYS)}
+
+    def dumps(self, data):
+        return msgpack.packb({self.keys.get(key, key): value for key, value in data.items()})
+
+    def loads(self, payload):
+        data = msgpack.unpackb(payload, strict_map_key=False)
+        return {KEYS[key] if isinstance(key, int) else key: value for key, value in data.items()}
+
+
+def encode_payload(payload):
+    # MQTT payload of a published value, same conversions as paho
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    return str(payload).encode("utf-8")
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    CompactCodec.name: CompactCodec,
+    MsgpackCodec.name: MsgpackCodec
+}
+
+default_codec = JsonCodec()
+
+
+def create_codec(name):
+    if name == JsonCodec.name:
+        return default_codec
+    return CODECS[name]()
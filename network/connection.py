@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.router import TopicRouter
+from network.metrics import metrics, handler_name
+from network.transport import default_transport
+from threading import Lock
+from log import logger
+import paho.mqtt.client as mqtt
+import random
+import string
+import time
+import zlib
+
+
+# Driver view on a shared MQTT connection: the subset of the paho client API used by the drivers
+class SharedClient(object):
+
+    def __init__(self, pool, connection, driver):
+        self.pool = pool
+        self.connection = connection
+        self.driver = driver
+        self.callbacks = {}
+        self.subscriptions = set()
+
+    def message_callback_add(self, sub, callback):
+        self.callbacks[sub] = callback
+
+    def message_callback_remove(self, sub):
+        self.callbacks.pop(sub, None)
+
+    def subscribe(self, topic, qos=0):
+        # Counted once per driver by the pool
+        if topic in self.subscriptions:
+            return mqtt.MQTT_ERR_SUCCESS, None
+        self.subscriptions.add(topic)
+        if not topic.startswith("/write/"):
+            self.pool.listeners.add(topic, self.dispatch)
+        return self.pool.subscribe(self.connection, topic, qos)
+
+    def unsubscribe(self, topic):
+        if topic not in self.subscriptions:
+            return mqtt.MQTT_ERR_SUCCESS, None
+        self.subscriptions.discard(topic)
+        if not topic.startswith("/write/"):
+            self.pool.listeners.remove(topic, self.dispatch)
+        return self.pool.unsubscribe(self.connection, topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        return self.connection.publish(topic, payload, qos, retain)
+
+    def dispatch(self, message):
+        callback = self.callbacks.get(message.topic) or self.driver.event_received
+        start = time.perf_counter()
+        try:
+            callback(self, None, message)
+        finally:
+            metrics.callback_time(handler_name(callback), time.perf_counter() - start)
+
+
+# Small pool of MQTT connections shared by all the drivers (and the groups and the switch).
+# Incoming /write/<type>/<mac>/... messages are routed to the driver by topic,
+# the other subscriptions (sensor dumps, hellos) are routed by filter.
+class ConnectionPool(object):
+
+    def __init__(self, broker_ip, size=1, transport=None):
+        self.broker_ip = broker_ip
+        self.transport = transport or default_transport
+        self.size = max(1, size)
+        self.connections = []
+        self.subscriptions = {}
+        self.routes = {}
+        self.listeners = TopicRouter()
+        self.lock = Lock()
+        self.name = "Pool" + ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+
+    def connect(self):
+        for index in range(self.size):
+            client = self.transport.client(self.name + str(index))
+            client.on_connect = self.on_connect
+            client.on_message = self.event_received
+            client.on_disconnect = self.on_disconnect
+            self.subscriptions[client] = {}
+            self.connections.append(client)
+            self.open(client)
+        logger.info("%r shared MQTT connections opened on %r", self.size, self.broker_ip)
+
+    def open(self, client):
+        client.connect(self.broker_ip)
+        client.loop_start()
+
+    def disconnect(self):
+        for client in self.connections:
+            client.loop_stop()
+            client.disconnect()
+
+    def on_connect(self, client, userdata, flags, rc):
+        # Subscriptions are lost on reconnection
+        with self.lock:
+            topics = [(topic, qos) for topic, (qos, _) in self.subscriptions[client].items()]
+        for topic, qos in topics:
+            client.subscribe(topic, qos)
+
+    def on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            logger.warning("Unexpected shared client disconnect for %r, will reconnect", self.name)
+
+    def connection(self, driver):
+        return self.connections[zlib.crc32(driver.base_topic.encode("utf-8")) % len(self.connections)]
+
+    def attach(self, driver):
+        shared = SharedClient(self, self.connection(driver), driver)
+        with self.lock:
+            self.routes[driver.base_topic] = shared
+        return shared
+
+    def route(self, driver):
+        # Driver dispatching its own /write/ messages (dispatch method) on the returned connection,
+        # without SharedClient
+        connection = self.connection(driver)
+        with self.lock:
+            self.routes[driver.base_topic] = driver
+        self.subscribe(connection, "/write/" + driver.base_topic + "/#")
+        return connection
+
+    def unroute(self, driver):
+        with self.lock:
+            if self.routes.pop(driver.base_topic, None) is None:
+                return
+        self.unsubscribe(self.connection(driver), "/write/" + driver.base_topic + "/#")
+
+    def detach(self, driver):
+        with self.lock:
+            shared = self.routes.pop(driver.base_topic, None)
+        if not shared:
+            return
+        for topic in list(shared.subscriptions):
+            shared.unsubscribe(topic)
+
+    def subscribe(self, client, topic, qos=0):
+        # Subscriptions of a connection are shared by its users: qos and number of users by topic,
+        # the broker subscription is made by the first user and removed with the last one
+        with self.lock:
+            subscription = self.subscriptions[client].get(topic)
+            if subscription is not None:
+                self.subscriptions[client][topic] = (subscription[0], subscription[1] + 1)
+                return mqtt.MQTT_ERR_SUCCESS, None
+            self.subscriptions[client][topic] = (qos, 1)
+            return client.subscribe(topic, qos)
+
+    def unsubscribe(self, client, topic):
+        with self.lock:
+            subscription = self.subscriptions[client].get(topic)
+            if subscription is None:
+                return mqtt.MQTT_ERR_SUCCESS, None
+            if subscription[1] > 1:
+                self.subscriptions[client][topic] = (subscription[0], subscription[1] - 1)
+                return mqtt.MQTT_ERR_SUCCESS, None
+            del self.subscriptions[client][topic]
+            return client.unsubscribe(topic)
+
+    def event_received(self, client, userdata, message):
+        try:
+            # /write/<type>/<mac>/...
+            fields = message.topic.split("/", 4)
+            if len(fields) < 4 or fields[1] != "write":
+                for dispatch in self.listeners.match(message.topic):
+                    dispatch(message)
+                return
+            shared = self.routes.get(fields[2] + "/" + fields[3])
+            if not shared:
+                return
+            shared.dispatch(message)
+        except:
+            logger.exception("Invalid value received")
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.group import Group
+from network.clock import Clock
+from network.revision import Versioned
+from threading import Thread, RLock
+from log import logger
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Control loop state of the groups, one array per attribute indexed by the group slot
+GROUP_COLUMNS = [
+    ("auto", "bool"),
+    ("time_to_auto", "int64"),
+    ("watchdog", "int64"),
+    ("slope_start", "int64"),
+    ("slope_stop", "int64"),
+    ("slope", "int64"),
+    ("setpoint", "int64"),
+    ("new_setpoint", "int64"),
+    ("refresh_light", "bool"),
+    ("presence", "bool"),
+    ("time_leaving", "int64"),
+    ("empty_room", "bool"),
+    ("current_brightness", "int64"),
+    ("current_temperature", "float64"),
+    ("active", "bool")
+]
+# Rules acting on the control loop, NaN when the group has no such rule
+# (the temperature rule has no effect on the groups)
+CONTROL_RULES = ["brightness", "presence"]
+
+
+class Column(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, group, owner=None):
+        if group is None:
+            return self
+        return group.controller.columns[self.name].item(group.slot)
+
+    def __set__(self, group, value):
+        group.controller.set(self.name, group.slot, value)
+
+
+# Group of a BatchController: its control loop state lives in the controller arrays and it has
+# no tick of its own, the controller advances every group at once
+class BatchGroup(Group):
+
+    unversioned = Group.unversioned | frozenset(["active"])
+
+    def __init__(self, controller, broker_ip, group_id, **options):
+        object.__setattr__(self, "controller", controller)
+        object.__setattr__(self, "slot", controller.register(self))
+        Group.__init__(self, broker_ip, group_id, **options)
+
+    def __setattr__(self, name, value):
+        if name not in self.controller.columns:
+            Versioned.__setattr__(self, name, value)
+            return
+        if self.controller.set(name, self.slot, value) and name not in self.unversioned:
+            self.touch()
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        self.disconnect()
+
+    # The rule is checked by the controller first: an invalid value is refused before being kept
+    def set_brightness(self, ref_brightness):
+        self.controller.set_rule("brightness", self.slot, ref_brightness)
+        Group.set_brightness(self, ref_brightness)
+
+    def set_presence(self, ref_presence):
+        self.controller.set_rule("presence", self.slot, ref_presence)
+        Group.set_presence(self, ref_presence)
+
+
+for name, dtype in GROUP_COLUMNS:
+    setattr(BatchGroup, name, Column(name))
+
+
+# Control loop of all the groups in one NumPy pass per tick, instead of a tick per group:
+# the mode timeout, the presence and brightness rules and the setpoint ramp of Group.tick.
+# Only the groups whose setpoint changed publish it to their leds.
+# Slots are never reused: a removed group keeps its row.
+class BatchController(Thread):
+
+    def __init__(self, scheduler=None, clock=None, capacity=64):
+        Thread.__init__(self, name="GroupController", daemon=True)
+        self.scheduler = scheduler
+        self.clock = clock or Clock()
+        self.capacity = capacity
+        self.columns = {name: numpy.zeros(capacity, dtype) for name, dtype in GROUP_COLUMNS}
+        self.rules = {name: numpy.full(capacity, numpy.nan) for name in CONTROL_RULES}
+        self.groups = []
+        self.is_running = True
+        # The MQTT handlers change the group state while the controller advances it
+        self.lock = RLock()
+
+    def group(self, broker_ip, group_id, **options):
+        return BatchGroup(self, broker_ip, group_id, **options)
+
+    def register(self, group):
+        with self.lock:
+            if len(self.groups) == self.capacity:
+                self.grow(self.capacity * 2)
+            self.groups.append(group)
+            return len(self.groups) - 1
+
+    def grow(self, capacity):
+        for arrays in [self.columns, self.rules]:
+            for name, values in arrays.items():
+                grown = numpy.full(capacity, numpy.nan) if arrays is self.rules else numpy.zeros(capacity, values.dtype)
+                grown[:len(values)] = values
+                arrays[name] = grown
+        self.capacity = capacity
+
+    def set(self, name, slot, value):
+        # True when the value changed
+        with self.lock:
+            values = self.columns[name]
+            if values.item(slot) == value:
+                return False
+            values[slot] = value
+            return True
+
+    def set_rule(self, name, slot, value):
+        # Raises ValueError in the caller thread instead of failing the controller tick
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("Rule " + name + " must be a number, not " + repr(value))
+        with self.lock:
+            self.rules[name][slot] = value
+
+    def start(self):
+        if not self.scheduler:
+            Thread.start(self)
+            return
+        self.scheduler.add(self)
+
+    def stop(self):
+        self.is_running = False
+        if self.scheduler:
+            self.scheduler.remove(self)
+
+    def run(self):
+        while self.is_running:
+            self.tick()
+            self.clock.sleep(1)
+
+    def advance(self):
+        # Slots of the groups whose setpoint changed, and of those with a new serialized state
+        size = len(self.groups)
+        columns = {name: values[:size] for name, values in self.columns.items()}
+        active = columns["active"]
+        auto = columns["auto"]
+        time_to_auto = columns["time_to_auto"]
+        slope = columns["slope"]
+        setpoint = columns["setpoint"]
+        new_setpoint = columns["new_setpoint"]
+        refresh_light = columns["refresh_light"]
+        time_leaving = columns["time_leaving"]
+        empty_room = columns["empty_room"]
+        previous_auto = auto.copy()
+        previous_time_to_auto = time_to_auto.copy()
+        previous_setpoint = setpoint.copy()
+
+        # Back to automatic mode at the end of the manual mode timer
+        auto |= active & (time_to_auto <= 0)
+        time_to_auto -= active & (time_to_auto != 0)
+        running = active & auto
+
+        presence_rule = self.rules["presence"][:size]
+        controlled = running & ~numpy.isnan(presence_rule)
+        leave = controlled & (time_leaving >= presence_rule) & ~empty_room
+        new_setpoint[leave] = 0
+        slope[leave] = columns["slope_stop"][leave]
+        empty_room |= leave
+        stay = controlled & ~leave
+        time_leaving[stay & ~columns["presence"]] += 1
+        present = stay & columns["presence"]
+        time_leaving[present] = 0
+        empty_room &= ~present
+
+        brightness_rule = self.rules["brightness"][:size]
+        lighting = running & ~empty_room & refresh_light & ~numpy.isnan(brightness_rule)
+        brightness = columns["current_brightness"]
+        increase = lighting & (brightness < brightness_rule)
+        decrease = lighting & (brightness > brightness_rule)
+        up = increase & (setpoint < 100)
+        # Same as Group.increase_brightness: any non negative setpoint goes to 100
+        new_setpoint[up] = numpy.where(new_setpoint + 10 >= 0, 100, new_setpoint + 10)[up]
+        slope[up] = columns["slope_start"][up]
+        down = decrease & (setpoint > 0)
+        new_setpoint[down] = numpy.maximum(new_setpoint - 10, 0)[down]
+        slope[down] = columns["slope_stop"][down]
+        refresh_light &= ~(increase | decrease)
+
+        # Setpoint ramp: a slope-th of the remaining difference per tick
+        diff = new_setpoint - setpoint
+        refresh_light |= active & (diff == 0)
+        moving = active & (diff != 0)
+        ramp = moving & (slope > 0)
+        jump = moving & ~ramp
+        setpoint[ramp] += numpy.trunc(diff[ramp] / slope[ramp]).astype(setpoint.dtype)
+        slope[ramp] -= 1
+        setpoint[jump] = new_setpoint[jump]
+        setpoint[moving] = numpy.clip(setpoint[moving], 0, 100)
+
+        changed = setpoint != previous_setpoint
+        touched = changed | (auto != previous_auto) | (time_to_auto != previous_time_to_auto)
+        return numpy.flatnonzero(changed), numpy.flatnonzero(touched)
+
+    def tick(self):
+        with self.lock:
+            changed, touched = self.advance()
+            groups = list(self.groups)
+        for slot in touched:
+            groups[slot].touch()
+        for slot in changed:
+            group = groups[slot]
+            logger.debug("Set group %r brightness now to %r, Remaining time %r", group.group_id, group.setpoint,
+                         group.slope)
+            group.publish_setpoint()
+
+
+def create_controller(name, scheduler=None, clock=None):
+    # None keeps a tick per group
+    if name != "batch":
+        return None
+    controller = BatchController(scheduler, clock)
+    logger.info("Groups driven by the batch controller")
+    return controller
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.clock import Clock
+from collections import deque
+from threading import Lock
+
+
+# Bounded diagnostic event log: the oldest events are dropped once size is reached.
+# Event ids are consecutive, so a cursor (last seen id) gives the position in the buffer.
+class EventLog(object):
+
+    def __init__(self, size=10000, clock=None):
+        self.clock = clock or Clock()
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+        self.lock = Lock()
+        # Called with each new event
+        self.listeners = []
+
+    def add(self, event_type, content, mac=None, group=None):
+        with self.lock:
+            self.last_id += 1
+            event = {
+                "id": self.last_id,
+                "date": self.clock.time(),
+                "type": event_type,
+                "content": content
+            }
+            if mac is not None:
+                event["mac"] = mac
+            if group is not None:
+                event["group"] = group
+            self.events.append(event)
+        for listener in self.listeners:
+            listener(event)
+        return event
+
+    def latest(self, limit=100):
+        with self.lock:
+            start = max(0, len(self.events) - limit)
+            return [self.events[index] for index in range(start, len(self.events))]
+
+    def query(self, since=None, until=None, event_type=None, mac=None, group=None, cursor=0, limit=100):
+        events = []
+        next_cursor = None
+        with self.lock:
+            if not self.events:
+                return events, next_cursor
+            first_id = self.events[0]["id"]
+            index = max(0, cursor + 1 - first_id)
+            while index < len(self.events):
+                event = self.events[index]
+                index += 1
+                if until is not None and event["date"] > until:
+                    break
+                if since is not None and event["date"] < since:
+                    continue
+                if event_type is not None and event["type"] != event_type:
+                    continue
+                if mac is not None and event.get("mac") != mac:
+                    continue
+                if group is not None and event.get("group") != group:
+                    continue
+                events.append(event)
+                if len(events) >= limit:
+                    if index < len(self.events):
+                        next_cursor = event["id"]
+                    break
+        return events, next_cursor
+
+    def __len__(self):
+        return len(self.events)
@@ -4,23 +4,83 @@
 import paho.mqtt.client as mqtt
 from threading import Thread
 import paho.mqtt.subscribe as subscribe
+from network.clock import Clock
+from network.codec import default_codec
+from network.revision import Versioned
+from network.metrics import metrics
+from network.transport import default_transport
+from network.profiler import profiler
 from log import logger
+import functools
 import time
+import json
 
 def error_management(func):
-    def func_wrapper(*args, **kwargs):
+    @functools.wraps(func)
+    def func_wrapper(self, *args, **kwargs):
+        if not profiler.enabled:
+            try:
+                return func(self, *args, **kwargs)
+            except:
+                logger.exception("Invalid value received")
+            return None
+        failed = False
+        start = time.perf_counter()
         try:
-            logger.info("Call %r", func.__name__)
-            return func(*args, **kwargs)
+            return func(self, *args, **kwargs)
         except:
+            failed = True
             logger.exception("Invalid value received")
+        finally:
+            profiler.record(type(self).__name__ + "." + func.__name__, time.perf_counter() - start, failed)
     return func_wrapper
 
 
-class Driver(Thread):
+# Topic of a driver derived from its base topic on access instead of being kept by every driver
+class Topic(object):
 
-    def __init__(self, broker_ip, base_topic, mac, version):
+    def __init__(self, suffix):
+        self.suffix = suffix
+
+    def __get__(self, driver, owner=None):
+        if driver is None:
+            return self
+        return driver.base_topic + self.suffix
+
+
+class Driver(Versioned, Thread):
+
+    unversioned = frozenset(["client", "last_dump", "dump_age", "is_running", "tracer", "transport"])
+    # Identity of the driver, not part of the state carried by a move to another shard
+    unmoved = frozenset(["mac", "base_topic", "broker_ip", "group", "revision", "snapshot_period"])
+
+    url_base = Topic("/base")
+    url_config = Topic("/config")
+    url_metric = Topic("/metric")
+    url_status = Topic("/status")
+    url_error = Topic("/status/error")
+    url_ping = Topic("/status/ping")
+    url_setup = Topic("/setup")
+    url_hello = Topic("/setup/hello")
+    url_initial_setup = Topic("/setup/config")
+    url_dump = Topic("/status/dump")
+
+    def __init__(self, broker_ip, base_topic, mac, version, pool=None, scheduler=None, clock=None,
+                 snapshot_period=0, codec=None, tracer=None, transport=None):
         Thread.__init__(self)
+        self.codec = codec or default_codec
+        self.clock = clock or Clock()
+        self.transport = transport or default_transport
+        self.pool = pool
+        self.scheduler = scheduler
+        # Command latency tracer of the switch, told when a commanded value is applied
+        self.tracer = tracer
+        self.is_running = True
+        # Delta dumps: only changed fields are published, with a full dump every snapshot_period ticks
+        # 0 means that the full dump is always published
+        self.snapshot_period = snapshot_period
+        self.last_dump = None
+        self.dump_age = 0
         self.version = version
         self.mac = mac
         self.broker_ip = broker_ip
@@ -28,23 +88,12 @@ class Driver(Thread):
         self.is_configured = False
         self.is_ble_enabled = False
         self.reset_numbers = 0
-        self.initial_date = time.time()
+        self.initial_date = self.clock.time()
         self.last_reset_date = 0
         self.error = 0
         self.voltage_input = 36
         self.group = 0
 
-        self.url_base = self.base_topic + "/base"
-        self.url_config = self.base_topic + "/config"
-        self.url_metric = self.base_topic + "/metric"
-        self.url_status = self.base_topic + "/status"
-        self.url_error = self.url_status + "/error"
-        self.url_ping = self.url_status + "/ping"
-        self.url_setup = self.base_topic + "/setup"
-        self.url_hello = self.url_setup + "/hello"
-        self.url_initial_setup = self.url_setup + "/config"
-        self.url_dump = self.url_status + "/dump"
-
     def event_received(self, client, userdata, message):
         data = message.payload.decode("utf-8")
         logger.info("received url %r %r", message.topic, str(data))
@@ -52,21 +101,85 @@ class Driver(Thread):
     def event_publish(self, client, userdata, result):
         pass
 
+    def state(self):
+        # Device state carried when the driver is moved to another shard
+        return {name: value for name, value in vars(self).items() if name[0] != "_" and name not in self.unversioned and
+                name not in self.unmoved and isinstance(value, (bool, int, float, str))}
+
+    def restore(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def publish_dump(self):
+        dump = self.serialize()
+        if self.snapshot_period <= 0:
+            self.client.publish("/read/" + self.url_dump, self.codec.encode(dump))
+            return
+        self.dump_age += 1
+        if self.last_dump is None or self.dump_age >= self.snapshot_period:
+            # Full snapshot for the new subscribers
+            payload = dump
+            self.dump_age = 0
+        else:
+            payload = {}
+            for key, value in dump.items():
+                if key not in self.last_dump or self.last_dump[key] != value:
+                    payload[key] = value
+        self.last_dump = dump
+        if not payload:
+            return
+        payload["mac"] = self.mac
+        self.client.publish("/read/" + self.url_dump, self.codec.encode(payload))
+
     def on_disconnect(self, client, userdata, rc):
         if rc != 0:
             logger.warning("Unexpected client disconnect for %r, will reconnect")
 
     def connect(self):
-        self.client = mqtt.Client(self.mac)
-        self.client.on_message = self.event_received
-        self.client.on_publish = self.event_publish
-        self.client.on_disconnect = self.on_disconnect
-        self.client.connect(self.broker_ip)
-        self.client.loop_start()
+        if self.pool:
+            # Share the pool connections instead of opening a new one
+            self.client = self.pool.attach(self)
+        else:
+            self.client = self.transport.client(self.mac)
+            self.client.on_message = metrics.timed(self.event_received)
+            self.client.on_publish = self.event_publish
+            self.client.on_disconnect = self.on_disconnect
+            self.client.connect(self.broker_ip)
+            self.client.loop_start()
         self.client.subscribe("/write/" + self.base_topic + "/#")
 
     def disconnect(self):
-        self.client.loop_stop()
+        if self.pool:
+            self.pool.detach(self)
+        else:
+            self.client.loop_stop()
+
+    def start(self):
+        if not self.is_running:
+            # Stopped before being started
+            return
+        if not self.scheduler:
+            Thread.start(self)
+            return
+        # The scheduler calls tick() instead of a dedicated thread
+        self.setup()
+        self.scheduler.add(self)
+
+    def stop(self):
+        self.is_running = False
+        if self.scheduler and hasattr(self, "client"):
+            self.scheduler.remove(self)
+            self.disconnect()
+
+    def setup(self):
+        self.connect()
+
+    def tick(self):
+        pass
 
     def run(self):
-        pass
\ No newline at end of file
+        self.setup()
+        while self.is_running:
+            self.tick()
+            self.clock.sleep(1)
+        self.disconnect()
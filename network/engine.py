@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.clock import Clock
+from network.connection import ConnectionPool
+from threading import Thread, get_ident
+from log import logger
+import paho.mqtt.client as mqtt
+import asyncio
+import heapq
+import itertools
+import math
+
+
+# Scheduler running the whole simulation on one asyncio event loop.
+# Same interface as Scheduler: the ticks are loop timers, one per aligned deadline whatever the
+# number of entities ticking at that time. Ticks are run in batches so that the MQTT traffic of
+# the AsyncConnectionPool is processed in between.
+class AsyncScheduler(object):
+
+    def __init__(self, period=1, clock=None, batch=500):
+        self.period = period
+        self.batch = max(1, batch)
+        self.clock = clock or Clock()
+        self.origin = self.clock.time()
+        self.loop = asyncio.new_event_loop()
+        # Token of every registered entity, as in Scheduler
+        self.entities = {}
+        self.tokens = itertools.count()
+        # Entities and their token by deadline, and the pending deadlines in lockstep
+        self.slots = {}
+        self.deadlines = []
+        self.busy = False
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, name="SimulationLoop", daemon=True)
+        self.thread.start()
+        logger.info("Asyncio scheduler started")
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def call(self, callback, *args):
+        # The loop is not thread safe: the other threads queue their calls
+        if self.thread is not None and self.thread.ident == get_ident():
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def next_deadline(self, now):
+        slots = math.ceil((now - self.origin) / self.period)
+        return self.origin + slots * self.period
+
+    def add(self, entity):
+        self.call(self.schedule, entity)
+
+    def remove(self, entity):
+        self.call(self.entities.pop, entity, None)
+
+    def schedule(self, entity):
+        token = self.entities[entity] = next(self.tokens)
+        self.enqueue(self.next_deadline(self.clock.time()), entity, token)
+
+    def enqueue(self, deadline, entity, token):
+        slot = self.slots.get(deadline)
+        if slot is None:
+            slot = self.slots[deadline] = []
+            self.arm(deadline)
+        slot.append((entity, token))
+
+    def arm(self, deadline):
+        if not self.clock.lockstep:
+            delay = self.clock.real_seconds(deadline - self.clock.time())
+            self.loop.call_later(max(0, delay), self.fire, deadline)
+            return
+        heapq.heappush(self.deadlines, deadline)
+        if not self.busy:
+            self.busy = True
+            self.loop.call_soon(self.advance)
+
+    def advance(self):
+        # Lockstep: time jumps to the next deadline once the previous ticks are done
+        if not self.deadlines:
+            self.busy = False
+            return
+        deadline = heapq.heappop(self.deadlines)
+        self.clock.advance(deadline)
+        self.fire(deadline)
+
+    def fire(self, deadline):
+        self.run_slot(deadline, self.slots.pop(deadline, []), 0)
+
+    def run_slot(self, deadline, entities, start):
+        for entity, token in entities[start:start + self.batch]:
+            if self.entities.get(entity) != token:
+                continue
+            try:
+                entity.tick()
+            except:
+                logger.exception("Tick failed for %r", entity)
+            self.enqueue(deadline + self.period, entity, token)
+        start += self.batch
+        if start < len(entities):
+            self.loop.call_soon(self.run_slot, deadline, entities, start)
+        elif self.clock.lockstep:
+            self.loop.call_soon(self.advance)
+
+
+# Connection pool whose sockets are read and written by the event loop of an AsyncScheduler
+# instead of a paho network thread per connection.
+class AsyncConnectionPool(ConnectionPool):
+
+    def __init__(self, broker_ip, size=1, scheduler=None, transport=None):
+        ConnectionPool.__init__(self, broker_ip, size, transport)
+        self.scheduler = scheduler
+        self.loop = scheduler.loop
+
+    def open(self, client):
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        client.connect(self.broker_ip)
+        self.scheduler.call(self.misc, client)
+
+    def disconnect(self):
+        for client in self.connections:
+            client.disconnect()
+
+    def on_socket_open(self, client, userdata, sock):
+        self.scheduler.call(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.scheduler.call(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.scheduler.call(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.scheduler.call(self.loop.remove_writer, sock)
+
+    def misc(self, client):
+        # Keepalive and reconnection, done by the paho thread otherwise
+        if client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+            try:
+                client.reconnect()
+            except:
+                logger.exception("Cannot reconnect %r to %r", self.name, self.broker_ip)
+        self.loop.call_later(1, self.misc, client)
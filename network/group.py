@@ -3,18 +3,35 @@
 
 import paho.mqtt.client as mqtt
 from network.driver import error_management
-from threading import Thread
+from network.clock import Clock
+from network.router import TopicRouter
+from network.codec import default_codec
+from network.revision import Versioned
+from network.metrics import metrics
+from network.transport import default_transport
+from threading import Thread, RLock
 import time
 import json
 import random
+import functools
 
 from log import logger
 from distutils.util import strtobool
 
-class Group(Thread):
+class Group(Versioned, Thread):
 
-    def __init__(self, broker_ip, group_id):
+    # Control loop state, not part of the serialized group
+    unversioned = frozenset(["client", "pool", "is_running", "transport", "router", "lock", "current_temperature", "current_brightness", "slope",
+                             "new_setpoint", "refresh_light", "presence", "time_leaving", "empty_room"])
+
+    def __init__(self, broker_ip, group_id, scheduler=None, clock=None, codec=None, pool=None, transport=None):
         Thread.__init__(self)
+        self.codec = codec or default_codec
+        self.clock = clock or Clock()
+        self.transport = transport or default_transport
+        self.scheduler = scheduler
+        self.pool = pool
+        self.is_running = True
         self.group_id = group_id
         self.broker_ip = broker_ip
         self.base_topic = "group/" + str(self.group_id)
@@ -39,8 +56,13 @@ class Group(Thread):
         self.empty_room = True
 
         self.sensors = {}
+        # Running sums and number of sensors reporting each value, presence sum is the number of present sensors
+        self.totals = {"temperature": 0, "brightness": 0, "presence": 0}
+        self.counts = {"temperature": 0, "brightness": 0, "presence": 0}
         self.leds = {}
         self.blinds = {}
+        # Members and sensor values are changed by the API workers and the MQTT thread
+        self.lock = RLock()
 
         self.rules = {}
 
@@ -49,14 +71,20 @@ class Group(Thread):
         self.url_blind_position = "/write/" + self.base_topic + "/config/blindPosition"
 
         group_name = "Group" + str(self.group_id) + str(random.randint(0,9))
-        self.client = mqtt.Client(group_name)
-        self.client.on_message = self.event_received
-        self.client.connect(self.broker_ip)
-        self.client.loop_start()
-        self.client.subscribe("#")
-        self.client.message_callback_add(self.url_auto, self.update_auto_mode)
-        self.client.message_callback_add(self.url_setpoint, self.update_led_brigthness)
-        self.client.message_callback_add(self.url_blind_position, self.update_blind_position)
+        # Precompiled topic index: only the group topics and the member dumps are subscribed
+        self.router = TopicRouter()
+        self.router.add(self.url_auto, self.update_auto_mode)
+        self.router.add(self.url_setpoint, self.update_led_brigthness)
+        self.router.add(self.url_blind_position, self.update_blind_position)
+
+        if self.pool:
+            self.client = self.pool.attach(self)
+        else:
+            self.client = self.transport.client(group_name)
+            self.client.on_message = metrics.timed(self.event_received)
+            self.client.connect(self.broker_ip)
+            self.client.loop_start()
+        self.client.subscribe("/write/" + self.base_topic + "/#")
 
     @error_management
     def update_auto_mode(self, client, userdata, message):
@@ -85,8 +113,8 @@ class Group(Thread):
         if position not in [0, 1, 2]:
             logger.warning("Received invalid position %r", position)
             return
-        for blind in self.blinds:
-            base_topic = self.blinds[blind]["topic"]
+        for blind in list(self.blinds.values()):
+            base_topic = blind["topic"]
             url = "/write/" + base_topic + "/base/blind1"
             self.client.publish(url, position)
             url = "/write/" + base_topic + "/base/blind2"
@@ -112,113 +140,146 @@ class Group(Thread):
     def serialize(self):
         return {
             "group": self.group_id,
-            "leds": [led for led in self.leds],
-            "sensors": [sensor for sensor in self.sensors],
-            "blinds": [blind for blind in self.blinds],
+            "leds": list(self.leds),
+            "sensors": list(self.sensors),
+            "blinds": list(self.blinds),
             "rules": self.rules,
             "slopeStart": self.slope_start,
             "slopeStop": self.slope_stop,
             "auto": self.auto,
             "timeToAuto": self.time_to_auto,
-            "watchdog": self.watchdog
+            "watchdog": self.watchdog,
+            "setpoint": self.setpoint
         }
 
     def event_received(self, client, userdata, message):
-        try:
-            logger.debug("Group Received %r %r", message.topic, message.payload.decode("utf-8"))
-            data = message.payload.decode("utf-8")
-            source = message.topic.split("/")[3]
-            if source in self.sensors:
-                dump = json.loads(data)
-                if "temperature" in dump:
-                    self.sensors[source]["temperature"] = int(dump["temperature"])
-                    self.compute_temperature()
-                if "brightness" in dump:
-                    self.sensors[source]["brightness"] = int(dump["brightness"])
-                    self.compute_brightness()
-                if "presence" in dump:
-                    self.sensors[source]["presence"] = bool(dump["presence"])
-                    self.compute_presence()
-            elif source in self.leds:
-                pass
-        except:
-            logger.exception("Received invalid value")
+        # Only a dispatch: the handlers are profiled by error_management each
+        for handler in self.router.match(message.topic):
+            handler(client, userdata, message)
+
+    @error_management
+    def sensor_dump_received(self, source, client, userdata, message):
+        logger.debug("Group Received %r %r", message.topic, message.payload)
+        # Delta dumps only carry the changed fields: merge them into the last known values
+        dump = self.codec.decode(message.payload)
+        with self.lock:
+            if source not in self.sensors:
+                return
+            if dump.get("isConfigured") is False and len(self.sensors[source]) > 1:
+                # The sensor has been reset, forget its values
+                self.forget_sensor_values(source)
+                return
+            if "temperature" in dump:
+                self.update_sensor_value(source, "temperature", int(dump["temperature"]))
+                self.compute_temperature()
+            if "brightness" in dump:
+                self.update_sensor_value(source, "brightness", int(dump["brightness"]))
+                self.compute_brightness()
+            if "presence" in dump:
+                self.update_sensor_value(source, "presence", bool(dump["presence"]))
+                self.compute_presence()
+
+    def start(self):
+        if not self.scheduler:
+            Thread.start(self)
+            return
+        # The scheduler calls tick() instead of a dedicated thread
+        self.scheduler.add(self)
+
+    def stop(self):
+        self.is_running = False
+        if self.scheduler:
+            self.scheduler.remove(self)
+        # A running thread disconnects when its loop ends
+        if self.scheduler or self.ident is None:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.pool:
+            self.pool.detach(self)
+        else:
+            self.client.loop_stop()
 
     def run(self):
-        while self.is_alive:
-            if self.time_to_auto <= 0:
-                # Switch back to automatic mode
-                self.auto = True
-                logger.info("Switch Group %r back to automatic mode", self.group_id)
-            if self.time_to_auto:
-                self.time_to_auto -= 1
-
-            if self.auto and "temperature" in self.rules:
-                if self.current_temperature > self.rules["temperature"]:
-                    logger.debug("Start air conditionning")
-                elif self.current_temperature < self.rules["temperature"]:
-                    logger.debug("Start hitting system")
-            
-            if self.auto and "presence" in self.rules:
-                if self.time_leaving >= self.rules["presence"] and not self.empty_room:
-                    self.leave_room()
-                    self.empty_room = True
-                else:
-                    if not self.presence:
-                        self.time_leaving += 1
-                    else:
-                        self.time_leaving = 0
-                        self.empty_room = False
-
-            if self.auto and not self.empty_room and self.refresh_light:
-                if "brightness" in self.rules:
-                    if self.current_brightness < self.rules["brightness"]:
-                        logger.debug("Increase brightness")
-                        self.increase_brightness()
-                        self.refresh_light = False
-
-                    elif self.current_brightness > self.rules["brightness"]:
-                        logger.debug("Decrease brightness")
-                        self.decrease_brightness()
-                        self.refresh_light = False
-
-            diff = self.new_setpoint - self.setpoint
-            if diff == 0:
-                self.refresh_light = True
-                time.sleep(1)
-                continue
-            
-            if self.slope > 0:
-                self.setpoint += int((diff / self.slope))
-                self.slope -= 1
+        while self.is_running:
+            self.tick()
+            self.clock.sleep(1)
+        self.disconnect()
+
+    def tick(self):
+        if self.time_to_auto <= 0:
+            # Switch back to automatic mode
+            self.auto = True
+            logger.info("Switch Group %r back to automatic mode", self.group_id)
+        if self.time_to_auto:
+            self.time_to_auto -= 1
+
+        if self.auto and "temperature" in self.rules:
+            if self.current_temperature > self.rules["temperature"]:
+                logger.debug("Start air conditionning")
+            elif self.current_temperature < self.rules["temperature"]:
+                logger.debug("Start hitting system")
+        
+        if self.auto and "presence" in self.rules:
+            if self.time_leaving >= self.rules["presence"] and not self.empty_room:
+                self.leave_room()
+                self.empty_room = True
             else:
-                self.setpoint = self.new_setpoint
-            logger.info("Set brightness now to %r, Remaining time %r", self.setpoint, self.slope)
-            if self.setpoint < 0:
-                self.setpoint = 0
-            if self.setpoint > 100:
-                self.setpoint = 100
-
-            for led in self.leds:
-                base_topic = self.leds[led]["topic"]
-                url = "/write/" + base_topic + "/base/setpoint"
-                self.client.publish(url,  self.setpoint)
-
-            time.sleep(1)
-        self.client.loop_stop()
+                if not self.presence:
+                    self.time_leaving += 1
+                else:
+                    self.time_leaving = 0
+                    self.empty_room = False
+
+        if self.auto and not self.empty_room and self.refresh_light:
+            if "brightness" in self.rules:
+                if self.current_brightness < self.rules["brightness"]:
+                    logger.debug("Increase brightness")
+                    self.increase_brightness()
+                    self.refresh_light = False
+
+                elif self.current_brightness > self.rules["brightness"]:
+                    logger.debug("Decrease brightness")
+                    self.decrease_brightness()
+                    self.refresh_light = False
+
+        diff = self.new_setpoint - self.setpoint
+        if diff == 0:
+            self.refresh_light = True
+            return
+        
+        if self.slope > 0:
+            self.setpoint += int((diff / self.slope))
+            self.slope -= 1
+        else:
+            self.setpoint = self.new_setpoint
+        logger.info("Set brightness now to %r, Remaining time %r", self.setpoint, self.slope)
+        if self.setpoint < 0:
+            self.setpoint = 0
+        if self.setpoint > 100:
+            self.setpoint = 100
+        self.publish_setpoint()
+
+    def publish_setpoint(self):
+        for led in list(self.leds.values()):
+            base_topic = led["topic"]
+            url = "/write/" + base_topic + "/base/setpoint"
+            self.client.publish(url,  self.setpoint)
 
     def add_led(self, led):
-        self.leds[led.mac] = {"topic": led.base_topic}
-        self.client.subscribe("/read/" + led.base_topic + "/#")
+        with self.lock:
+            self.leds[led.mac] = {"topic": led.base_topic}
         led.group = self.group_id
         led.auto = True
+        self.touch()
         logger.info("led %r added", led.serialize())
         return True
 
     def remove_led(self, led):
-        self.client.unsubscribe("/read/" + led.base_topic + "/#")
-        if led.base_topic in self.leds:
-            del self.leds[led.base_topic]
+        with self.lock:
+            if led.mac in self.leds:
+                del self.leds[led.mac]
+                self.touch()
         led.group = 1
         led.auto = False
         return True
@@ -245,78 +306,110 @@ class Group(Thread):
         self.slope = self.slope_stop
 
     def add_sensor(self, sensor):
-        self.sensors[sensor.mac] = {"topic": sensor.base_topic}
-        self.client.subscribe("/read/" + sensor.base_topic + "/#")
+        url = "/read/" + sensor.base_topic + "/status/dump"
+        with self.lock:
+            self.sensors[sensor.mac] = {"topic": sensor.base_topic}
+        self.router.add(url, functools.partial(self.sensor_dump_received, sensor.mac))
+        self.client.subscribe(url)
         sensor.group = self.group_id
         sensor.auto = True
+        self.touch()
         logger.info("sensor %r added", sensor.serialize())
+        return True
 
     def remove_sensor(self, sensor):
-        self.client.unsubscribe("/read/" + sensor.base_topic + "/#")
-        if sensor.base_topic in self.sensors:
-            del self.sensors[sensor.base_topic]
+        url = "/read/" + sensor.base_topic + "/status/dump"
+        self.client.unsubscribe(url)
+        self.router.remove(url)
+        with self.lock:
+            if sensor.mac in self.sensors:
+                self.forget_sensor_values(sensor.mac)
+                del self.sensors[sensor.mac]
+                self.touch()
         sensor.group = 1
         sensor.auto = False
         return True
 
+    def update_sensor_value(self, source, key, value):
+        sensor = self.sensors[source]
+        if key in sensor:
+            self.totals[key] -= sensor[key]
+        else:
+            self.counts[key] += 1
+        sensor[key] = value
+        self.totals[key] += value
+
+    def forget_sensor_values(self, source):
+        sensor = self.sensors[source]
+        for key in self.totals:
+            if key in sensor:
+                self.totals[key] -= sensor[key]
+                self.counts[key] -= 1
+                del sensor[key]
+        self.compute_temperature()
+        self.compute_brightness()
+        self.compute_presence()
+
     def compute_temperature(self):
-        active_sensors = 0
-        temperature = 0
-        for sensor in self.sensors:
-            if "temperature" not in self.sensors[sensor]:
-                continue
-            temperature += self.sensors[sensor]["temperature"]
-            active_sensors += 1
-        if active_sensors < 1:
+        if self.counts["temperature"] < 1:
             self.current_temperature = 0
         else:
-            self.current_temperature = temperature / active_sensors
+            self.current_temperature = self.totals["temperature"] / self.counts["temperature"]
 
     def set_temperature(self, ref_temperature):
         self.rules["temperature"] = ref_temperature
+        self.touch()
 
     def compute_brightness(self):
-        active_sensors = 0
-        brightness = 0
-        for sensor in self.sensors:
-            if "brightness" not in self.sensors[sensor]:
-                continue
-            brightness += self.sensors[sensor]["brightness"]
-            active_sensors += 1
-        if active_sensors < 1:
+        if self.counts["brightness"] < 1:
             self.current_brightness = 0
         else:
-            self.current_brightness = int(brightness / active_sensors)
+            self.current_brightness = int(self.totals["brightness"] / self.counts["brightness"])
 
     def set_brightness(self, ref_brightness):
         self.rules["brightness"] = ref_brightness
+        self.touch()
         logger.info("Group %r : brightness rule set to %r", self.group_id, self.rules["brightness"])
 
     def set_presence(self, ref_presence):
         self.rules["presence"] = ref_presence
+        self.touch()
         logger.info("Group %r : presence rule set to %r", self.group_id, self.rules["presence"])
 
     def add_blind(self, blind):
-        self.blinds[blind.mac] = {"topic": blind.base_topic}
-        self.client.subscribe("/read/" + blind.base_topic + "/#")
+        with self.lock:
+            self.blinds[blind.mac] = {"topic": blind.base_topic}
         blind.group = self.group_id
         blind.auto = True
+        self.touch()
         logger.info("blind %r added", blind.serialize())
         return True
 
     def remove_blind(self, blind):
-        self.client.unsubscribe("/read/" + blind.base_topic + "/#")
-        if blind.base_topic in self.blinds:
-            del self.blinds[blind.base_topic]
+        with self.lock:
+            if blind.mac in self.blinds:
+                del self.blinds[blind.mac]
+                self.touch()
         blind.group = 1
         blind.auto = False
         return True
 
     def compute_presence(self):
-        for sensor in self.sensors:
-            if "presence" not in self.sensors[sensor]:
-                continue
-            if self.sensors[sensor]["presence"]:
-                self.presence = True
-                return
-        self.presence = False
+        self.presence = self.totals["presence"] > 0
+
+    def statistics(self):
+        # Only walks the sensors on request: min and max are not maintained incrementally
+        statistics = {"group": self.group_id}
+        for key in ["temperature", "brightness"]:
+            values = [sensor[key] for sensor in list(self.sensors.values()) if key in sensor]
+            statistics[key] = {
+                "count": self.counts[key],
+                "mean": self.totals[key] / self.counts[key] if self.counts[key] else 0,
+                "min": min(values) if values else 0,
+                "max": max(values) if values else 0
+            }
+        statistics["presence"] = {
+            "count": self.counts["presence"],
+            "present": self.totals["presence"]
+        }
+        return statistics
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Lock
+from collections import deque
+import bisect
+import itertools
+import time
+
+# Upper bounds of the latency buckets in seconds
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 30, 60, 120]
+# A command not applied after this delay in seconds is dropped (ignored by a driver in the other mode)
+COMMAND_TIMEOUT = 300
+
+
+class LatencyHistogram(object):
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        # One more bucket for the latencies above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.expired = 0
+        self.superseded = 0
+
+    def add(self, latency):
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if self.minimum is None or latency < self.minimum:
+            self.minimum = latency
+        if self.maximum is None or latency > self.maximum:
+            self.maximum = latency
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in [other.minimum, other.maximum]:
+            if value is None:
+                continue
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.expired += other.expired
+        self.superseded += other.superseded
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile, the exact maximum for the last bucket
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.bounds):
+                    return self.maximum
+                return min(self.bounds[index], self.maximum)
+        return self.maximum
+
+    def serialize(self):
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ["+Inf"], self.counts):
+            cumulative += count
+            buckets.append({"le": bound, "count": cumulative})
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.minimum or 0,
+            "max": self.maximum or 0,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "expired": self.expired,
+            "superseded": self.superseded,
+            "buckets": buckets
+        }
+
+
+def load_histogram(data):
+    # Histogram of a serialized one, to merge the histograms of the shards
+    histogram = LatencyHistogram([bucket["le"] for bucket in data["buckets"][:-1]])
+    previous = 0
+    for index, bucket in enumerate(data["buckets"]):
+        histogram.counts[index] = bucket["count"] - previous
+        previous = bucket["count"]
+    histogram.count = data["count"]
+    histogram.total = data["sum"]
+    if data["count"]:
+        histogram.minimum = data["min"]
+        histogram.maximum = data["max"]
+    histogram.expired = data["expired"]
+    histogram.superseded = data["superseded"]
+    return histogram
+
+
+def merge_latencies(answers):
+    # Merge the /v1/switch/latency answers of the shards
+    histograms = {}
+    pending = {}
+    for answer in answers:
+        for command_type, data in answer["commands"].items():
+            histogram = load_histogram(data)
+            if command_type in histograms:
+                histograms[command_type].merge(histogram)
+            else:
+                histograms[command_type] = histogram
+            pending[command_type] = pending.get(command_type, 0) + data["pending"]
+    return {"commands": {command_type: dict(histogram.serialize(), pending=pending[command_type])
+                         for command_type, histogram in histograms.items()}}
+
+
+# End to end latency of the switch commands: each command gets an id and its publish time for each
+# target driver, the latency is recorded when the driver applies the commanded value.
+# A new command to a driver supersedes its pending one.
+class CommandTracer(object):
+
+    def __init__(self, timeout=COMMAND_TIMEOUT):
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+        # Pending command of each driver: (id, type, value, publish time)
+        self.pending = {}
+        # (publish time, mac, id) in publish order, the oldest first: expire() only looks at the front.
+        # The entries of the applied and superseded commands are dropped when they reach it.
+        self.deadlines = deque()
+        self.histograms = {}
+        self.lock = Lock()
+
+    def histogram(self, command_type):
+        histogram = self.histograms.get(command_type)
+        if histogram is None:
+            histogram = self.histograms[command_type] = LatencyHistogram()
+        return histogram
+
+    def start(self, command_type, macs, value, unchanged=False):
+        # unchanged: the targets already have the value, nothing will be applied and the command
+        # is recorded at once with a zero latency instead of expiring
+        self.expire()
+        command_id = next(self.ids)
+        with self.lock:
+            now = time.time()
+            histogram = self.histogram(command_type)
+            for mac in macs:
+                previous = self.pending.pop(mac, None)
+                if previous is not None:
+                    self.histogram(previous[1]).superseded += 1
+                if unchanged:
+                    histogram.add(0)
+                else:
+                    self.pending[mac] = (command_id, command_type, value, now)
+                    self.deadlines.append((now, mac, command_id))
+        return command_id
+
+    def applied(self, mac, value):
+        # Called on every driver update: nothing to do without pending command
+        if not self.pending:
+            return
+        now = time.time()
+        with self.lock:
+            command = self.pending.get(mac)
+            if command is None or command[2] != value:
+                return
+            del self.pending[mac]
+            self.histogram(command[1]).add(now - command[3])
+
+    def expire(self):
+        limit = time.time() - self.timeout
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] < limit:
+                _, mac, command_id = self.deadlines.popleft()
+                command = self.pending.get(mac)
+                if command is not None and command[0] == command_id:
+                    del self.pending[mac]
+                    self.histogram(command[1]).expired += 1
+
+    def serialize(self):
+        self.expire()
+        with self.lock:
+            pending = {}
+            for command in self.pending.values():
+                pending[command[1]] = pending.get(command[1], 0) + 1
+            return {"commands": {command_type: dict(histogram.serialize(), pending=pending.get(command_type, 0))
+                                 for command_type, histogram in self.histograms.items()}}
+
+    def reset(self):
+        with self.lock:
+            self.pending = {}
+            self.deadlines = deque()
+            self.histograms = {}
@@ -3,7 +3,7 @@
 
 import paho.mqtt.client as mqtt
 
-from network.driver import Driver, error_management
+from network.driver import Driver, Topic, error_management
 import time
 import json
 from log import logger
@@ -12,8 +12,49 @@ from distutils.util import strtobool
 
 class Led(Driver):
 
-    def __init__(self, broker_ip, mac, version):
-        Driver.__init__(self, broker_ip, "led/" + mac, mac, version)
+    unversioned = Driver.unversioned | frozenset(["duration_seconds"])
+
+    url_setpoint = Topic("/base/setpoint")
+    url_setpoint_manual = Topic("/base/setpointManual")
+    url_version = Topic("/config/version")
+    url_is_configured = Topic("/config/isConfigured")
+    url_watchdog = Topic("/config/watchdog")
+    url_i_max = Topic("/config/iMax")
+    url_group = Topic("/config/group")
+    url_thresold_low = Topic("/config/thresoldLow")
+    url_thresold_high = Topic("/config/thresoldHigh")
+    url_ble = Topic("/config/isBleEnabled")
+    url_daisy_enabled = Topic("/config/isDaisyChainEnabled")
+    url_daisy_position = Topic("/config/daisyChainPosition")
+    url_device_power = Topic("/metric/devicePower")
+    url_energy = Topic("/metric/energy")
+    url_voltage_led = Topic("/metric/voltageLed")
+    url_voltage_input = Topic("/metric/voltageInput")
+    url_temperature = Topic("/metric/temperature")
+    url_line_power = Topic("/metric/linePower")
+    url_duration = Topic("/metric/duration")
+    url_time_to_auto = Topic("/metric/timeToAuto")
+    url_auto = Topic("/status/auto")
+    url_reset_numbers = Topic("/metric/resetNumbers")
+    url_initial_date = Topic("/metric/initialSetupDate")
+    url_last_reset = Topic("/metric/lastResetDate")
+
+    # Topics written by the switch and the groups, with their handler
+    write_handlers = [
+        ("url_auto", "update_auto_mode"),
+        ("url_watchdog", "update_watchdog"),
+        ("url_group", "update_group"),
+        ("url_initial_setup", "setup_configuration"),
+        ("url_is_configured", "update_configuration_status"),
+        ("url_thresold_high", "update_thresold_high"),
+        ("url_thresold_low", "update_thresold_low"),
+        ("url_ble", "enable_ble"),
+        ("url_setpoint", "update_brigthness_auto"),
+        ("url_setpoint_manual", "update_brigthness_manual")
+    ]
+
+    def __init__(self, broker_ip, mac, version, **options):
+        Driver.__init__(self, broker_ip, "led/" + mac, mac, version, **options)
         self.brightness = 0
         self.watchdog = 3600
         self.i_max = 0
@@ -33,32 +74,6 @@ class Led(Driver):
         self.auto = False
         self.default_brightness = 20 #default value when the switch is not responding
 
-        self.url_setpoint = self.url_base + "/setpoint"
-        self.url_setpoint_manual = self.url_base + "/setpointManual"
-        self.url_version = self.url_config + "/version"
-        self.url_is_configured = self.url_config + "/isConfigured"
-        self.url_watchdog = self.url_config + "/watchdog"
-        self.url_i_max = self.url_config + "/iMax"
-        self.url_group = self.url_config + "/group"
-        self.url_thresold_low = self.url_config + "/thresoldLow"
-        self.url_thresold_high = self.url_config + "/thresoldHigh"
-        self.url_ble = self.url_config + "/isBleEnabled"
-        self.url_daisy_enabled = self.url_config + "/isDaisyChainEnabled"
-        self.url_daisy_position = self.url_config + "/daisyChainPosition"
-        self.url_device_power = self.url_metric + "/devicePower"
-        self.url_energy = self.url_metric + "/energy"
-        self.url_voltage_led = self.url_metric + "/voltageLed"
-        self.url_voltage_input = self.url_metric + "/voltageInput"
-        self.url_temperature = self.url_metric + "/temperature"
-        self.url_line_power = self.url_metric + "/linePower"
-        self.url_duration = self.url_metric + "/duration"
-        self.url_time_to_auto = self.url_metric + "/timeToAuto"
-        self.url_auto = self.url_status + "/auto"
-        self.url_reset_numbers = self.url_metric + "/resetNumbers"
-        self.url_initial_date = self.url_metric + "/initialSetupDate"
-        self.url_last_reset = self.url_metric + "/lastResetDate"
-
-
     def serialize(self):
         led = {
             "mac": self.mac,
@@ -119,8 +134,7 @@ class Led(Driver):
 
     @error_management
     def setup_configuration(self, client, userdata, message):
-        data = message.payload.decode("utf-8")
-        config = json.loads(data)
+        config = self.codec.decode(message.payload)
         self.i_max = config["iMax"]
         self.group = config.get("group", self.group)
         self.thresold_low = config.get("thresoldLow", self.thresold_low)
@@ -134,7 +148,7 @@ class Led(Driver):
         # Field used for reset to default
         self.is_configured = strtobool(data) == 1
         self.reset_numbers += 1
-        self.last_reset_date = time.time()
+        self.last_reset_date = self.clock.time()
 
     @error_management
     def update_thresold_high(self, client, userdata, message):
@@ -168,6 +182,8 @@ class Led(Driver):
         self.set_brigthness(int(data))
 
     def set_brigthness(self, new_brigthness):
+        if self.tracer:
+            self.tracer.applied(self.mac, new_brigthness)
         if new_brigthness > self.thresold_high:
             new_brigthness = self.thresold_high
         if new_brigthness < 0:
@@ -177,39 +193,30 @@ class Led(Driver):
         self.brightness = new_brigthness
         logger.info("LED %r has now %r", self.mac, self.brightness)
 
-    def run(self):
+    def setup(self):
         self.connect()
-        self.client.message_callback_add("/write/" + self.url_auto, self.update_auto_mode)
-        self.client.message_callback_add("/write/" + self.url_watchdog, self.update_watchdog)
-        self.client.message_callback_add("/write/" + self.url_group, self.update_group)
-        self.client.message_callback_add("/write/" + self.url_initial_setup, self.setup_configuration)
-        self.client.message_callback_add("/write/" + self.url_is_configured, self.update_configuration_status)
-        self.client.message_callback_add("/write/" + self.url_thresold_high, self.update_thresold_high)
-        self.client.message_callback_add("/write/" + self.url_thresold_low, self.update_thresold_low)
-        self.client.message_callback_add("/write/" + self.url_ble, self.enable_ble)
-        self.client.message_callback_add("/write/" + self.url_setpoint, self.update_brigthness_auto)
-        self.client.message_callback_add("/write/" + self.url_setpoint_manual, self.update_brigthness_manual)
-        while self.is_alive:
-            if not self.is_configured:
-                message = {
-                    "mac": self.mac,
-                    "type": "led",
-                    "topic": self.base_topic
-                }
-                self.client.publish("/read/" + self.url_hello, json.dumps(message))
-            else:
-                if self.brightness:
-                    self.duration_seconds += 1
-                if self.duration_seconds == 3600:
-                    self.duration += 1
-                    self.duration_seconds = 0
-
-                if self.time_to_auto <= 0:
-                    # Switch back to automatic mode
-                    self.auto = True
-                    logger.info("Switch %r back to automatic mode", self.mac)
-                if self.time_to_auto:
-                    self.time_to_auto -= 1
-                self.client.publish("/read/" + self.url_dump, json.dumps(self.serialize()))
-            time.sleep(1)
-        self.disconnect()
+        for topic, handler in self.write_handlers:
+            self.client.message_callback_add("/write/" + getattr(self, topic), getattr(self, handler))
+
+    def tick(self):
+        if not self.is_configured:
+            message = {
+                "mac": self.mac,
+                "type": "led",
+                "topic": self.base_topic
+            }
+            self.client.publish("/read/" + self.url_hello, self.codec.encode(message))
+        else:
+            if self.brightness:
+                self.duration_seconds += 1
+            if self.duration_seconds == 3600:
+                self.duration += 1
+                self.duration_seconds = 0
+
+            if self.time_to_auto <= 0:
+                # Switch back to automatic mode
+                self.auto = True
+                logger.info("Switch %r back to automatic mode", self.mac)
+            if self.time_to_auto:
+                self.time_to_auto -= 1
+            self.publish_dump()
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.latency import LatencyHistogram, load_histogram
+from network.recording import recorder
+import paho.mqtt.client as mqtt
+from threading import Lock
+import threading
+import time
+import weakref
+
+# Topic classes of the message counters, by topic suffix
+TOPIC_CLASSES = [
+    ("dump", "/status/dump"),
+    ("hello", "/setup/hello"),
+    ("setup_config", "/setup/config"),
+    ("setpoint", "/base/setpoint"),
+    ("auto", "/status/auto")
+]
+# Upper bounds of the callback duration buckets in seconds
+CALLBACK_BUCKETS = [0.00001, 0.00002, 0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.05, 0.1, 0.5, 1]
+DRIVER_CATEGORIES = [("led", "leds"), ("sensor", "sensors"), ("blind", "blinds")]
+DEVICE_STATES = ["unconfigured", "auto", "manual"]
+
+
+def topic_class(topic):
+    for name, suffix in TOPIC_CLASSES:
+        if topic.endswith(suffix):
+            return name
+    return "other"
+
+
+def handler_name(callback):
+    # Class and method name of the MQTT callbacks
+    callback = getattr(callback, "func", callback)
+    owner = getattr(callback, "__self__", None)
+    name = getattr(callback, "__name__", type(callback).__name__)
+    if owner is None:
+        return name
+    return type(owner).__name__ + "." + name
+
+
+# Process wide counters of the MQTT traffic and the callback durations
+class Metrics(object):
+
+    def __init__(self):
+        self.messages = {"in": {}, "out": {}}
+        self.callbacks = {}
+        # Every MQTT client for the publish queue depth
+        self.clients = weakref.WeakSet()
+        self.lock = Lock()
+
+    def message(self, direction, topic):
+        name = topic_class(topic)
+        counters = self.messages[direction]
+        with self.lock:
+            counters[name] = counters.get(name, 0) + 1
+
+    def callback_time(self, name, seconds):
+        with self.lock:
+            histogram = self.callbacks.get(name)
+            if histogram is None:
+                histogram = self.callbacks[name] = LatencyHistogram(CALLBACK_BUCKETS)
+            histogram.add(seconds)
+
+    def timed(self, callback):
+        # Callback of a paho client recording its duration
+        name = handler_name(callback)
+
+        def timed_callback(client, userdata, message):
+            start = time.perf_counter()
+            try:
+                return callback(client, userdata, message)
+            finally:
+                self.callback_time(name, time.perf_counter() - start)
+        return timed_callback
+
+    def publish_queue(self):
+        # Packets waiting to be written by paho, the attribute is internal to paho
+        depths = [len(getattr(client, "_out_packet", ())) for client in list(self.clients)]
+        return {"depth": sum(depths), "max": max(depths) if depths else 0, "connections": len(depths)}
+
+    def collect(self, switch):
+        with self.lock:
+            messages = {direction: dict(counters) for direction, counters in self.messages.items()}
+            callbacks = {name: histogram.serialize() for name, histogram in self.callbacks.items()}
+        devices = {}
+        for driver_type, category in DRIVER_CATEGORIES:
+            states = devices[driver_type] = dict.fromkeys(DEVICE_STATES, 0)
+            for driver in list(switch.drivers[category].values()):
+                if not driver.is_configured:
+                    states["unconfigured"] += 1
+                elif getattr(driver, "auto", False):
+                    states["auto"] += 1
+                else:
+                    states["manual"] += 1
+        groups = {"auto": 0, "manual": 0}
+        for group in list(switch.groups.values()):
+            groups["auto" if group.auto else "manual"] += 1
+        return {
+            "messages": messages,
+            "callbacks": callbacks,
+            "publishQueue": self.publish_queue(),
+            "threads": threading.active_count(),
+            "devices": devices,
+            "groups": groups,
+            "commands": switch.tracer.serialize()["commands"]
+        }
+
+
+metrics = Metrics()
+
+
+# paho client counting its messages
+class MeteredClient(mqtt.Client):
+
+    def __init__(self, *args, **kwargs):
+        mqtt.Client.__init__(self, *args, **kwargs)
+        metrics.clients.add(self)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        metrics.message("out", topic)
+        if recorder.active:
+            recorder.record("out", topic, payload)
+        return mqtt.Client.publish(self, topic, payload, qos, retain, properties)
+
+    def message_callback_add(self, sub, callback):
+        mqtt.Client.message_callback_add(self, sub, metrics.timed(callback))
+
+    def _handle_on_message(self, message):
+        # paho internal dispatch of the received messages to the callbacks
+        metrics.message("in", message.topic)
+        if recorder.active:
+            recorder.record("in", message.topic, message.payload)
+        mqtt.Client._handle_on_message(self, message)
+
+
+def add_counts(left, right):
+    merged = dict(left)
+    for key, value in right.items():
+        if isinstance(value, dict):
+            merged[key] = add_counts(left.get(key, {}), value)
+        else:
+            merged[key] = left.get(key, 0) + value
+    return merged
+
+
+def merge_histograms(left, right):
+    merged = {}
+    for name in set(left) | set(right):
+        histograms = [load_histogram(data) for data in [left.get(name), right.get(name)] if data]
+        for histogram in histograms[1:]:
+            histograms[0].merge(histogram)
+        merged[name] = histograms[0].serialize()
+        pending = [data["pending"] for data in [left.get(name), right.get(name)] if data and "pending" in data]
+        if pending:
+            merged[name]["pending"] = sum(pending)
+    return merged
+
+
+def merge_metrics(snapshots):
+    # Metrics of the shard processes
+    merged = snapshots[0]
+    for snapshot in snapshots[1:]:
+        queue = add_counts(merged["publishQueue"], snapshot["publishQueue"])
+        queue["max"] = max(merged["publishQueue"]["max"], snapshot["publishQueue"]["max"])
+        merged = {
+            "messages": add_counts(merged["messages"], snapshot["messages"]),
+            "callbacks": merge_histograms(merged["callbacks"], snapshot["callbacks"]),
+            "publishQueue": queue,
+            "threads": merged["threads"] + snapshot["threads"],
+            "devices": add_counts(merged["devices"], snapshot["devices"]),
+            "groups": add_counts(merged["groups"], snapshot["groups"]),
+            "commands": merge_histograms(merged["commands"], snapshot["commands"])
+        }
+    return merged
+
+
+def labels(values):
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in values) + "}"
+
+
+def bound(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def render_histogram(lines, name, label, histograms):
+    for key, data in sorted(histograms.items()):
+        for bucket in data["buckets"]:
+            lines.append(name + "_bucket" + labels([(label, key), ("le", bound(bucket["le"]))]) + " " +
+                         str(bucket["count"]))
+        lines.append(name + "_sum" + labels([(label, key)]) + " " + repr(float(data["sum"])))
+        lines.append(name + "_count" + labels([(label, key)]) + " " + str(data["count"]))
+
+
+def render_metrics(snapshot):
+    # Prometheus text exposition format
+    lines = [
+        "# HELP simulator_mqtt_messages_total MQTT messages sent (out) and received (in) by topic class",
+        "# TYPE simulator_mqtt_messages_total counter"
+    ]
+    for direction, counters in sorted(snapshot["messages"].items()):
+        for name, count in sorted(counters.items()):
+            lines.append("simulator_mqtt_messages_total" + labels([("direction", direction), ("topic", name)]) +
+                         " " + str(count))
+    lines += [
+        "# HELP simulator_callback_seconds Duration of the MQTT message callbacks by handler",
+        "# TYPE simulator_callback_seconds histogram"
+    ]
+    render_histogram(lines, "simulator_callback_seconds", "handler", snapshot["callbacks"])
+    lines += [
+        "# HELP simulator_publish_queue_depth MQTT packets waiting to be sent",
+        "# TYPE simulator_publish_queue_depth gauge",
+        "simulator_publish_queue_depth " + str(snapshot["publishQueue"]["depth"]),
+        "# HELP simulator_publish_queue_max_depth Largest publish queue of one MQTT connection",
+        "# TYPE simulator_publish_queue_max_depth gauge",
+        "simulator_publish_queue_max_depth " + str(snapshot["publishQueue"]["max"]),
+        "# HELP simulator_mqtt_connections Open MQTT clients",
+        "# TYPE simulator_mqtt_connections gauge",
+        "simulator_mqtt_connections " + str(snapshot["publishQueue"]["connections"]),
+        "# HELP simulator_threads Live threads",
+        "# TYPE simulator_threads gauge",
+        "simulator_threads " + str(snapshot["threads"]),
+        "# HELP simulator_devices Drivers by type and state",
+        "# TYPE simulator_devices gauge"
+    ]
+    for driver_type, states in sorted(snapshot["devices"].items()):
+        for state, count in sorted(states.items()):
+            lines.append("simulator_devices" + labels([("type", driver_type), ("state", state)]) + " " + str(count))
+    lines += [
+        "# HELP simulator_groups Groups by mode",
+        "# TYPE simulator_groups gauge"
+    ]
+    for state, count in sorted(snapshot["groups"].items()):
+        lines.append("simulator_groups" + labels([("state", state)]) + " " + str(count))
+    lines += [
+        "# HELP simulator_command_latency_seconds Latency from a switch command to its application by the leds",
+        "# TYPE simulator_command_latency_seconds histogram"
+    ]
+    render_histogram(lines, "simulator_command_latency_seconds", "command", snapshot["commands"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Lock
+import time
+
+SORT_KEYS = ["total", "max", "mean", "calls", "errors"]
+
+
+# Call count, cumulative and max wall time of the MQTT handlers wrapped by error_management.
+# Off by default: the handlers only pay for the enabled check.
+class HandlerProfiler(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.since = None
+        # Handler name: [calls, total seconds, max seconds, errors]
+        self.handlers = {}
+        self.lock = Lock()
+
+    def enable(self, enabled=True):
+        with self.lock:
+            if enabled and not self.enabled:
+                self.since = time.time()
+            self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.handlers = {}
+            self.since = time.time() if self.enabled else None
+
+    def record(self, name, seconds, failed=False):
+        with self.lock:
+            stats = self.handlers.get(name)
+            if stats is None:
+                stats = self.handlers[name] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+            if failed:
+                stats[3] += 1
+
+    def report(self, top=20, sort="total"):
+        with self.lock:
+            handlers = [{
+                "handler": name,
+                "calls": calls,
+                "total": total,
+                "mean": total / calls if calls else 0,
+                "max": maximum,
+                "errors": errors
+            } for name, (calls, total, maximum, errors) in self.handlers.items()]
+        return {
+            "enabled": self.enabled,
+            "since": self.since,
+            "handlers": top_handlers(handlers, top, sort)
+        }
+
+
+def top_handlers(handlers, top=20, sort="total"):
+    # top 0 keeps all the handlers
+    handlers = sorted(handlers, key=lambda handler: handler[sort], reverse=True)
+    return handlers[:top] if top else handlers
+
+
+def merge_reports(reports, top=20, sort="total"):
+    # Reports of the shard processes
+    merged = {}
+    for report in reports:
+        for handler in report["handlers"]:
+            current = merged.get(handler["handler"])
+            if current is None:
+                merged[handler["handler"]] = dict(handler)
+                continue
+            for key in ["calls", "total", "errors"]:
+                current[key] += handler[key]
+            current["max"] = max(current["max"], handler["max"])
+            current["mean"] = current["total"] / current["calls"] if current["calls"] else 0
+    starts = [report["since"] for report in reports if report["since"] is not None]
+    return {
+        "enabled": any(report["enabled"] for report in reports),
+        "since": min(starts) if starts else None,
+        "handlers": top_handlers(list(merged.values()), top, sort)
+    }
+
+
+profiler = HandlerProfiler()
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.codec import encode_payload
+from threading import Lock
+from log import logger
+import struct
+import time
+
+# Traffic recording file: the magic then the records, each one a header (date, direction,
+# topic size, payload size) followed by the topic and the payload. Records are only appended.
+MAGIC = b"SOLREC1\n"
+HEADER = struct.Struct(">dBHI")
+DIRECTIONS = ["in", "out"]
+
+
+# Append every MQTT message published (out) and received (in) by the simulator to a recording file
+class TrafficRecorder(object):
+
+    def __init__(self):
+        self.active = False
+        self.file = None
+        self.path = None
+        self.records = 0
+        self.size = 0
+        self.since = None
+        self.lock = Lock()
+
+    def start(self, path):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            # A new recording is appended to an existing file
+            self.file = open(path, "ab")
+            if self.file.tell() == 0:
+                self.file.write(MAGIC)
+            self.path = path
+            self.records = 0
+            self.size = 0
+            self.since = time.time()
+            self.active = True
+        logger.info("Recording the MQTT traffic into %r", path)
+
+    def stop(self):
+        with self.lock:
+            self.active = False
+            if self.file is not None:
+                self.file.close()
+            self.file = None
+        logger.info("Recording stopped: %r messages in %r", self.records, self.path)
+
+    def record(self, direction, topic, payload):
+        topic = topic.encode("utf-8")
+        payload = encode_payload(payload)
+        data = HEADER.pack(time.time(), DIRECTIONS.index(direction), len(topic), len(payload)) + topic + payload
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(data)
+            self.records += 1
+            self.size += len(data)
+
+    def serialize(self):
+        return {
+            "recording": self.active,
+            "file": self.path,
+            "records": self.records,
+            "bytes": self.size,
+            "since": self.since
+        }
+
+
+recorder = TrafficRecorder()
+
+
+def read_records(path):
+    # Records of a recording file one by one: (date, direction, topic, payload)
+    with open(path, "rb") as stream:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a traffic recording")
+        while True:
+            header = stream.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            date, direction, topic_size, payload_size = HEADER.unpack(header)
+            body = stream.read(topic_size + payload_size)
+            if len(body) < topic_size + payload_size:
+                # Last record cut by the end of the recording process
+                return
+            yield date, DIRECTIONS[direction], body[:topic_size].decode("utf-8"), body[topic_size:]
+
+
+# Publish recorded messages again with their original spacing divided by speed (0 = as fast as possible).
+# Pauses longer than max_gap seconds are shortened to max_gap (0 = kept).
+class TrafficReplayer(object):
+
+    def __init__(self, client, speed=1, directions=("out",), max_gap=0):
+        self.client = client
+        self.speed = speed
+        self.directions = directions
+        self.max_gap = max_gap
+        self.messages = 0
+        self.size = 0
+        self.lag = 0
+        self.span = 0
+        self.elapsed = 0
+
+    def run(self, records):
+        start = time.time()
+        first = previous = None
+        offset = 0
+        info = None
+        try:
+            for date, direction, topic, payload in records:
+                if direction not in self.directions:
+                    continue
+                if first is None:
+                    first = previous = date
+                if self.max_gap and date - previous > self.max_gap:
+                    offset += date - previous - self.max_gap
+                previous = date
+                self.span = date - first - offset
+                if self.speed > 0:
+                    delay = start + self.span / self.speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        self.lag = max(self.lag, -delay)
+                info = self.client.publish(topic, payload)
+                self.messages += 1
+                self.size += len(payload)
+            if info is not None:
+                # Everything is sent once the last message is
+                info.wait_for_publish()
+        finally:
+            self.elapsed = time.time() - start
+        return self.report()
+
+    def report(self):
+        return {
+            "messages": self.messages,
+            "bytes": self.size,
+            "recordedSeconds": self.span,
+            "elapsed": self.elapsed,
+            "rate": self.messages / self.elapsed if self.elapsed > 0 else 0,
+            "speedup": self.span / self.elapsed if self.elapsed > 0 else 0,
+            "maxLag": self.lag
+        }
+
+
+def merge_recordings(states):
+    # Recording states of the shard processes, each one with its own file
+    starts = [state["since"] for state in states if state["since"] is not None]
+    return {
+        "recording": any(state["recording"] for state in states),
+        "file": [state["file"] for state in states],
+        "records": sum(state["records"] for state in states),
+        "bytes": sum(state["bytes"] for state in states),
+        "since": min(starts) if starts else None
+    }
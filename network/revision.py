@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Lock
+
+
+# Global state version, bumped on every mutation of a driver, a group or the switch content.
+# Bumped by the device, pool and API threads: last never goes backwards.
+class RevisionCounter(object):
+
+    def __init__(self):
+        self.last = 0
+        self.lock = Lock()
+
+    def next(self):
+        with self.lock:
+            self.last += 1
+            return self.last
+
+
+revisions = RevisionCounter()
+
+
+# Entity getting a new revision each time one of its public attributes changes.
+# The attributes listed in unversioned are internal and do not change the serialized state.
+class Versioned(object):
+
+    unversioned = frozenset()
+    revision = 0
+
+    def __setattr__(self, name, value):
+        changed = name[0] != "_" and name not in self.unversioned and \
+            (name not in self.__dict__ or self.__dict__[name] != value)
+        object.__setattr__(self, name, value)
+        # The value is set first so that a reader never caches the old value with the new revision
+        if changed:
+            object.__setattr__(self, "revision", revisions.next())
+
+    def touch(self):
+        object.__setattr__(self, "revision", revisions.next())
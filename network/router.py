@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Lock
+
+
+class RouteNode(object):
+
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+# Topic trie dispatching a topic to the handlers of the matching MQTT filters.
+# Filters may contain the + (one level) and # (remaining levels) wildcards.
+class TopicRouter(object):
+
+    def __init__(self):
+        self.root = RouteNode()
+        self.lock = Lock()
+
+    def add(self, topic_filter, handler):
+        with self.lock:
+            node = self.root
+            for level in topic_filter.split("/"):
+                child = node.children.get(level)
+                if child is None:
+                    child = RouteNode()
+                    node.children[level] = child
+                node = child
+            node.handlers.append(handler)
+
+    def remove(self, topic_filter, handler=None):
+        with self.lock:
+            path = []
+            node = self.root
+            for level in topic_filter.split("/"):
+                child = node.children.get(level)
+                if child is None:
+                    return
+                path.append((node, level))
+                node = child
+            if handler is None:
+                node.handlers = []
+            elif handler in node.handlers:
+                node.handlers.remove(handler)
+            # Prune the empty branches
+            while path and not node.handlers and not node.children:
+                parent, level = path.pop()
+                del parent.children[level]
+                node = parent
+
+    def match(self, topic):
+        handlers = []
+        self.walk(self.root, topic.split("/"), 0, handlers)
+        return handlers
+
+    def walk(self, node, levels, index, handlers):
+        wildcard = node.children.get("#")
+        if wildcard is not None:
+            handlers.extend(wildcard.handlers)
+        if index == len(levels):
+            handlers.extend(node.handlers)
+            return
+        child = node.children.get(levels[index])
+        if child is not None:
+            self.walk(child, levels, index + 1, handlers)
+        child = node.children.get("+")
+        if child is not None:
+            self.walk(child, levels, index + 1, handlers)
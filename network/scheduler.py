@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Thread, Condition
+from queue import Queue
+from network.clock import Clock
+from log import logger
+import heapq
+import itertools
+import math
+
+
+# Central timer heap calling tick() on every registered entity once per period.
+# All the deadlines are aligned on the same origin so that entities tick in phase.
+# With a lockstep clock, time jumps to the next deadline once all the ticks are done.
+class Scheduler(object):
+
+    def __init__(self, period=1, workers=4, clock=None):
+        self.period = period
+        self.workers = max(1, workers)
+        self.clock = clock or Clock()
+        self.origin = self.clock.time()
+        self.heap = []
+        self.sequence = itertools.count()
+        # Token of every registered entity: the heap entries of a removed entity are left in the heap
+        # and skipped, also when it is added again (with a new token)
+        self.entities = {}
+        self.running = set()
+        self.condition = Condition()
+        self.jobs = Queue()
+        self.threads = []
+        self.is_running = False
+
+    def start(self):
+        self.is_running = True
+        timer = Thread(target=self.dispatch, name="SchedulerTimer", daemon=True)
+        self.threads.append(timer)
+        for index in range(self.workers):
+            worker = Thread(target=self.work, name="SchedulerWorker" + str(index), daemon=True)
+            self.threads.append(worker)
+        for thread in self.threads:
+            thread.start()
+        logger.info("Scheduler started with %r workers", self.workers)
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        for _ in range(self.workers):
+            self.jobs.put(None)
+
+    def next_deadline(self, now):
+        slots = math.ceil((now - self.origin) / self.period)
+        return self.origin + slots * self.period
+
+    def add(self, entity):
+        with self.condition:
+            token = self.entities[entity] = next(self.sequence)
+            heapq.heappush(self.heap, (self.next_deadline(self.clock.time()), next(self.sequence), entity, token))
+            self.condition.notify()
+
+    def remove(self, entity):
+        with self.condition:
+            self.entities.pop(entity, None)
+
+    def dispatch(self):
+        while True:
+            with self.condition:
+                while self.is_running:
+                    if self.heap:
+                        deadline = self.heap[0][0]
+                        if deadline <= self.clock.time():
+                            break
+                        if not self.clock.lockstep:
+                            self.clock.wait(self.condition, deadline - self.clock.time())
+                        elif self.running:
+                            # Wait for the current ticks before moving time forward
+                            self.condition.wait()
+                        else:
+                            self.clock.advance(deadline)
+                            break
+                    else:
+                        self.condition.wait()
+                if not self.is_running:
+                    return
+                deadline = self.heap[0][0]
+                while self.heap and self.heap[0][0] <= deadline:
+                    _, _, entity, token = heapq.heappop(self.heap)
+                    if self.entities.get(entity) != token:
+                        continue
+                    heapq.heappush(self.heap, (deadline + self.period, next(self.sequence), entity, token))
+                    if entity in self.running:
+                        logger.warning("%r is still running its previous tick, skip it", entity)
+                        continue
+                    self.running.add(entity)
+                    self.jobs.put(entity)
+
+    def work(self):
+        while True:
+            entity = self.jobs.get()
+            if entity is None:
+                return
+            try:
+                entity.tick()
+            except:
+                logger.exception("Tick failed for %r", entity)
+            finally:
+                with self.condition:
+                    self.running.discard(entity)
+                    if not self.running:
+                        self.condition.notify()
@@ -3,7 +3,8 @@
 
 import paho.mqtt.client as mqtt
 
-from network.driver import Driver, error_management
+from network.driver import Driver, Topic, error_management
+from threading import RLock
 import time
 import json
 from log import logger
@@ -11,8 +12,28 @@ from distutils.util import strtobool
 
 class Sensor(Driver):
 
-    def __init__(self, broker_ip, mac, version):
-        Driver.__init__(self, broker_ip, "sensor/" + mac, mac, version)
+    unversioned = Driver.unversioned | frozenset(["old_presence", "lock"])
+
+    url_temperature = Topic("/base/temperature")
+    url_brightness = Topic("/base/brightness")
+    url_presence = Topic("/base/presence")
+    url_brightness_correction_factor = Topic("/config/brightnessCorrectionFactor")
+    url_version = Topic("/config/version")
+    url_is_configured = Topic("/config/isConfigured")
+    url_thresold_presence = Topic("/config/thresoldPresence")
+    url_group = Topic("/config/group")
+    url_temperature_offset = Topic("/config/temperatureOffset")
+    url_brightness_raw = Topic("/metric/brightnessRaw")
+    url_last_movment = Topic("/metric/lastMovment")
+    url_voltage_input = Topic("/metric/voltageInput")
+    url_temperature_raw = Topic("/metric/temperatureRaw")
+    url_ble = Topic("/config/isBleEnabled")
+    url_reset_numbers = Topic("/metric/resetNumbers")
+    url_initial_date = Topic("/metric/initialSetupDate")
+    url_last_reset = Topic("/metric/lastResetDate")
+
+    def __init__(self, broker_ip, mac, version, **options):
+        Driver.__init__(self, broker_ip, "sensor/" + mac, mac, version, **options)
         self.presence = False
         self.old_presence = False
         self.brightness_correction_factor = 1
@@ -21,24 +42,7 @@ class Sensor(Driver):
         self.brightness_raw = 0
         self.last_movment = 0
         self.temperature_raw = 0
-
-        self.url_temperature = self.url_base + "/temperature"
-        self.url_brightness = self.url_base + "/brightness"
-        self.url_presence = self.url_base + "/presence"
-        self.url_brightness_correction_factor = self.url_config + "/brightnessCorrectionFactor"
-        self.url_version = self.url_config + "/version"
-        self.url_is_configured = self.url_config + "/isConfigured"
-        self.url_thresold_presence = self.url_config + "/thresoldPresence"
-        self.url_group = self.url_config + "/group"
-        self.url_temperature_offset = self.url_config + "/temperatureOffset"
-        self.url_brightness_raw = self.url_metric + "/brightnessRaw"
-        self.url_last_movment = self.url_metric + "/lastMovment"
-        self.url_voltage_input = self.url_metric + "/voltageInput"
-        self.url_temperature_raw = self.url_metric + "/temperatureRaw"
-        self.url_ble = self.url_config + "/isBleEnabled"
-        self.url_reset_numbers = self.url_metric + "/resetNumbers"
-        self.url_initial_date = self.url_metric + "/initialSetupDate"
-        self.url_last_reset = self.url_metric + "/lastResetDate"
+        self.lock = RLock()
 
     def serialize(self):
         sensor = {
@@ -67,8 +71,7 @@ class Sensor(Driver):
 
     @error_management
     def setup_configuration(self, client, userdata, message):
-        data = message.payload.decode("utf-8")
-        config = json.loads(data)
+        config = self.codec.decode(message.payload)
         logger.info("Not yet implemented setup_configuration for sensor %r", config)
         self.is_configured = True
 
@@ -83,7 +86,7 @@ class Sensor(Driver):
         # Field used for reset to default
         self.is_configured = strtobool(data) == 1
         self.reset_numbers += 1
-        self.last_reset_date = time.time()
+        self.last_reset_date = self.clock.time()
 
     @error_management
     def enable_ble(self, client, userdata, message):
@@ -105,7 +108,7 @@ class Sensor(Driver):
         data = message.payload.decode("utf-8")
         self.temperature_offset = int(data)
 
-    def run(self):
+    def setup(self):
         self.connect()
         self.client.message_callback_add("/write/" + self.url_initial_setup, self.setup_configuration)
         self.client.message_callback_add("/write/" + self.url_brightness_correction_factor,
@@ -117,14 +120,17 @@ class Sensor(Driver):
         self.client.message_callback_add("/write/" + self.url_temperature_offset,
                                          self.update_temperature_offset)
         self.client.message_callback_add("/write/" + self.url_ble, self.enable_ble)
-        while self.is_alive:
+
+    def tick(self):
+        # The stimulus thread sets the inputs and publishes the dump between the ticks
+        with self.lock:
             if not self.is_configured:
                 message = {
                     "mac": self.mac,
                     "type": "sensor",
                     "topic": self.base_topic
                 }
-                self.client.publish("/read/" + self.url_hello, json.dumps(message))
+                self.client.publish("/read/" + self.url_hello, self.codec.encode(message))
             else:
                 if self.presence != self.old_presence:
                    # Start last_movement counts
@@ -135,6 +141,4 @@ class Sensor(Driver):
                 if self.last_movment == self.thresold_presence:
                    # End detection
                    self.presence = False
-                self.client.publish("/read/" + self.url_dump, json.dumps(self.serialize()))
-            time.sleep(1)
-        self.disconnect()
+                self.publish_dump()
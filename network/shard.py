@@ -0,0 +1,404 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.switch import CATEGORIES
+from network.latency import merge_latencies
+from network.metrics import merge_metrics
+from network.profiler import merge_reports
+from network.recording import merge_recordings
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from log import logger
+import itertools
+import json
+import zlib
+
+DRIVER_TYPES = ["led", "sensor", "blind"]
+
+
+def shard_of_mac(mac, count):
+    return zlib.crc32(mac.encode("utf-8")) % count
+
+
+def shard_of_group(group_id, count):
+    return group_id % count
+
+
+def parse_group(group_id):
+    # Group number of a JSON body or of a query string, None when it is not an integer
+    if isinstance(group_id, int) and not isinstance(group_id, bool):
+        return group_id
+    if not isinstance(group_id, str):
+        return None
+    try:
+        return int(group_id)
+    except ValueError:
+        return None
+
+
+# Shard side: execute the commands received from the coordinator until the pipe is closed.
+# handlers maps a command name to a function, its result is sent back.
+def serve_shard(connection, handlers):
+    while True:
+        try:
+            command, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            answer = (True, handlers[command](*args))
+        except Exception as error:
+            logger.exception("Shard command %r failed", command)
+            answer = (False, str(error))
+        connection.send(answer)
+
+
+# Coordinator side of one shard process
+class ShardClient(object):
+
+    def __init__(self, index, process, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.lock = Lock()
+
+    def call(self, command, *args):
+        with self.lock:
+            self.connection.send((command, args))
+            success, result = self.connection.recv()
+        if not success:
+            raise RuntimeError("Shard " + str(self.index) + ": " + result)
+        return result
+
+    def request(self, method, path, args=None, body=None):
+        # Returns the status code and the decoded JSON answer of the shard API
+        status, data, _ = self.call("request", method, path, args or {}, body)
+        return status, json.loads(data) if data else None
+
+    def conditional(self, path, etag):
+        # GET answering 304 without body when the shard ETag is still etag, also returns the ETag
+        headers = {"If-None-Match": '"' + etag + '"'} if etag else {}
+        status, data, etag = self.call("request", "GET", path, {}, None, headers)
+        return status, json.loads(data) if data else None, etag
+
+
+# Fleet partitioned across shard processes, each one with its own switch, drivers and groups.
+# A group and its members live on shard group % count, the drivers without group on the shard of
+# their mac hash (or the next shard in turn when the mac is chosen by the shard). A driver added
+# to a group of another shard is moved there.
+# route() forwards an API request to the owning shard or merges the answers of all the shards.
+class ShardCoordinator(object):
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.count = len(shards)
+        self.owners = {}
+        self.lock = Lock()
+        self.turn = itertools.count()
+        self.executor = ThreadPoolExecutor(self.count)
+        # Last /v1/switch listing of every shard and its ETag: only the changed ones are sent again
+        self.listings = [(None, None) for _ in shards]
+        self.listings_lock = Lock()
+
+    def broadcast(self, method, path, args=None, body=None):
+        return list(self.executor.map(lambda shard: shard.request(method, path, args, body), self.shards))
+
+    def owner(self, mac):
+        with self.lock:
+            index = self.owners.get(mac)
+        if index is not None:
+            return index
+        # Drivers created by the shards themselves (topology) are looked up once
+        found = self.executor.map(lambda shard: shard.call("has_driver", mac), self.shards)
+        for index, present in enumerate(found):
+            if present:
+                self.learn([mac], index)
+                return index
+        return None
+
+    def learn(self, macs, index):
+        with self.lock:
+            for mac in macs:
+                self.owners[mac] = index
+
+    def forget(self, mac):
+        with self.lock:
+            self.owners.pop(mac, None)
+
+    def move(self, mac, index):
+        # Unplug the driver from its shard and plug it again with the same mac and state into shard index
+        current = self.owner(mac)
+        if current is None or current == index:
+            return None
+        moved = self.shards[current].call("unplug_driver", mac)
+        if not moved:
+            return "Driver " + mac + " already associate to a group"
+        driver_type, state = moved
+        self.forget(mac)
+        status, answer = self.shards[index].request("POST", "/v1/" + driver_type + "/bulk", body={"macs": [mac]})
+        if status != 200:
+            return answer["Message"]
+        self.shards[index].call("restore_driver", mac, state)
+        self.learn([mac], index)
+        logger.info("Driver %r moved from shard %r to shard %r", mac, current, index)
+        return None
+
+    def route(self, method, path, args, body):
+        body = body or {}
+        if path == "/v1/switch/stream":
+            return 400, {"Message": "The state stream is not available with shards"}
+        if path == "/v1/switch":
+            if args:
+                return self.query(args)
+            return self.listing()
+        if path == "/v1/switch/diagnostic":
+            return self.diagnostic()
+        if path == "/v1/switch/diagnostic/events":
+            return self.events(args)
+        if path == "/v1/switch/latency":
+            return 200, merge_latencies([answer for _, answer in self.broadcast(method, path, args)])
+        if path == "/v1/switch/latency/reset":
+            self.broadcast(method, path, args, body)
+            return 200, {}
+        if path == "/v1/debug/profiler":
+            return self.profiler(method, args, body)
+        if path.startswith("/v1/record"):
+            return self.recording(method, path, args, body)
+        if path == "/v1/debug/codec":
+            return 200, merge_counters([answer for _, answer in self.broadcast(method, path, args)])
+        if path == "/v1/stimulus" and method == "GET":
+            answers = self.broadcast(method, path, args)
+            return 200, {"stimuli": [stimulus for _, answer in answers for stimulus in answer["stimuli"]]}
+        if path == "/v1/stimulus/stop":
+            # The stimulus ids are random: only its shard knows it
+            answers = self.broadcast(method, path, args, body)
+            return next((answer for answer in answers if answer[0] == 200), answers[0])
+        if path == "/v1/stimulus" and "group" not in body:
+            if not body.get("sensors"):
+                return 400, {"Message": "A stimulus needs a group or a list of sensors with shards"}
+            index = self.owner(body["sensors"][0])
+            if index is None:
+                return 400, {"Message": "Unknow sensor " + body["sensors"][0]}
+            return self.shards[index].request(method, path, args, body)
+        if path == "/v1/group/statistics" and "group" not in args:
+            answers = self.broadcast(method, path, args)
+            return 200, {"groups": [group for _, answer in answers for group in answer["groups"]]}
+        fields = path.split("/")
+        if len(fields) == 4 and fields[2] in DRIVER_TYPES and fields[3] == "new":
+            return self.create(next(self.turn) % self.count, method, path, args, body, fields[2])
+        if len(fields) == 4 and fields[3] == "bulk":
+            return self.bulk(fields[2], method, path, args, body)
+        group_id = body.get("group", args.get("group"))
+        if group_id is not None and parse_group(group_id) is None:
+            return 400, {"Message": "Invalid group " + str(group_id)}
+        if path == "/v1/group/new":
+            index = shard_of_group(parse_group(body.get("group", 0)), self.count)
+            for key in ["leds", "sensors", "blinds"]:
+                for mac in body.get(key, []):
+                    error = self.move(mac, index)
+                    if error:
+                        return 400, {"Message": error}
+            return self.shards[index].request(method, path, args, body)
+        if path == "/v1/group/add":
+            index = shard_of_group(parse_group(body.get("group", 0)), self.count)
+            error = self.move(body.get("mac", ""), index)
+            if error:
+                return 400, {"Message": error}
+            return self.shards[index].request(method, path, args, body)
+        if group_id is not None:
+            return self.shards[shard_of_group(parse_group(group_id), self.count)].request(method, path, args, body)
+        if "mac" in body:
+            index = self.owner(body["mac"])
+            if index is None:
+                return 400, {"Message": "Unknow driver " + body["mac"]}
+            return self.shards[index].request(method, path, args, body)
+        return self.shards[0].request(method, path, args, body)
+
+    def create(self, index, method, path, args, body, driver_type):
+        status, answer = self.shards[index].request(method, path, args, body)
+        if status == 200:
+            self.learn([answer["mac"]], index)
+        return status, answer
+
+    def bulk(self, driver_type, method, path, args, body):
+        if driver_type not in DRIVER_TYPES:
+            return 400, {"Message": "Unknow driver type " + driver_type}
+        group_id = body.get("group", 0)
+        macs = body.get("macs", [])
+        count = body.get("count", 0)
+        if not isinstance(group_id, int) or not isinstance(macs, list) or not isinstance(count, int) or \
+                not all(isinstance(mac, str) for mac in macs):
+            # Invalid payload: the shard answers the error
+            return self.shards[0].request(method, path, args, body)
+        if group_id:
+            index = shard_of_group(group_id, self.count)
+            return self.collect(driver_type, [(index, self.shards[index].request(method, path, args, body))])
+        for mac in macs:
+            if self.owner(mac) is not None:
+                return 400, {"Message": "Driver " + mac + " already exists"}
+        if macs:
+            parts = [[] for _ in self.shards]
+            for mac in macs:
+                parts[shard_of_mac(mac, self.count)].append(mac)
+            bodies = [dict(body, macs=part, count=len(part)) if part else None for part in parts]
+        else:
+            if count < 1:
+                return self.shards[0].request(method, path, args, body)
+            shares = [count // self.count + (1 if index < count % self.count else 0) for index in range(self.count)]
+            bodies = [dict(body, count=share) if share else None for share in shares]
+        requests = [(index, part) for index, part in enumerate(bodies) if part is not None]
+        answers = self.executor.map(lambda request: self.shards[request[0]].request(method, path, args, request[1]),
+                                    requests)
+        return self.collect(driver_type, [(index, answer) for (index, _), answer in zip(requests, answers)])
+
+    def collect(self, driver_type, answers):
+        drivers = []
+        for index, (status, answer) in answers:
+            if status != 200:
+                return status, answer
+            self.learn([driver["mac"] for driver in answer[driver_type + "s"]], index)
+            drivers += answer[driver_type + "s"]
+        return 200, {driver_type + "s": drivers}
+
+    def listing(self):
+        return self.conditional_listing(None)[:2]
+
+    def conditional_listing(self, if_none_match):
+        # The global ETag is made of the shard ones: the listing is not modified when none of them changed.
+        # Returns the status, the merged listing (None when not modified) and the global ETag.
+        # Concurrent listings each work on their own copy: a 304 stands for the listing this one sent the ETag of
+        with self.listings_lock:
+            listings = list(self.listings)
+        answers = list(self.executor.map(lambda shard: shard.conditional("/v1/switch", listings[shard.index][0]),
+                                         self.shards))
+        for index, (status, answer, etag) in enumerate(answers):
+            if status == 200:
+                listings[index] = (etag, answer)
+            elif status != 304:
+                return status, answer, None
+        with self.listings_lock:
+            self.listings = listings
+        etag = ".".join(etag for etag, _ in listings)
+        if if_none_match is not None and if_none_match.contains(etag):
+            return 304, None, etag
+        merged = {category: [] for category in CATEGORIES}
+        for _, answer in listings:
+            for category in CATEGORIES:
+                merged[category] += answer.get(category, [])
+        return 200, merged, etag
+
+    def query(self, args):
+        # Every shard returns its first page after the cursor: the global page is the first items of their union
+        limit = int(args.get("limit", 100))
+        shard_args = dict(args)
+        if "fields" in args:
+            shard_args["fields"] = args["fields"] + ",mac,group"
+        answers = self.broadcast("GET", "/v1/switch", shard_args)
+        for status, answer in answers:
+            if status != 200:
+                return status, answer
+        items = []
+        for _, answer in answers:
+            for category in CATEGORIES:
+                for item in answer.get(category, []):
+                    key = item["group"] if category == "groups" else item["mac"]
+                    items.append((CATEGORIES.index(category), key, category, item))
+        items.sort(key=lambda entry: entry[:2])
+        more = len(items) > limit or any(answer["cursor"] for _, answer in answers)
+        items = items[:limit]
+        merged = {"cursor": None}
+        for category in CATEGORIES:
+            if any(category in answer for _, answer in answers):
+                merged[category] = []
+        requested = args["fields"].split(",") if "fields" in args else None
+        for _, key, category, item in items:
+            if requested:
+                item = {field: item[field] for field in requested if field in item}
+            merged[category].append(item)
+        if more and items:
+            merged["cursor"] = items[-1][2] + ":" + str(items[-1][1])
+        return 200, merged
+
+    def profiler(self, method, args, body):
+        if method == "POST":
+            answers = self.broadcast(method, "/v1/debug/profiler", args, body)
+        else:
+            # Every handler of every shard, the top ones are chosen once merged
+            answers = self.broadcast(method, "/v1/debug/profiler", dict(args, top="0"), body)
+        for status, answer in answers:
+            if status != 200:
+                return status, answer
+        top = int(args["top"]) if args.get("top", "").isdigit() else 20
+        return 200, merge_reports([answer for _, answer in answers], top, args.get("sort", "total"))
+
+    def recording(self, method, path, args, body):
+        if path == "/v1/record" and method == "POST" and body.get("file"):
+            # One recording file per shard
+            answers = list(self.executor.map(
+                lambda shard: shard.request(method, path, args, dict(body, file=body["file"] + "." + str(shard.index))),
+                self.shards))
+        else:
+            answers = self.broadcast(method, path, args, body)
+        for status, answer in answers:
+            if status != 200:
+                return status, answer
+        return 200, merge_recordings([answer for _, answer in answers])
+
+    def metrics(self):
+        return merge_metrics(list(self.executor.map(lambda shard: shard.call("metrics"), self.shards)))
+
+    def global_event(self, event, index):
+        # Event ids are only consecutive inside a shard: id * count + shard is unique and ordered per shard
+        return dict(event, id=event["id"] * self.count + index)
+
+    def diagnostic(self):
+        answers = self.broadcast("GET", "/v1/switch/diagnostic")
+        config = dict(answers[0][1]["config"])
+        config["groups"] = [group for _, answer in answers for group in answer["config"].get("groups", [])]
+        events = [self.global_event(event, index) for index, (_, answer) in enumerate(answers)
+                  for event in answer["events"]]
+        events.sort(key=lambda event: event["date"])
+        return 200, {"config": config, "events": events[-100:]}
+
+    def events(self, args):
+        cursor = int(args.get("cursor", 0))
+        limit = int(args.get("limit", 100))
+        requests = []
+        for index in range(self.count):
+            shard_args = dict(args)
+            shard_args["cursor"] = max(0, (cursor - index) // self.count) if cursor else 0
+            requests.append((index, shard_args))
+        answers = list(self.executor.map(
+            lambda request: self.shards[request[0]].request("GET", "/v1/switch/diagnostic/events", request[1]),
+            requests))
+        for status, answer in answers:
+            if status != 200:
+                return status, answer
+        events = [self.global_event(event, index) for index, (_, answer) in enumerate(answers)
+                  for event in answer["events"]]
+        events.sort(key=lambda event: event["id"])
+        more = len(events) > limit or any(answer["cursor"] for _, answer in answers)
+        events = events[:limit]
+        return 200, {"events": events, "cursor": events[-1]["id"] if more and events else None}
+
+    def stop(self):
+        for shard in self.shards:
+            shard.connection.close()
+        for shard in self.shards:
+            shard.process.join(5)
+
+
+def merge_counters(answers):
+    # Sum of the numeric values of the shard answers with the same layout
+    merged = answers[0]
+    for answer in answers[1:]:
+        merged = add_counters(merged, answer)
+    return merged
+
+
+def add_counters(left, right):
+    if isinstance(left, dict):
+        return {key: add_counters(value, right.get(key, value)) if key in right else value
+                for key, value in left.items()}
+    if isinstance(left, (int, float)) and not isinstance(left, bool):
+        return left + right
+    return left
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.revision import revisions
+from threading import Lock
+import json
+
+
+# Encoded fleet listing, rebuilt only when the global state version moved.
+# Each entity fragment is re-encoded only when its own revision changed.
+class FleetSnapshot(object):
+
+    def __init__(self, switch):
+        self.switch = switch
+        self.version = None
+        self.body = None
+        self.fragments = {}
+        self.lock = Lock()
+
+    def categories(self):
+        return [
+            ("leds", self.switch.list_leds()),
+            ("sensors", self.switch.list_sensors()),
+            ("blinds", self.switch.list_blinds()),
+            ("groups", self.switch.list_groups())
+        ]
+
+    def encoded(self):
+        with self.lock:
+            version = revisions.last
+            if version == self.version:
+                return self.version, self.body
+            fragments = {}
+            parts = []
+            for name, entities in self.categories():
+                encoded = []
+                for entity in list(entities):
+                    key = id(entity)
+                    fragment = self.fragments.get(key)
+                    if fragment is None or fragment[0] != entity.revision:
+                        # The revision is read before serializing: a concurrent change gives a newer revision
+                        revision = entity.revision
+                        fragment = (revision, json.dumps(entity.serialize()))
+                    fragments[key] = fragment
+                    encoded.append(fragment[1])
+                parts.append('"' + name + '":[' + ",".join(encoded) + ']')
+            self.fragments = fragments
+            self.version = version
+            self.body = "{" + ",".join(parts) + "}"
+            return self.version, self.body
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from threading import Thread
+from queue import Queue
+from log import logger
+import time
+
+
+# Start the drivers at a bounded rate to avoid connection storms on the broker
+class PacedStarter(Thread):
+
+    def __init__(self, rate=100):
+        Thread.__init__(self, daemon=True)
+        self.rate = rate
+        self.pending = Queue()
+
+    def add(self, drivers):
+        for driver in drivers:
+            self.pending.put(driver)
+
+    def run(self):
+        while True:
+            driver = self.pending.get()
+            start = time.time()
+            try:
+                driver.start()
+            except:
+                logger.exception("Cannot start driver %r", driver.mac)
+            if self.rate > 0:
+                delay = 1.0 / self.rate - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
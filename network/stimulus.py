@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.clock import Clock
+from threading import Thread
+from log import logger
+import inspect
+import random
+import time
+
+# Stimulated sensor inputs and the sensor attributes they set
+FIELDS = {
+    "brightness": "brightness_raw",
+    "temperature": "temperature_raw",
+    "presence": "presence"
+}
+
+
+# low until at seconds then high, repeated every period seconds when period is set
+class StepPattern(object):
+
+    name = "step"
+    poisson = False
+
+    def __init__(self, low=0, high=100, at=0, period=0):
+        self.low = low
+        self.high = high
+        self.at = at
+        self.period = period
+
+    def value(self, sensor, elapsed):
+        if self.period > 0:
+            elapsed %= self.period
+        return self.high if elapsed >= self.at else self.low
+
+
+# Linear from start to stop in duration seconds, then stays at stop
+class RampPattern(object):
+
+    name = "ramp"
+    poisson = False
+
+    def __init__(self, start=0, stop=100, duration=60):
+        self.start = start
+        self.stop = stop
+        self.duration = duration
+
+    def value(self, sensor, elapsed):
+        progress = min(1.0, elapsed / self.duration) if self.duration > 0 else 1.0
+        return int(round(self.start + (self.stop - self.start) * progress))
+
+
+# Each sensor moves by at most step from its previous value, bounded by minimum and maximum
+class RandomWalkPattern(object):
+
+    name = "randomWalk"
+    poisson = False
+
+    def __init__(self, start=50, step=5, minimum=0, maximum=100):
+        self.start = start
+        self.step = step
+        self.minimum = minimum
+        self.maximum = maximum
+        self.values = {}
+
+    def value(self, sensor, elapsed):
+        value = self.values.get(sensor.mac, self.start) + random.uniform(-self.step, self.step)
+        value = min(self.maximum, max(self.minimum, value))
+        self.values[sensor.mac] = value
+        return int(round(value))
+
+
+# Presence arrivals: the events are a Poisson process, each one detects a presence on a random sensor.
+# The sensor ends the detection by itself after its presence threshold.
+class PoissonPresencePattern(object):
+
+    name = "poisson"
+    poisson = True
+
+    def value(self, sensor, elapsed):
+        return True
+
+
+PATTERNS = {
+    "step": StepPattern,
+    "ramp": RampPattern,
+    "randomWalk": RandomWalkPattern,
+    "poisson": PoissonPresencePattern
+}
+
+
+# Apply a stimulus pattern to a set of sensors at rate events per second for duration seconds (0 = until stopped).
+# Each event sets one sensor input, with publish its dump is sent at once instead of on the next tick
+# so that the message rate follows the event rate.
+class LoadGenerator(Thread):
+
+    def __init__(self, sensors, field, pattern, rate, duration=0, publish=False, clock=None):
+        Thread.__init__(self, daemon=True)
+        self.id = "%08X" % random.getrandbits(32)
+        self.sensors = list(sensors)
+        self.field = field
+        self.attribute = FIELDS[field]
+        self.pattern = pattern
+        self.rate = float(rate)
+        self.duration = duration
+        self.publish = publish
+        self.clock = clock or Clock()
+        self.is_running = True
+        self.events = 0
+        self.messages = 0
+        self.errors = 0
+        self.lag = 0
+        self.start_time = None
+        self.stop_time = None
+
+    def stop(self):
+        self.is_running = False
+
+    def apply(self, sensor, elapsed):
+        # Under the sensor lock: the tick cannot publish a dump at the same time
+        with sensor.lock:
+            setattr(sensor, self.attribute, self.pattern.value(sensor, elapsed))
+            if self.publish and sensor.is_configured:
+                sensor.publish_dump()
+                self.messages += 1
+
+    def run(self):
+        self.start_time = time.time()
+        origin = self.clock.time()
+        deadline = self.start_time
+        position = 0
+        while self.is_running:
+            now = time.time()
+            if self.duration and now - self.start_time >= self.duration:
+                break
+            if now < deadline:
+                # Short sleeps so that stop() is quick
+                time.sleep(min(deadline - now, 0.1))
+                continue
+            # Late events are sent back to back: the lag tells how far behind the target rate the generator is
+            self.lag = now - deadline
+            if self.pattern.poisson:
+                sensor = random.choice(self.sensors)
+                deadline += random.expovariate(self.rate)
+            else:
+                sensor = self.sensors[position]
+                position = (position + 1) % len(self.sensors)
+                deadline += 1.0 / self.rate
+            try:
+                self.apply(sensor, self.clock.time() - origin)
+            except:
+                self.errors += 1
+                logger.exception("Stimulus %r cannot set %r on %r", self.id, self.field, sensor.mac)
+            self.events += 1
+        self.is_running = False
+        self.stop_time = time.time()
+        logger.info("Stimulus %r done: %r events at %.1f/s", self.id, self.events, self.achieved_rate())
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0
+        return (self.stop_time or time.time()) - self.start_time
+
+    def achieved_rate(self):
+        elapsed = self.elapsed()
+        return self.events / elapsed if elapsed > 0 else 0
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "pattern": self.pattern.name,
+            "field": self.field,
+            "sensors": len(self.sensors),
+            "rate": self.rate,
+            "achievedRate": self.achieved_rate(),
+            "events": self.events,
+            "messages": self.messages,
+            "errors": self.errors,
+            "lag": self.lag,
+            "elapsed": self.elapsed(),
+            "running": self.is_running
+        }
+
+
+def pattern_parameters(name):
+    # Pattern parameters are the JSON keys of the request (e.g. low, high, at, period), all numbers
+    return list(inspect.signature(PATTERNS[name]).parameters)
+
+
+def create_pattern(name, options):
+    return PATTERNS[name](**{key: options[key] for key in pattern_parameters(name) if key in options})
@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.led import Led
+from network.clock import Clock
+from network.codec import default_codec
+from network.metrics import metrics
+from network.revision import Versioned
+from threading import Lock
+from array import array
+from log import logger
+import time
+
+# Led state kept in typed arrays, one row per led: attribute, array type code, initial value.
+# The protocol values are integers: the "i" columns truncate the floats they are given.
+LED_COLUMNS = [
+    ("brightness", "i", 0),
+    ("watchdog", "i", 3600),
+    ("i_max", "i", 0),
+    ("temperature", "i", 0),
+    ("thresold_low", "i", 10),
+    ("thresold_high", "i", 100),
+    ("daisy_chain_position", "i", 0),
+    ("device_power", "i", 0),
+    ("energy", "i", 0),
+    ("voltage_led", "i", 0),
+    ("voltage_input", "i", 36),
+    ("line_power", "i", 0),
+    ("duration", "i", 0),
+    ("duration_seconds", "i", 0),
+    ("time_to_auto", "i", 0),
+    ("default_brightness", "i", 20),
+    ("reset_numbers", "i", 0),
+    ("error", "i", 0),
+    ("group", "i", 0),
+    ("dump_age", "i", 0),
+    ("initial_date", "d", 0),
+    ("last_reset_date", "d", 0),
+    ("revision", "q", 0),
+    ("is_configured", "b", False),
+    ("is_ble_enabled", "b", False),
+    ("is_daisy_chain_enabled", "b", False),
+    ("auto", "b", False),
+    ("is_running", "b", True)
+]
+# Led state that is not a number: one list entry per row
+LED_OBJECTS = ["mac", "version", "last_dump", "client"]
+# Fields of the dump of a configured led, in the order of Led.serialize, and their attribute
+DUMP_FIELDS = [
+    ("duration", "duration"),
+    ("version", "version"),
+    ("brightness", "brightness"),
+    ("watchdog", "watchdog"),
+    ("iMax", "i_max"),
+    ("group", "group"),
+    ("thresoldLow", "thresold_low"),
+    ("thresoldHigh", "thresold_high"),
+    ("isBleEnabled", "is_ble_enabled"),
+    ("isDaisyChainEnabled", "is_daisy_chain_enabled"),
+    ("daisyChainPosition", "daisy_chain_position"),
+    ("devicePower", "device_power"),
+    ("energy", "energy"),
+    ("voltageLed", "voltage_led"),
+    ("voltageInput", "voltage_input"),
+    ("temperature", "temperature"),
+    ("linePower", "line_power"),
+    ("timeToAuto", "time_to_auto"),
+    ("auto", "auto"),
+    ("resetNumbers", "reset_numbers"),
+    ("lastResetDate", "last_reset_date"),
+    ("defaultBrigthness", "default_brightness")
+]
+# Settings of the driver options, the same for every led of the store
+SHARED_OPTIONS = ["pool", "scheduler", "clock", "codec", "snapshot_period", "tracer"]
+
+
+class Column(object):
+
+    def __init__(self, name, convert=None):
+        self.name = name
+        self.convert = convert
+
+    def __get__(self, row, owner=None):
+        if row is None:
+            return self
+        value = row.store.columns[self.name][row.slot]
+        return self.convert(value) if self.convert else value
+
+    def __set__(self, row, value):
+        row.store.set(self.name, row.slot, value)
+
+
+class Shared(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, row, owner=None):
+        if row is None:
+            return self
+        return getattr(row.store, self.name)
+
+
+# Led of a LedStore: a view over its row, the behaviour being the one of Led.
+# It has no thread, no MQTT client of its own and no topic strings: the pool routes its
+# messages to dispatch() and it ticks on the scheduler. Its only attributes are its store and
+# slot (Thread.__init__ is never called): the memory saved is the one of the Led attributes.
+class CompactLed(Led):
+
+    def __init__(self, store, slot):
+        object.__setattr__(self, "store", store)
+        object.__setattr__(self, "slot", slot)
+
+    def __setattr__(self, name, value):
+        if name not in self.store.columns:
+            Versioned.__setattr__(self, name, value)
+            return
+        if self.store.set(name, self.slot, value) and name not in self.unversioned:
+            self.touch()
+
+    def __repr__(self):
+        return "<CompactLed " + self.mac + ">"
+
+    @property
+    def base_topic(self):
+        return "led/" + self.mac
+
+    def serialize(self):
+        # Same dump as Led.serialize read from the row
+        slot = self.slot
+        columns = self.store.columns
+        led = {
+            "mac": columns["mac"][slot],
+            "isConfigured": bool(columns["is_configured"][slot]),
+            "error": columns["error"][slot],
+            "initialSetupDate": columns["initial_date"][slot]
+        }
+        if led["isConfigured"]:
+            for key, values, flag in self.store.dump_fields:
+                led[key] = bool(values[slot]) if flag else values[slot]
+        return led
+
+    def state(self):
+        names = [name for name, _, _ in LED_COLUMNS] + ["version"]
+        return {name: getattr(self, name) for name in names if name not in self.unversioned and name not in self.unmoved}
+
+    def connect(self):
+        self.client = self.pool.route(self)
+
+    def disconnect(self):
+        self.pool.unroute(self)
+
+    def setup(self):
+        self.connect()
+
+    def dispatch(self, message):
+        # /write/led/<mac><suffix>
+        handler = HANDLERS.get(message.topic[len(self.base_topic) + 7:])
+        start = time.perf_counter()
+        try:
+            if handler:
+                handler(self, self.client, None, message)
+            else:
+                self.event_received(self.client, None, message)
+        finally:
+            metrics.callback_time(HANDLER_NAMES.get(handler, "CompactLed.event_received"),
+                                  time.perf_counter() - start)
+
+
+for name, typecode, _ in LED_COLUMNS:
+    setattr(CompactLed, name, Column(name, bool if typecode == "b" else None))
+for name in LED_OBJECTS:
+    setattr(CompactLed, name, Column(name))
+for name in SHARED_OPTIONS:
+    setattr(CompactLed, name, Shared(name))
+
+# Handlers of the written topics by topic suffix
+HANDLERS = {getattr(Led, topic).suffix: getattr(Led, handler) for topic, handler in Led.write_handlers}
+HANDLER_NAMES = {getattr(Led, handler): "CompactLed." + handler for topic, handler in Led.write_handlers}
+
+
+# Columnar store of the leds: their state is held in one typed array per attribute indexed by
+# the led slot instead of the attributes of a Led object, with the same behaviour. The leds
+# share the connections of the pool and tick on the scheduler, both are required.
+# Slots are never reused: a removed led keeps its row.
+class LedStore(object):
+
+    def __init__(self, pool, scheduler, clock=None, codec=None, snapshot_period=0, tracer=None):
+        self.pool = pool
+        self.scheduler = scheduler
+        self.clock = clock or Clock()
+        self.codec = codec or default_codec
+        self.snapshot_period = snapshot_period
+        self.tracer = tracer
+        self.columns = {name: array(typecode) for name, typecode, _ in LED_COLUMNS}
+        self.columns.update((name, []) for name in LED_OBJECTS)
+        self.integers = frozenset(name for name, typecode, _ in LED_COLUMNS if typecode in "iq")
+        flags = frozenset(name for name, typecode, _ in LED_COLUMNS if typecode == "b")
+        # The arrays grow in place: the dump reads them directly
+        self.dump_fields = [(key, self.columns[name], name in flags) for key, name in DUMP_FIELDS]
+        self.size = 0
+        self.lock = Lock()
+
+    def create(self, mac, version):
+        with self.lock:
+            for name, typecode, value in LED_COLUMNS:
+                self.columns[name].append(value)
+            for name in LED_OBJECTS:
+                self.columns[name].append(None)
+            slot = self.size
+            self.size += 1
+        led = CompactLed(self, slot)
+        self.columns["mac"][slot] = mac
+        self.columns["version"][slot] = version
+        self.columns["initial_date"][slot] = self.clock.time()
+        led.touch()
+        return led
+
+    def set(self, name, slot, value):
+        # True when the value changed
+        values = self.columns[name]
+        if name in self.integers:
+            value = int(value)
+        if values[slot] == value:
+            return False
+        values[slot] = value
+        return True
+
+
+def create_store(name, **options):
+    # None keeps one Led object per led
+    if name != "columnar":
+        return None
+    store = LedStore(**options)
+    logger.info("Leds kept in a columnar store")
+    return store
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.revision import revisions
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
+from log import logger
+import time
+
+STREAM_TYPES = ["led", "sensor", "blind", "group", "diagnostic"]
+
+
+# Stream subscriber with its filters.
+# Pending changes of the same entity are merged so that a slow client only gets the latest values.
+class StreamClient(object):
+
+    def __init__(self, types=None, mac=None, group=None, max_pending=1000):
+        self.types = types or STREAM_TYPES
+        self.mac = mac
+        self.group = group
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.dropped = 0
+        self.condition = Condition()
+
+    def accept(self, event):
+        if event["type"] not in self.types:
+            return False
+        if self.mac is not None and event.get("mac") != self.mac:
+            return False
+        if self.group is not None and event.get("group") != self.group:
+            return False
+        return True
+
+    def push(self, key, event):
+        with self.condition:
+            previous = self.pending.get(key)
+            if previous is not None and "changes" in previous and "changes" in event:
+                previous["changes"].update(event["changes"])
+            else:
+                self.pending[key] = event
+                if len(self.pending) > self.max_pending:
+                    self.pending.popitem(last=False)
+                    self.dropped += 1
+            self.condition.notify()
+
+    def wait(self, timeout):
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            events = list(self.pending.values())
+            self.pending = OrderedDict()
+            return events
+
+
+# Push the state changes to the stream clients: field changes of the drivers and groups
+# (found with their revision), and the diagnostic events.
+class EventStream(Thread):
+
+    def __init__(self, switch, period=1):
+        Thread.__init__(self, daemon=True)
+        self.switch = switch
+        self.period = period
+        self.clients = set()
+        self.lock = Lock()
+        self.version = 0
+        self.states = None
+        switch.events.listeners.append(self.diagnostic_event)
+
+    def subscribe(self, client):
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def publish(self, key, event):
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            if client.accept(event):
+                client.push(key, dict(event, changes=dict(event["changes"])) if "changes" in event else event)
+
+    def diagnostic_event(self, event):
+        if not self.clients:
+            return
+        self.publish(("diagnostic", event["id"]), dict(event, type="diagnostic", event=event["type"]))
+
+    def run(self):
+        while True:
+            start = time.time()
+            try:
+                if not self.clients:
+                    # Nothing to follow: the state is collected again when a client comes
+                    self.states = None
+                    self.version = 0
+                elif revisions.last != self.version:
+                    self.version = revisions.last
+                    self.collect()
+            except:
+                logger.exception("Cannot collect the state changes")
+            delay = self.period - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def entities(self):
+        for driver_type, category in [("led", "leds"), ("sensor", "sensors"), ("blind", "blinds")]:
+            for driver in list(self.switch.drivers[category].values()):
+                yield (driver_type, driver.mac), driver, {"type": driver_type, "mac": driver.mac,
+                                                          "group": driver.group}
+        for group in list(self.switch.groups.values()):
+            yield ("group", group.group_id), group, {"type": "group", "group": group.group_id}
+
+    def collect(self):
+        # The first collection is the reference state: clients get it from /v1/switch
+        publish = self.states is not None
+        if not publish:
+            self.states = {}
+        states = {}
+        for key, entity, event in self.entities():
+            state = self.states.get(key)
+            if state is not None and state[0] == entity.revision:
+                states[key] = state
+                continue
+            revision = entity.revision
+            serialized = entity.serialize()
+            changes = {}
+            last = state[1] if state is not None else {}
+            for field, value in serialized.items():
+                if field not in last or last[field] != value:
+                    changes[field] = value
+            # The group is kept for the removal event: a removed driver leaves its group
+            states[key] = (revision, serialized, event["group"])
+            if changes and publish:
+                event["changes"] = changes
+                self.publish(key, event)
+        for key, state in self.states.items():
+            if key not in states:
+                event = {"type": key[0], "removed": True, "group": state[2]}
+                if key[0] != "group":
+                    event["mac"] = key[1]
+                self.publish(key, event)
+        self.states = states
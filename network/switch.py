@@ -2,30 +2,63 @@
 # coding: utf-8
 
 from network.group import Group
+from network.driver import error_management
+from network.clock import Clock
+from network.codec import default_codec
+from network.diagnostic import EventLog
+from network.latency import CommandTracer
+from network.metrics import metrics
+from network.transport import default_transport
+from network.revision import revisions
 
 import paho.mqtt.client as mqtt
-from threading import Thread
+from threading import Thread, RLock
+import bisect
 import time
 from log import logger
-import paho.mqtt.subscribe as subscribe
 import json
 import random
 import string
 
+CATEGORIES = ["leds", "sensors", "blinds", "groups"]
+
+
 class Switch(Thread):
 
-    def __init__(self, broker_ip):
+    def __init__(self, broker_ip, scheduler=None, clock=None, codec=None, events_size=10000, pool=None,
+                 local_only=False, transport=None, controller=None):
         Thread.__init__(self)
+        self.codec = codec or default_codec
+        self.clock = clock or Clock()
+        self.transport = transport or default_transport
         self.broker_ip = broker_ip
+        self.scheduler = scheduler
+        self.pool = pool
+        self.is_running = True
+        # Batch controller ticking all the groups at once, None for a tick per group
+        self.controller = controller
+        self.base_topic = "switch"
+        # Only configure the drivers plugged into this switch, the other ones belong to another shard
+        self.local_only = local_only
         self.groups = {}
         self.drivers = {
             "leds" : {},
             "sensors": {},
             "blinds": {}
         }
+        # Sorted keys of every category for the paginated listings
+        self.indexes = {
+            "leds": [],
+            "sensors": [],
+            "blinds": [],
+            "groups": []
+        }
+        # Guards the registries and their indexes, shared by the API workers
+        self.lock = RLock()
+        self.events = EventLog(events_size, self.clock)
+        self.tracer = CommandTracer()
         self.diagnostic = {
-            "config": {},
-            "events": {}
+            "config": {}
         }
         self.name = "Switch" + ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(12))
 
@@ -33,38 +66,63 @@ class Switch(Thread):
         if rc != 0:
             logger.warning("Unexpected client disconnect for %r, will reconnect", self.name)
 
+    def start(self):
+        if not self.pool:
+            Thread.start(self)
+            return
+        # Only the hellos are needed, on a shared connection instead of a dedicated thread
+        self.client = self.pool.attach(self)
+        self.client.subscribe("/read/+/+/setup/hello")
+
+    def stop(self):
+        self.is_running = False
+        # The thread unsubscribes when its loop ends
+        if self.pool:
+            self.pool.detach(self)
+
     def run(self):
-        self.client = mqtt.Client(self.name)
-        self.client.on_message = self.event_received
+        self.client = self.transport.client(self.name)
+        self.client.on_message = metrics.timed(self.event_received)
         self.client.on_disconnect = self.on_disconnect
         self.client.connect(self.broker_ip)
         self.client.loop_start()
-        subscribe.callback(self.event_received, "#", hostname=self.broker_ip)
+        self.client.subscribe("/read/+/+/setup/hello")
 
-        while self.is_alive:
-            time.sleep(1)
+        while self.is_running:
+            self.clock.sleep(1)
         self.client.loop_stop()
 
+    @error_management
     def event_received(self, client, userdata, message):
-        try:
-            data = message.payload.decode("utf-8")
-            logger.debug("received url  %r %r", message.topic, str(data))
-            if message.topic.endswith("/setup/hello"):
-                data = json.loads(data)
-                topic_url = data["topic"] + "/setup/config"
-                config = {}
-                if data["type"] == "led":
-                    config["iMax"] = 700
-                self.client.publish("/write/" + topic_url, json.dumps(config))
-        except:
-            logger.exception("Invalid value received")
+        logger.debug("received url  %r %r", message.topic, message.payload)
+        if message.topic.endswith("/setup/hello"):
+            data = self.codec.decode(message.payload)
+            if self.local_only and not self.get_driver(data["mac"]):
+                return
+            topic_url = data["topic"] + "/setup/config"
+            config = {}
+            if data["type"] == "led":
+                config["iMax"] = 700
+            self.client.publish("/write/" + topic_url, self.codec.encode(config))
 
     def create_group(self, leds, sensors, blinds, group_id):
-        if group_id in self.groups:
-            return False
-
-        group = Group(self.broker_ip, group_id)
-        self.groups[group_id] = group
+        with self.lock:
+            if group_id in self.groups:
+                return False
+            options = {
+                "scheduler": self.scheduler,
+                "clock": self.clock,
+                "codec": self.codec,
+                "pool": self.pool,
+                "transport": self.transport
+            }
+            if self.controller:
+                group = self.controller.group(self.broker_ip, group_id, **options)
+            else:
+                group = Group(self.broker_ip, group_id, **options)
+            self.groups[group_id] = group
+            self.index_add("groups", group_id)
+        revisions.next()
 
         for led in leds:
             group.add_led(led)
@@ -76,7 +134,7 @@ class Switch(Thread):
             group.add_blind(blind)
 
         group.start()
-        self.diagnostic['events'][time.time()] = "Group " + str(group_id) + "has been created and contains " + json.dumps(group.serialize())
+        self.events.add("group_created", "Group " + str(group_id) + "has been created and contains " + json.dumps(group.serialize()), group=group_id)
         return True
 
     def add_driver_to_group(self, group_id, driver_type, mac):
@@ -85,23 +143,33 @@ class Switch(Thread):
 
         group = self.groups[group_id]
 
+        added = False
         if driver_type == "led":
             led = self.get_led(mac)
             if not led:
                 return False
-            return group.add_led(led)
+            added = group.add_led(led)
         elif driver_type == "sensor":
             sensor = self.get_sensor(mac)
             if not sensor:
                 return False
-            return group.add_sensor(sensor)
+            added = group.add_sensor(sensor)
         elif driver_type == "blind":
             blind = self.get_blind(mac)
             if not blind:
                 return False
-            return group.add_blind(blind)
-        self.diagnostic['events'][time.time()] = "Driver " + driver_type + " : " + mac + "has been been added to " + group_id
-        return False
+            added = group.add_blind(blind)
+        if added:
+            self.events.add("group_driver_added", "Driver " + driver_type + " : " + mac + " has been added to " + str(group_id),
+                            mac=mac, group=group_id)
+        return added
+
+    def get_driver(self, mac):
+        for category in ["leds", "sensors", "blinds"]:
+            driver = self.drivers[category].get(mac)
+            if driver:
+                return driver
+        return None
 
     def get_group_id(self, group_id):
         if group_id in self.groups:
@@ -109,7 +177,7 @@ class Switch(Thread):
         return {}
 
     def list_groups(self):
-        return self.groups.values()
+        return list(self.groups.values())
 
     def update_group_rules(self, group_id, rule_id, value):
         if group_id not in self.groups:
@@ -120,11 +188,80 @@ class Switch(Thread):
             self.groups[group_id].set_temperature(value)
         elif rule_id == "presence":
             self.groups[group_id].set_presence(value)
-        self.diagnostic['events'][time.time()] = "Rule " + rule_id + " is set to " + str(value) + " for " + str(group_id)
+        self.events.add("group_rule", "Rule " + rule_id + " is set to " + str(value) + " for " + str(group_id), group=group_id)
         return True
 
+    def index_add(self, category, key):
+        with self.lock:
+            keys = self.indexes[category]
+            position = bisect.bisect_left(keys, key)
+            if position == len(keys) or keys[position] != key:
+                keys.insert(position, key)
+
+    def index_remove(self, category, key):
+        with self.lock:
+            keys = self.indexes[category]
+            position = bisect.bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def query(self, categories=None, group=None, is_configured=None, auto=None, mac_prefix="", cursor="", limit=100):
+        # Entities are ordered by category then by key (mac or group number); the cursor is the last returned one
+        categories = categories or CATEGORIES
+        results = {category: [] for category in categories}
+        start_category, start_key = "", None
+        if cursor:
+            start_category, start_key = cursor.split(":", 1)
+            if start_category == "groups":
+                start_key = int(start_key)
+        count = 0
+        last = None
+        for category in CATEGORIES:
+            if category not in categories:
+                continue
+            if start_category and CATEGORIES.index(category) < CATEGORIES.index(start_category):
+                continue
+            if category == "groups":
+                if mac_prefix or is_configured is not None:
+                    continue
+                entities = self.groups
+            else:
+                entities = self.drivers[category]
+            with self.lock:
+                keys = list(self.indexes[category])
+            if category == start_category:
+                position = bisect.bisect_right(keys, start_key)
+            elif mac_prefix:
+                position = bisect.bisect_left(keys, mac_prefix)
+            else:
+                position = 0
+            while position < len(keys):
+                key = keys[position]
+                position += 1
+                if mac_prefix and not key.startswith(mac_prefix):
+                    break
+                entity = entities.get(key)
+                if entity is None:
+                    continue
+                if category == "groups":
+                    if group is not None and entity.group_id != group:
+                        continue
+                else:
+                    if group is not None and entity.group != group:
+                        continue
+                    if is_configured is not None and entity.is_configured != is_configured:
+                        continue
+                if auto is not None and getattr(entity, "auto", None) != auto:
+                    continue
+                if count == limit:
+                    return results, last
+                results[category].append(entity)
+                count += 1
+                last = category + ":" + str(key)
+        return results, None
+
     def list_leds(self):
-        return self.drivers["leds"].values()
+        return list(self.drivers["leds"].values())
 
     def get_led(self, led_id):
         if led_id in self.drivers["leds"]:
@@ -132,16 +269,22 @@ class Switch(Thread):
         return None
 
     def plug_led(self, led):
-        self.drivers["leds"][led.mac] = led
-        self.diagnostic['events'][time.time()] = "New led " + led.mac + " has been plugged into the switch"
+        with self.lock:
+            self.drivers["leds"][led.mac] = led
+            self.index_add("leds", led.mac)
+        revisions.next()
+        self.events.add("driver_plugged", "New led " + led.mac + " has been plugged into the switch", mac=led.mac)
 
     def unplug_led(self, led):
-        if led.mac in self.drivers["leds"]:
-            del self.drivers["leds"][led.mac]
-        self.diagnostic['events'][time.time()] = "Led " + led.mac + " has been unplugged from the switch"
+        with self.lock:
+            if led.mac in self.drivers["leds"]:
+                del self.drivers["leds"][led.mac]
+                self.index_remove("leds", led.mac)
+        revisions.next()
+        self.events.add("driver_unplugged", "Led " + led.mac + " has been unplugged from the switch", mac=led.mac)
 
     def list_sensors(self):
-        return self.drivers["sensors"].values()
+        return list(self.drivers["sensors"].values())
 
     def get_sensor(self, sensor_id):
         if sensor_id in self.drivers["sensors"]:
@@ -149,13 +292,19 @@ class Switch(Thread):
         return None
 
     def plug_sensor(self, sensor):
-        self.drivers["sensors"][sensor.mac] = sensor
-        self.diagnostic['events'][time.time()] = "New sensor " + sensor.mac + " has been plugged into the switch"
+        with self.lock:
+            self.drivers["sensors"][sensor.mac] = sensor
+            self.index_add("sensors", sensor.mac)
+        revisions.next()
+        self.events.add("driver_plugged", "New sensor " + sensor.mac + " has been plugged into the switch", mac=sensor.mac)
 
     def unplug_sensor(self, sensor):
-        if sensor.mac in self.drivers["sensors"]:
-            del self.drivers["sensors"][sensor.mac]
-        self.diagnostic['events'][time.time()] = "Sensor " + sensor.mac + " has been unplugged from the switch"
+        with self.lock:
+            if sensor.mac in self.drivers["sensors"]:
+                del self.drivers["sensors"][sensor.mac]
+                self.index_remove("sensors", sensor.mac)
+        revisions.next()
+        self.events.add("driver_unplugged", "Sensor " + sensor.mac + " has been unplugged from the switch", mac=sensor.mac)
 
     def switch_led_mode(self, led_id, auto=True):
         if led_id not in self.drivers["leds"]:
@@ -166,12 +315,12 @@ class Switch(Thread):
         status = "auto"
         if not auto:
             status = "manual"
-        self.diagnostic['events'][time.time()] = "Switch led " + led.mac + " into mode " + status
+        self.events.add("driver_mode", "Switch led " + led.mac + " into mode " + status, mac=led.mac)
         self.client.publish(url,  "%s" % auto)
         return True
 
     def list_blinds(self):
-        return self.drivers["blinds"].values()
+        return list(self.drivers["blinds"].values())
 
     def get_blind(self, blind_id):
         if blind_id in self.drivers["blinds"]:
@@ -179,17 +328,28 @@ class Switch(Thread):
         return None
 
     def plug_blind(self, blind):
-        self.drivers["blinds"][blind.mac] = blind
-        self.diagnostic['events'][time.time()] = "New blind " + blind.mac + " has been plugged into the switch"
+        with self.lock:
+            self.drivers["blinds"][blind.mac] = blind
+            self.index_add("blinds", blind.mac)
+        revisions.next()
+        self.events.add("driver_plugged", "New blind " + blind.mac + " has been plugged into the switch", mac=blind.mac)
 
     def unplug_blind(self, blind):
-        if blind.mac in self.drivers["blinds"]:
-            del self.drivers["blinds"][blind.mac]
-        self.diagnostic['events'][time.time()] = "Blind " + blind.mac + " has been unplugged from the switch"
-
-    def get_diagnostic(self):
-        self.diagnostic["config"]["groups"] = [group.serialize() for group in self.groups.values()]
-        return self.diagnostic
+        with self.lock:
+            if blind.mac in self.drivers["blinds"]:
+                del self.drivers["blinds"][blind.mac]
+                self.index_remove("blinds", blind.mac)
+        revisions.next()
+        self.events.add("driver_unplugged", "Blind " + blind.mac + " has been unplugged from the switch", mac=blind.mac)
+
+    def get_diagnostic(self, events_limit=100):
+        # A new report for each caller, the requests can run concurrently
+        config = dict(self.diagnostic["config"])
+        config["groups"] = [group.serialize() for group in list(self.groups.values())]
+        return {
+            "config": config,
+            "events": self.events.latest(events_limit)
+        }
 
     def set_manual_led_brightness(self, led_id, brightness=0):
         if led_id not in self.drivers["leds"]:
@@ -197,7 +357,8 @@ class Switch(Thread):
         led = self.drivers["leds"][led_id]
         url = "/write/" + led.base_topic + "/base/setpointManual"
         logger.info("Send setpoint to %r for %r", brightness, url)
-        self.diagnostic['events'][time.time()] = "Force led " + led.mac + " brightness " + str(brightness)
+        self.events.add("led_brightness", "Force led " + led.mac + " brightness " + str(brightness), mac=led.mac)
+        self.tracer.start("led_brightness", [led.mac], int(brightness))
         logger.info(" back %r", self.client.publish(url, str(brightness)))
         return True
 
@@ -210,7 +371,7 @@ class Switch(Thread):
         status = "auto"
         if not auto:
             status = "manual"
-        self.diagnostic['events'][time.time()] = "Switch blind " + blind.mac + " into mode " + status
+        self.events.add("driver_mode", "Switch blind " + blind.mac + " into mode " + status, mac=blind.mac)
         self.client.publish(url, "%s" % auto)
         return True
 
@@ -221,12 +382,12 @@ class Switch(Thread):
         if not blind_number or blind_number == 1:
             url = "/write/" + blind.base_topic + "/base/blind1Manual"
             logger.info("Send position to %r for %r", position, url)
-            self.diagnostic['events'][time.time()] = "Force blind " + blind.mac + " position " + str(position)
+            self.events.add("blind_position", "Force blind " + blind.mac + " position " + str(position), mac=blind.mac)
             self.client.publish(url, str(position))
         if not blind_number or blind_number == 2:
             url = "/write/" + blind.base_topic + "/base/blind2Manual"
             logger.info("Send position to %r for %r", position, url)
-            self.diagnostic['events'][time.time()] = "Force blind " + blind.mac + " position " + str(position)
+            self.events.add("blind_position", "Force blind " + blind.mac + " position " + str(position), mac=blind.mac)
             self.client.publish(url, str(position))
 
     def set_manual_blind_fin(self, blind_id, fin, blind_number=0):
@@ -236,12 +397,12 @@ class Switch(Thread):
         if not blind_number or blind_number == 1:
             url = "/write/" + blind.base_topic + "/base/fin1Manual"
             logger.info("Send position to %r for %r", fin, url)
-            self.diagnostic['events'][time.time()] = "Force blind " + blind.mac + " fin " + str(fin)
+            self.events.add("blind_fin", "Force blind " + blind.mac + " fin " + str(fin), mac=blind.mac)
             self.client.publish(url, str(fin))
         if not blind_number or blind_number == 2:
             url = "/write/" + blind.base_topic + "/base/fin2Manual"
             logger.info("Send position to %r for %r", fin, url)
-            self.diagnostic['events'][time.time()] = "Force blind " + blind.mac + " fin " + str(fin)
+            self.events.add("blind_fin", "Force blind " + blind.mac + " fin " + str(fin), mac=blind.mac)
             self.client.publish(url, str(fin))
 
     def switch_group_mode(self, group_id, auto=True):
@@ -253,7 +414,7 @@ class Switch(Thread):
         status = "auto"
         if not auto:
             status = "manual"
-        self.diagnostic['events'][time.time()] = "Switch group " + str(group.group_id) + " into mode " + str(status)
+        self.events.add("group_mode", "Switch group " + str(group.group_id) + " into mode " + str(status), group=group.group_id)
         self.client.publish(url, "%s" % auto)
         return True
 
@@ -263,7 +424,10 @@ class Switch(Thread):
         group = self.groups[group_id]
         url = "/write/" + group.base_topic + "/config/setpoint"
         logger.info("Send setpoint value to %r for %r", setpoint, url)
-        self.diagnostic['events'][time.time()] = "Send setpoint " + str(setpoint) + " to group " + str(group.group_id)
+        self.events.add("group_setpoint", "Send setpoint " + str(setpoint) + " to group " + str(group.group_id), group=group.group_id)
+        # Applied once the group ramp reaches the setpoint on each led, nothing is published to the leds
+        # when the group is already at this setpoint
+        self.tracer.start("group_setpoint", list(group.leds), int(setpoint), unchanged=group.setpoint == int(setpoint))
         self.client.publish(url, str(setpoint))
         return True
 
@@ -273,6 +437,6 @@ class Switch(Thread):
         group = self.groups[group_id]
         url = "/write/" + group.base_topic + "/config/blindPosition"
         logger.info("Send setpoint value to %r for %r", position, url)
-        self.diagnostic['events'][time.time()] = "Send blind position " + str(position) + " to group " + str(group.group_id)
+        self.events.add("group_blind_position", "Send blind position " + str(position) + " to group " + str(group.group_id), group=group.group_id)
         self.client.publish(url, str(position))
         return True
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from network.shard import shard_of_group, shard_of_mac
+from log import logger
+import json
+import random
+import string
+import time
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DRIVER_TYPES = {
+    "leds": "led",
+    "sensors": "sensor",
+    "blinds": "blind"
+}
+
+DEFAULT_RULES = {
+    "presence": 600,
+    "temperature": 200,
+    "brightness": 300
+}
+
+
+def random_mac():
+    return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(12))
+
+
+def load_topology(path):
+    with open(path) as stream:
+        if path.endswith(".yaml") or path.endswith(".yml"):
+            if yaml is None:
+                raise ImportError("PyYAML package is required to load a YAML topology")
+            return yaml.safe_load(stream)
+        return json.load(stream)
+
+
+# Build the whole fleet described by a topology:
+# {
+#     "leds": 10 or ["MAC1", ...],  (same for sensors and blinds, drivers without group)
+#     "groups": [{"group": 1, "leds": 20, "sensors": ["MAC2"], "blinds": 2,
+#                 "brightness": 300, "presence": 600, "temperature": 200}]
+# }
+# With shard (index, count), only the part of the fleet of this shard is built: the groups number % count and
+# the drivers without group by mac hash (or by position when the mac is generated).
+class TopologyBuilder(object):
+
+    def __init__(self, switch, create_driver, workers=16, shard=None, mac_generator=random_mac):
+        self.switch = switch
+        self.create_driver = create_driver
+        self.mac_generator = mac_generator
+        self.workers = workers
+        self.shard = shard
+
+    def owned(self, group_id, position, mac):
+        if not self.shard:
+            return True
+        index, count = self.shard
+        if group_id:
+            return shard_of_group(group_id, count) == index
+        if mac:
+            return shard_of_mac(mac, count) == index
+        return position % count == index
+
+    def driver_specs(self, description, group_id=0):
+        specs = []
+        for key, driver_type in DRIVER_TYPES.items():
+            drivers = description.get(key, [])
+            if isinstance(drivers, int):
+                drivers = [None] * drivers
+            for position, mac in enumerate(drivers):
+                if self.owned(group_id, position, mac):
+                    specs.append((driver_type, mac, group_id))
+        return specs
+
+    def assign_macs(self, specs):
+        # The macs are chosen before the parallel creation: two drivers cannot get the same one
+        used = set()
+        for _, mac, _ in specs:
+            if mac in used or (mac and self.switch.get_driver(mac)):
+                raise ValueError("Driver " + mac + " already exists")
+            if mac:
+                used.add(mac)
+        assigned = []
+        for driver_type, mac, group_id in specs:
+            while not mac:
+                mac = self.mac_generator()
+                if mac in used or self.switch.get_driver(mac):
+                    mac = None
+            used.add(mac)
+            assigned.append((driver_type, mac, group_id))
+        return assigned
+
+    def build(self, topology):
+        start = time.time()
+        groups = [group for group in topology.get("groups", []) if self.owned(group["group"], 0, None)]
+        specs = self.driver_specs(topology)
+        for group in groups:
+            group_id = group["group"]
+            if group_id < 1:
+                raise ValueError("Group must be greater than 0 (0 = default group)")
+            for rule_id in DEFAULT_RULES:
+                value = group.get(rule_id, 0)
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise ValueError("Rule " + rule_id + " of group " + str(group_id) + " must be a number")
+            specs += self.driver_specs(group, group_id)
+        specs = self.assign_macs(specs)
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            drivers = list(executor.map(lambda spec: self.create_driver(spec[0], spec[1]), specs))
+
+            members = {}
+            for (driver_type, _, group_id), driver in zip(specs, drivers):
+                if group_id:
+                    members.setdefault(group_id, {"led": [], "sensor": [], "blind": []})
+                    members[group_id][driver_type].append(driver)
+            for group in groups:
+                group_id = group["group"]
+                group_members = members.get(group_id, {"led": [], "sensor": [], "blind": []})
+                if not self.switch.create_group(group_members["led"], group_members["sensor"],
+                                                group_members["blind"], group_id):
+                    raise ValueError("Group " + str(group_id) + " already exists")
+                for rule_id, value in DEFAULT_RULES.items():
+                    self.switch.update_group_rules(group_id, rule_id, group.get(rule_id, value))
+
+            # The provisioning starts as soon as the drivers are connected
+            list(executor.map(lambda driver: driver.start(), drivers))
+        logger.info("Topology with %r drivers and %r groups built in %.3f s", len(drivers), len(groups),
+                    time.time() - start)
+        return drivers
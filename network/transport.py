@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.codec import encode_payload
+from network.metrics import metrics, MeteredClient
+from network.recording import recorder
+from network.router import TopicRouter
+from log import logger
+import paho.mqtt.client as mqtt
+
+
+# In-process broker: a published message is delivered at once, in the publishing thread,
+# to every client with a matching subscription (+ and # wildcards included)
+class LoopbackBroker(object):
+
+    def __init__(self):
+        self.router = TopicRouter()
+
+    def subscribe(self, client, topic_filter):
+        self.router.add(topic_filter, client.deliver)
+
+    def unsubscribe(self, client, topic_filter):
+        self.router.remove(topic_filter, client.deliver)
+
+    def publish(self, topic, payload):
+        handlers = self.router.match(topic)
+        if not handlers:
+            return
+        message = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        message.payload = encode_payload(payload)
+        # One delivery per client whatever the number of its matching filters (a/# and a/+)
+        for deliver in dict.fromkeys(handlers):
+            deliver(message)
+
+
+# Client of the loopback broker with the subset of the paho client API used by the simulator
+class LoopbackClient(object):
+
+    def __init__(self, broker, client_id=""):
+        self.broker = broker
+        self.client_id = client_id
+        self.filters = set()
+        self.callbacks = TopicRouter()
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_disconnect = None
+        metrics.clients.add(self)
+
+    def connect(self, host=None, *args, **kwargs):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect()
+
+    def disconnect(self):
+        for topic_filter in list(self.filters):
+            self.unsubscribe(topic_filter)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        # Nothing is received once the network loop is stopped
+        self.disconnect()
+
+    def loop_misc(self):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def message_callback_add(self, sub, callback):
+        self.callbacks.remove(sub)
+        self.callbacks.add(sub, metrics.timed(callback))
+
+    def message_callback_remove(self, sub):
+        self.callbacks.remove(sub)
+
+    def subscribe(self, topic, qos=0):
+        # A filter subscribed again is kept once, the broker delivers once per client
+        if topic not in self.filters:
+            self.filters.add(topic)
+            self.broker.subscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def unsubscribe(self, topic):
+        if topic in self.filters:
+            self.filters.discard(topic)
+            self.broker.unsubscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        metrics.message("out", topic)
+        if recorder.active:
+            recorder.record("out", topic, payload)
+        self.broker.publish(topic, payload)
+
+    def deliver(self, message):
+        metrics.message("in", message.topic)
+        if recorder.active:
+            recorder.record("in", message.topic, message.payload)
+        try:
+            callbacks = self.callbacks.match(message.topic)
+            if callbacks:
+                for callback in callbacks:
+                    callback(self, None, message)
+            elif self.on_message:
+                self.on_message(self, None, message)
+        except:
+            # The subscriber errors must not reach the publisher
+            logger.exception("Loopback delivery of %r failed", message.topic)
+
+
+# Way the simulated entities reach each other: paho clients connected to the MQTT broker
+class MqttTransport(object):
+
+    name = "mqtt"
+
+    def client(self, client_id):
+        return MeteredClient(client_id)
+
+
+# Messages delivered in memory by one loopback broker, without MQTT broker
+class LoopbackTransport(object):
+
+    name = "loopback"
+
+    def __init__(self):
+        self.broker = LoopbackBroker()
+
+    def client(self, client_id):
+        return LoopbackClient(self.broker, client_id)
+
+
+TRANSPORTS = {
+    MqttTransport.name: MqttTransport,
+    LoopbackTransport.name: LoopbackTransport
+}
+
+default_transport = MqttTransport()
+
+
+def create_transport(name):
+    if name == MqttTransport.name:
+        return default_transport
+    return TRANSPORTS[name]()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import argparse
+import json
+import random
+import string
+import sys
+
+import paho.mqtt.client as mqtt
+
+from network.recording import DIRECTIONS, TrafficReplayer, read_records
+from log import logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the MQTT traffic recorded by the simulator (--record) again")
+    parser.add_argument("recording",  type=str,
+                        help="recording file")
+    parser.add_argument("-b", "--broker",  type=str, default="127.0.0.1",
+                        help="Broker ip address by default 127.0.0.1")
+    parser.add_argument("-x", "--speed",  type=float, default=1,
+                        help="replay speed factor, 0 publishes as fast as possible, by default 1 (recorded pace)")
+    parser.add_argument("-D", "--direction",  type=str, default="out", choices=DIRECTIONS + ["all"],
+                        help="messages to publish: out (published by the simulated drivers, groups and switch), in (received by them) or all, by default out")
+    parser.add_argument("-g", "--max-gap",  type=float, default=0,
+                        help="shorten the pauses of the recording to this number of seconds, by default 0 (pauses kept)")
+    parser.add_argument("-o", "--output",  type=str, default="",
+                        help="write the JSON report to this file instead of the standard output")
+    args = parser.parse_args()
+    if args.speed < 0 or args.max_gap < 0:
+        parser.error("--speed and --max-gap must be positive")
+
+    client = mqtt.Client("Replay" + ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8)))
+    client.connect(args.broker)
+    client.loop_start()
+    directions = DIRECTIONS if args.direction == "all" else [args.direction]
+    replayer = TrafficReplayer(client, args.speed, directions, args.max_gap)
+    logger.info("Replay %r on %r at speed %r", args.recording, args.broker, args.speed)
+    try:
+        report = replayer.run(read_records(args.recording))
+    except KeyboardInterrupt:
+        report = replayer.report()
+    client.loop_stop()
+    client.disconnect()
+    logger.info("%r messages replayed at %.1f messages/s", report["messages"], report["rate"])
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(data + "\n")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
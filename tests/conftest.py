@@ -0,0 +1,8 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import os
+import sys
+
+# The simulator modules are imported from the repository root, as websimulator.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import argparse
+import pytest
+import time
+import websimulator
+
+MACS = ["CURSOR%06d" % index for index in range(7)]
+
+
+@pytest.fixture(scope="module")
+def client():
+    # The routes are added to the global app: one simulator for all the tests.
+    # Loopback transport, and a clock so slow that the drivers never tick during the tests.
+    args = argparse.Namespace(broker="loopback", speed=0.001, codec="json", transport="loopback", record="",
+                              engine="threads", workers=2, mqtt_pool=1, controller="groups", events_size=1000,
+                              delta_dump=0, store="objects", connect_rate=0, topology="")
+    websimulator.setup(args)
+    return websimulator.app.test_client()
+
+
+def stable_etag(client, timeout=5):
+    # ETag of the listing once the drivers started in the background are left alone
+    etag = client.get("/v1/switch").headers["ETag"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.05)
+        current = client.get("/v1/switch").headers["ETag"]
+        if current == etag:
+            return etag
+        etag = current
+    raise AssertionError("The listing keeps changing")
+
+
+def test_bulk_creation(client):
+    response = client.post("/v1/led/bulk", json={"macs": MACS})
+    assert response.status_code == 200
+    assert [led["mac"] for led in response.get_json()["leds"]] == MACS
+    response = client.post("/v1/led/bulk", json={"macs": MACS[:1]})
+    assert response.status_code == 400
+    assert response.get_json() == {"Message": "Driver " + MACS[0] + " already exists"}
+
+
+@pytest.mark.parametrize("payload", [
+    {"count": "10"},
+    {"count": True},
+    {"count": 0},
+    {"macs": "AB12CD34EF56"},
+    {"macs": [12]},
+    {"macs": ["AB12CD34EF56"], "count": 2},
+    {"macs": ["AB12CD34EF56", "AB12CD34EF56"]},
+    {"count": 1, "group": "1"},
+    {"count": 1, "group": 999},
+    {"count": 1, "macPrefix": 12}
+])
+def test_bulk_invalid_payloads(client, payload):
+    response = client.post("/v1/led/bulk", json=payload)
+    assert response.status_code == 400
+    assert "Message" in response.get_json()
+
+
+def test_listing_etag(client):
+    client.post("/v1/led/bulk", json={"count": 2})
+    etag = stable_etag(client)
+    response = client.get("/v1/switch", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    client.post("/v1/led/new")
+    response = client.get("/v1/switch", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_query_cursor(client):
+    if not client.get("/v1/switch?mac=CURSOR").get_json()["leds"]:
+        client.post("/v1/led/bulk", json={"macs": MACS})
+    seen = []
+    cursor = ""
+    pages = 0
+    while True:
+        answer = client.get("/v1/switch", query_string={"type": "led", "mac": "CURSOR", "limit": 3,
+                                                         "cursor": cursor, "fields": "mac"}).get_json()
+        pages += 1
+        assert set(answer) == {"cursor", "leds"}
+        assert all(list(led) == ["mac"] for led in answer["leds"])
+        seen += [led["mac"] for led in answer["leds"]]
+        cursor = answer["cursor"]
+        if cursor is None:
+            break
+    assert seen == MACS
+    assert pages == 3
+
+
+def test_query_invalid(client):
+    assert client.get("/v1/switch?type=lamp").status_code == 400
+    assert client.get("/v1/switch?limit=0").status_code == 400
+    for cursor in ["bad", "lamps:1", "groups:x", "leds:"]:
+        response = client.get("/v1/switch", query_string={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.get_json() == {"Message": "Invalid cursor " + cursor}
+    for value in ["yes", "on", "TRUE", ""]:
+        assert client.get("/v1/switch", query_string={"auto": value}).status_code == 400
+        assert client.get("/v1/switch", query_string={"isConfigured": value}).status_code == 400
+    assert client.get("/v1/switch?cursor=groups:1&auto=0&isConfigured=false").status_code == 200
+
+
+def test_group_statistics(client):
+    groups = client.get("/v1/group/statistics").get_json()["groups"]
+    assert all(set(group) == {"group", "temperature", "brightness", "presence"} for group in groups)
+    assert client.get("/v1/group/statistics?group=999").status_code == 400
+
+
+def test_diagnostic_events_pages(client):
+    client.post("/v1/led/bulk", json={"count": 5})
+    expected = client.get("/v1/switch/diagnostic/events?type=driver_plugged&limit=1000").get_json()
+    assert expected["cursor"] is None
+    expected = [event["id"] for event in expected["events"]]
+    seen = []
+    cursor = 0
+    while cursor is not None:
+        answer = client.get("/v1/switch/diagnostic/events", query_string={"type": "driver_plugged", "limit": 2,
+                                                                          "cursor": cursor}).get_json()
+        assert len(answer["events"]) <= 2
+        assert all(event["type"] == "driver_plugged" for event in answer["events"])
+        seen += [event["id"] for event in answer["events"]]
+        cursor = answer["cursor"]
+    assert len(seen) >= 5
+    assert seen[:len(expected)] == expected
+    assert client.get("/v1/switch/diagnostic/events?limit=0").status_code == 400
+
+
+@pytest.mark.parametrize("payload", [
+    {"pattern": "step", "rate": "10"},
+    {"pattern": "step", "rate": True},
+    {"pattern": "step", "duration": "1"},
+    {"pattern": "step", "low": "1"},
+    {"pattern": "ramp", "stop": None},
+    {"pattern": "randomWalk", "step": [1]},
+    {"pattern": "step", "publish": "yes"},
+    {"pattern": "step", "rate": 0},
+    {"pattern": "wave"}
+])
+def test_stimulus_invalid_payloads(client, payload):
+    response = client.post("/v1/stimulus", json=payload)
+    assert response.status_code == 400
+    assert "Message" in response.get_json()
+
+
+def test_metrics(client):
+    response = client.get("/v1/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    assert "# TYPE simulator_mqtt_messages_total counter" in lines
+    assert any(line.startswith('simulator_devices{type="led",state="unconfigured"} ') for line in lines)
+
+
+@pytest.mark.parametrize("payload", [None, {}, {"enabled": "true"}, {"enabled": 1}, {"enabled": False, "reset": "yes"}])
+def test_profiler_invalid_settings(client, payload):
+    response = client.post("/v1/debug/profiler", json=payload)
+    assert response.status_code == 400
+    assert "Message" in response.get_json()
+
+
+def test_profiler_settings(client):
+    report = client.post("/v1/debug/profiler", json={"enabled": True, "reset": True}).get_json()
+    assert report["enabled"] is True
+    report = client.post("/v1/debug/profiler", json={"enabled": False}).get_json()
+    assert report["enabled"] is False
+
+
+def test_group_rules_must_be_numbers(client):
+    assert client.post("/v1/group/new", json={"group": 40, "brightness": "high"}).status_code == 400
+    assert client.post("/v1/group/new", json={"group": 40, "presence": True}).status_code == 400
+    response = client.post("/v1/group/new", json={"group": 40, "brightness": 450})
+    assert response.status_code == 200
+    assert response.get_json()["rules"]["brightness"] == 450
+    for rule in ["brightness", "presence", "temperature"]:
+        response = client.post("/v1/group/rules/" + rule, json={"group": 40, rule: "10"})
+        assert response.status_code == 400
+        assert response.get_json() == {"Message": rule.capitalize() + " must be a number"}
+    assert client.post("/v1/group/rules/brightness", json={"group": 40, "brightness": 200}).status_code == 200
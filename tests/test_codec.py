@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.codec import CODECS, KEYS, create_codec, encode_payload, msgpack
+import pytest
+
+DUMP = {
+    "mac": "AB12CD34EF56",
+    "isConfigured": True,
+    "brightness": 42,
+    "temperature": 21.5,
+    "auto": False,
+    "lastResetDate": 0,
+    "unknownField": [1, 2]
+}
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_round_trip(name):
+    if name == "msgpack" and msgpack is None:
+        pytest.skip("msgpack is not installed")
+    codec = create_codec(name)
+    payload = codec.encode(DUMP)
+    assert codec.decode(payload) == DUMP
+    # As received from MQTT
+    assert codec.decode(encode_payload(payload)) == DUMP
+    assert codec.serialize()["encoded"] >= 1
+
+
+def test_compact_keys():
+    codec = create_codec("compact")
+    payload = codec.encode({"brightness": 1, "unknownField": 2})
+    assert payload == '{"' + str(KEYS.index("brightness")) + '":1,"unknownField":2}'
+
+
+def test_encode_payload():
+    assert encode_payload(None) == b""
+    assert encode_payload(12) == b"12"
+    assert encode_payload("é") == "é".encode("utf-8")
+    assert encode_payload(bytearray(b"ab")) == b"ab"
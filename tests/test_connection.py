@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.connection import ConnectionPool
+from network.transport import LoopbackTransport
+
+DUMP = "/read/sensor/AB12CD34EF56/status/dump"
+DUMPS = "/read/sensor/+/status/dump"
+
+
+class Member(object):
+
+    def __init__(self, base_topic):
+        self.base_topic = base_topic
+        self.received = []
+
+    def event_received(self, client, userdata, message):
+        self.received.append(message.topic)
+
+
+def test_shared_subscription_kept_for_the_other_users():
+    transport = LoopbackTransport()
+    pool = ConnectionPool("loopback", 1, transport)
+    pool.connect()
+    first, second = Member("group/1"), Member("group/2")
+    first_client, second_client = pool.attach(first), pool.attach(second)
+    first_client.subscribe(DUMPS)
+    second_client.subscribe(DUMPS)
+    # Subscribed twice by the same user: counted once
+    second_client.subscribe(DUMPS)
+    first_client.unsubscribe(DUMPS)
+    transport.client("sensor").publish(DUMP, "{}")
+    assert first.received == []
+    assert second.received == [DUMP]
+    pool.detach(second)
+    assert pool.subscriptions[pool.connections[0]] == {}
+    transport.client("sensor").publish(DUMP, "{}")
+    assert second.received == [DUMP]
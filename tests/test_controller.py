@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from network.controller import BatchController
+from network.group import Group
+from network.transport import LoopbackTransport
+import paho.mqtt.client as mqtt
+import random
+
+FIELDS = ["auto", "time_to_auto", "slope", "setpoint", "new_setpoint", "refresh_light", "time_leaving",
+          "empty_room", "presence", "current_brightness"]
+
+
+def message(topic, payload):
+    received = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    received.payload = str(payload).encode("utf-8")
+    return received
+
+
+def record_setpoints(group, published):
+    group.leds["LED%d" % group.group_id] = {"topic": "led/LED%d" % group.group_id}
+    group.client.publish = lambda url, value: published.append((group.group_id, value))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_batch_controller_matches_group_tick(seed):
+    rnd = random.Random(seed)
+    transport = LoopbackTransport()
+    controller = BatchController()
+    count = 100
+    plain = [Group("loopback", index, transport=transport) for index in range(count)]
+    batch = [controller.group("loopback", index, transport=transport) for index in range(count)]
+    published = {"plain": [], "batch": []}
+    for index in range(count):
+        batch[index].start()
+        record_setpoints(plain[index], published["plain"])
+        record_setpoints(batch[index], published["batch"])
+        brightness = rnd.choice([None, 100, 300, 500])
+        presence = rnd.choice([None, 3, 10, 30])
+        watchdog = rnd.choice([5, 20, 60])
+        for group in (plain[index], batch[index]):
+            if brightness is not None:
+                group.set_brightness(brightness)
+            if presence is not None:
+                group.set_presence(presence)
+            group.watchdog = watchdog
+
+    for tick in range(150):
+        for index in range(count):
+            draw = rnd.random()
+            if draw < 0.05:
+                operation = ("auto", rnd.choice(["true", "false"]))
+            elif draw < 0.12:
+                operation = ("setpoint", rnd.choice([0, 10, 33, 50, 77, 100, 150, -5]))
+            elif draw < 0.3:
+                operation = ("brightness", rnd.randint(0, 700))
+            elif draw < 0.4:
+                operation = ("presence", rnd.random() < 0.5)
+            else:
+                continue
+            for group in (plain[index], batch[index]):
+                name, value = operation
+                if name == "auto":
+                    group.update_auto_mode(group.client, None, message(group.url_auto, value))
+                elif name == "setpoint":
+                    group.update_led_brigthness(group.client, None, message(group.url_setpoint, value))
+                elif name == "brightness":
+                    group.current_brightness = value
+                else:
+                    group.presence = value
+        for group in plain:
+            group.tick()
+        controller.tick()
+        for index in range(count):
+            assert [getattr(batch[index], field) for field in FIELDS] == \
+                [getattr(plain[index], field) for field in FIELDS], (tick, index)
+            assert batch[index].serialize() == plain[index].serialize()
+
+    # The batch controller only publishes the setpoints that changed
+    last = {}
+    changed = []
+    for group_id, value in published["plain"]:
+        if last.get(group_id, 0) != value:
+            changed.append((group_id, value))
+        last[group_id] = value
+    assert sorted(changed) == sorted(published["batch"])
+
+
+def test_stopped_group_is_not_advanced():
+    transport = LoopbackTransport()
+    controller = BatchController()
+    group = controller.group("loopback", 1, transport=transport)
+    group.start()
+    group.auto = False
+    group.update_led_brigthness(group.client, None, message(group.url_setpoint, 50))
+    group.stop()
+    controller.tick()
+    assert group.setpoint == 0
+
+
+def test_invalid_rule_is_refused():
+    controller = BatchController()
+    group = controller.group("loopback", 1, transport=LoopbackTransport())
+    group.start()
+    group.set_brightness(300)
+    for value in ["500", None, True]:
+        with pytest.raises(ValueError):
+            group.set_brightness(value)
+        with pytest.raises(ValueError):
+            group.set_presence(value)
+    # The previous rule is kept and the controller still ticks
+    assert group.rules == {"brightness": 300}
+    assert controller.rules["brightness"][group.slot] == 300
+    controller.tick()
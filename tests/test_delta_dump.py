@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.group import Group
+from network.sensor import Sensor
+from network.transport import LoopbackTransport
+import random
+
+
+def create_group(sensors, snapshot_period):
+    transport = LoopbackTransport()
+    group = Group("loopback", 1, transport=transport)
+    drivers = []
+    for index in range(sensors):
+        sensor = Sensor("loopback", "SENSOR%06d" % index, 2.3, transport=transport, snapshot_period=snapshot_period)
+        sensor.connect()
+        sensor.is_configured = True
+        group.add_sensor(sensor)
+        drivers.append(sensor)
+    return group, drivers
+
+
+def test_delta_dumps_give_the_full_values():
+    group, sensors = create_group(3, snapshot_period=5)
+    rnd = random.Random(1)
+    for step in range(50):
+        for sensor in sensors:
+            # Most ticks change nothing or one value
+            if rnd.random() < 0.3:
+                sensor.brightness_raw = rnd.randint(0, 1000)
+            if rnd.random() < 0.3:
+                sensor.temperature_raw = rnd.randint(150, 300)
+            if rnd.random() < 0.2:
+                sensor.presence = not sensor.presence
+            sensor.publish_dump()
+        dumps = [sensor.serialize() for sensor in sensors]
+        assert group.current_brightness == int(sum(dump["brightness"] for dump in dumps) / len(dumps))
+        assert group.current_temperature == sum(dump["temperature"] for dump in dumps) / len(dumps)
+        assert group.presence == any(dump["presence"] for dump in dumps)
+
+
+def test_delta_dump_content():
+    group, sensors = create_group(1, snapshot_period=3)
+    sensor = sensors[0]
+    payloads = []
+    sensor.client.publish = lambda topic, payload: payloads.append(sensor.codec.decode(payload))
+    first = sensor.serialize()
+    sensor.publish_dump()
+    sensor.brightness_raw = 120
+    sensor.publish_dump()
+    # Nothing changed: nothing published
+    sensor.publish_dump()
+    sensor.publish_dump()
+    assert payloads[0] == first
+    assert payloads[1] == {"mac": sensor.mac, "brightness": 120, "brightnessRaw": 120}
+    # Full snapshot every 3 dumps
+    assert len(payloads) == 3
+    assert payloads[2] == sensor.serialize()
+
+
+def test_reset_sensor_values_are_forgotten():
+    group, sensors = create_group(2, snapshot_period=10)
+    for sensor, brightness in zip(sensors, [100, 300]):
+        sensor.brightness_raw = brightness
+        sensor.publish_dump()
+    assert group.current_brightness == 200
+    sensors[0].is_configured = False
+    sensors[0].publish_dump()
+    assert group.current_brightness == 300
+    assert group.counts["brightness"] == 1
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.clock import VirtualClock
+from network.diagnostic import EventLog
+
+
+def create_log(size=100):
+    clock = VirtualClock(start=1000)
+    log = EventLog(size, clock)
+    for i in range(10):
+        clock.advance(1000 + i)
+        log.add("driver_plugged" if i % 2 else "group_rule", "event " + str(i), mac="MAC" + str(i % 3),
+                group=i % 2)
+    return log
+
+
+def test_query_filters():
+    log = create_log()
+    events, cursor = log.query(event_type="group_rule")
+    assert [event["id"] for event in events] == [1, 3, 5, 7, 9]
+    assert cursor is None
+    events, _ = log.query(mac="MAC0", group=1)
+    assert [event["id"] for event in events] == [4, 10]
+    events, _ = log.query(since=1003, until=1005)
+    assert [event["date"] for event in events] == [1003, 1004, 1005]
+
+
+def test_query_pages():
+    log = create_log()
+    seen = []
+    cursor = 0
+    pages = 0
+    while cursor is not None:
+        events, cursor = log.query(group=0, cursor=cursor, limit=2)
+        seen += [event["id"] for event in events]
+        pages += 1
+    assert seen == [1, 3, 5, 7, 9]
+    assert pages == 3
+
+
+def test_query_after_eviction():
+    log = create_log(size=4)
+    assert len(log) == 4
+    # The cursor points before the oldest kept event: start from the oldest one
+    events, cursor = log.query(cursor=2, limit=2)
+    assert [event["id"] for event in events] == [7, 8]
+    events, cursor = log.query(cursor=cursor, limit=2)
+    assert [event["id"] for event in events] == [9, 10]
+    assert cursor is None
+    assert [event["id"] for event in log.latest(3)] == [8, 9, 10]
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.engine import AsyncScheduler, AsyncConnectionPool
+from network.led import Led
+from network.transport import LoopbackTransport
+import paho.mqtt.client as mqtt
+import pytest
+import socket
+import threading
+import time
+
+
+# Paho client stand-in: the socket callbacks are called as paho does, the loop calls are counted
+class SocketClient(object):
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.reads = 0
+        self.writes = 0
+        self.misc = 0
+        self.reconnects = 0
+        self.on_socket_register_write = None
+
+    def connect(self, host=None, *args, **kwargs):
+        self.on_socket_open(self, None, self.sock)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        self.reconnects += 1
+
+    def disconnect(self):
+        self.on_socket_close(self, None, self.sock)
+
+    def loop_read(self):
+        self.sock.recv(1024)
+        self.reads += 1
+
+    def loop_write(self):
+        self.writes += 1
+        self.on_socket_unregister_write(self, None, self.sock)
+
+    def loop_misc(self):
+        self.misc += 1
+        # Lost on the first call: the pool reconnects
+        return mqtt.MQTT_ERR_NO_CONN if self.misc == 1 else mqtt.MQTT_ERR_SUCCESS
+
+
+class SocketTransport(object):
+
+    def __init__(self):
+        self.clients = []
+
+    def client(self, client_id):
+        self.clients.append(SocketClient())
+        return self.clients[-1]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = AsyncScheduler(period=0.01)
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_pool_sockets_run_on_the_loop(scheduler):
+    transport = SocketTransport()
+    pool = AsyncConnectionPool("127.0.0.1", 2, scheduler=scheduler, transport=transport)
+    pool.connect()
+    first, second = transport.clients
+    assert wait_for(lambda: first.misc and second.misc)
+    assert first.reconnects == 1
+    first.peer.send(b"x")
+    assert wait_for(lambda: first.reads == 1)
+    assert second.reads == 0
+    second.on_socket_register_write(second, None, second.sock)
+    # Written once, then unregistered
+    assert wait_for(lambda: second.writes == 1)
+    time.sleep(0.05)
+    assert second.writes == 1
+    pool.disconnect()
+    first.peer.send(b"x")
+    time.sleep(0.05)
+    assert first.reads == 1
+
+
+def test_led_ticks_on_the_loop(scheduler):
+    transport = LoopbackTransport()
+    pool = AsyncConnectionPool("loopback", 1, scheduler=scheduler, transport=transport)
+    pool.connect()
+    threads = set()
+    listener = transport.client("listener")
+    listener.connect()
+    listener.on_message = lambda client, userdata, message: threads.add(threading.current_thread().name)
+    listener.subscribe("/read/led/+/setup/hello")
+    led = Led("loopback", "AB12CD34EF56", 2.3, scheduler=scheduler, pool=pool, transport=transport)
+    led.start()
+    # The hellos are published by the ticks, on the loop thread
+    assert wait_for(lambda: threads)
+    assert threads == {"SimulationLoop"}
+    led.stop()
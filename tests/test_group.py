@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.group import Group
+from network.scheduler import Scheduler
+from network.sensor import Sensor
+from network.transport import LoopbackTransport
+import json
+import types
+
+
+def create_group(count):
+    # Scheduler never started: the group and the sensors do not tick
+    transport = LoopbackTransport()
+    scheduler = Scheduler()
+    group = Group("loopback", 5, scheduler=scheduler, transport=transport)
+    sensors = []
+    for i in range(count):
+        sensor = Sensor("loopback", "SENSOR00000" + str(i), 2.3, scheduler=scheduler, transport=transport)
+        group.add_sensor(sensor)
+        sensors.append(sensor)
+    return group, sensors
+
+
+def send_dump(group, sensor, dump):
+    message = types.SimpleNamespace(topic="/read/" + sensor.base_topic + "/status/dump",
+                                    payload=json.dumps(dump).encode("utf-8"))
+    group.event_received(None, None, message)
+
+
+def test_aggregates_follow_the_dumps():
+    group, sensors = create_group(3)
+    send_dump(group, sensors[0], {"temperature": 200, "brightness": 100, "presence": False})
+    send_dump(group, sensors[1], {"temperature": 220, "brightness": 301})
+    assert group.current_temperature == 210
+    assert group.current_brightness == 200
+    assert group.presence is False
+
+    # A delta dump only replaces the value it carries
+    send_dump(group, sensors[0], {"brightness": 201, "presence": True})
+    assert group.current_temperature == 210
+    assert group.current_brightness == 251
+    assert group.presence is True
+
+    # A reset sensor is forgotten
+    send_dump(group, sensors[0], {"isConfigured": False})
+    assert group.current_temperature == 220
+    assert group.current_brightness == 301
+    assert group.presence is False
+
+    group.remove_sensor(sensors[1])
+    assert group.current_temperature == 0
+    assert group.current_brightness == 0
+    assert group.totals == {"temperature": 0, "brightness": 0, "presence": 0}
+    assert group.counts == {"temperature": 0, "brightness": 0, "presence": 0}
+
+
+def test_statistics():
+    group, sensors = create_group(3)
+    assert group.statistics() == {
+        "group": 5,
+        "temperature": {"count": 0, "mean": 0, "min": 0, "max": 0},
+        "brightness": {"count": 0, "mean": 0, "min": 0, "max": 0},
+        "presence": {"count": 0, "present": 0}
+    }
+    send_dump(group, sensors[0], {"temperature": 180, "brightness": 50, "presence": True})
+    send_dump(group, sensors[1], {"temperature": 240, "presence": True})
+    send_dump(group, sensors[2], {"temperature": 210, "presence": False})
+    assert group.statistics() == {
+        "group": 5,
+        "temperature": {"count": 3, "mean": 210, "min": 180, "max": 240},
+        "brightness": {"count": 1, "mean": 50, "min": 50, "max": 50},
+        "presence": {"count": 3, "present": 2}
+    }
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.latency import CommandTracer, LatencyHistogram, load_histogram, merge_latencies
+
+
+def test_applied_command():
+    tracer = CommandTracer()
+    tracer.start("led_brightness", ["AB"], 50)
+    # Another value is not the commanded one
+    tracer.applied("AB", 20)
+    assert tracer.serialize()["commands"]["led_brightness"]["pending"] == 1
+    tracer.applied("AB", 50)
+    command = tracer.serialize()["commands"]["led_brightness"]
+    assert (command["count"], command["pending"]) == (1, 0)
+
+
+def test_unchanged_command_is_not_pending():
+    tracer = CommandTracer()
+    tracer.start("group_setpoint", ["AB", "CD"], 30, unchanged=True)
+    command = tracer.serialize()["commands"]["group_setpoint"]
+    assert (command["count"], command["max"], command["pending"], command["expired"]) == (2, 0, 0, 0)
+
+
+def test_superseded_and_expired():
+    tracer = CommandTracer()
+    tracer.start("led_brightness", ["AB"], 50)
+    tracer.start("led_brightness", ["AB"], 60)
+    command = tracer.serialize()["commands"]["led_brightness"]
+    assert (command["superseded"], command["expired"], command["pending"]) == (1, 0, 1)
+    tracer.timeout = 0
+    command = tracer.serialize()["commands"]["led_brightness"]
+    assert (command["superseded"], command["expired"], command["pending"]) == (1, 1, 0)
+
+
+def test_histogram_serialization_round_trip():
+    histogram = LatencyHistogram()
+    for latency in [0.0005, 0.003, 0.003, 0.4, 200]:
+        histogram.add(latency)
+    data = histogram.serialize()
+    assert data["p50"] == 0.005
+    assert data["max"] == 200
+    assert load_histogram(data).serialize() == data
+    merged = merge_latencies([{"commands": {"led": dict(data, pending=1)}},
+                              {"commands": {"led": dict(data, pending=2)}}])["commands"]["led"]
+    assert (merged["count"], merged["pending"]) == (10, 3)
+
+
+def test_expire_only_the_oldest_commands():
+    tracer = CommandTracer(timeout=10)
+    tracer.start("led_brightness", ["AB", "CD"], 50)
+    tracer.applied("AB", 50)
+    tracer.start("led_brightness", ["CD", "EF"], 60)
+    # The commands of the first start were published 20 seconds ago
+    for index in range(2):
+        published, mac, command_id = tracer.deadlines[index]
+        tracer.deadlines[index] = (published - 20, mac, command_id)
+    command = tracer.serialize()["commands"]["led_brightness"]
+    # AB was applied and CD superseded: their entries are dropped without expiring anything
+    assert (command["count"], command["superseded"], command["expired"], command["pending"]) == (1, 1, 0, 2)
+    assert [mac for _, mac, _ in tracer.deadlines] == ["CD", "EF"]
+    tracer.timeout = -1
+    command = tracer.serialize()["commands"]["led_brightness"]
+    assert (command["expired"], command["pending"]) == (2, 0)
+    assert not tracer.deadlines
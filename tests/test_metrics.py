@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.latency import LatencyHistogram
+from network.metrics import CALLBACK_BUCKETS, handler_name, merge_metrics, render_metrics, topic_class
+import functools
+
+
+def snapshot(count=1):
+    callbacks = LatencyHistogram(CALLBACK_BUCKETS)
+    commands = LatencyHistogram([0.1, 1])
+    for _ in range(count):
+        callbacks.add(0.00003)
+        commands.add(0.5)
+    return {
+        "messages": {"in": {"dump": 3 * count}, "out": {"hello": count}},
+        "callbacks": {'Led."quoted"': callbacks.serialize()},
+        "publishQueue": {"depth": count, "max": count, "connections": 2},
+        "threads": 5,
+        "devices": {"led": {"unconfigured": count, "auto": 0, "manual": 0}},
+        "groups": {"auto": count, "manual": 0},
+        "commands": {"led_brightness": dict(commands.serialize(), pending=count)}
+    }
+
+
+def test_topic_class_and_handler_name():
+    assert topic_class("/read/led/AB12CD34EF56/status/dump") == "dump"
+    assert topic_class("/write/led/AB12CD34EF56/config/watchdog") == "other"
+
+    class Driver(object):
+        def received(self, message):
+            pass
+
+    assert handler_name(Driver().received) == "Driver.received"
+    assert handler_name(functools.partial(Driver().received)) == "Driver.received"
+
+
+def test_render():
+    lines = render_metrics(snapshot()).splitlines()
+    assert 'simulator_mqtt_messages_total{direction="in",topic="dump"} 3' in lines
+    assert 'simulator_mqtt_messages_total{direction="out",topic="hello"} 1' in lines
+    # Label values are escaped, the buckets are cumulative and end with +Inf
+    assert 'simulator_callback_seconds_bucket{handler="Led.\\"quoted\\"",le="2e-05"} 0' in lines
+    assert 'simulator_callback_seconds_bucket{handler="Led.\\"quoted\\"",le="5e-05"} 1' in lines
+    assert 'simulator_callback_seconds_bucket{handler="Led.\\"quoted\\"",le="+Inf"} 1' in lines
+    assert 'simulator_callback_seconds_count{handler="Led.\\"quoted\\""} 1' in lines
+    assert "simulator_publish_queue_depth 1" in lines
+    assert "simulator_mqtt_connections 2" in lines
+    assert "simulator_threads 5" in lines
+    assert 'simulator_devices{type="led",state="unconfigured"} 1' in lines
+    assert 'simulator_groups{state="auto"} 1' in lines
+    assert 'simulator_command_latency_seconds_bucket{command="led_brightness",le="1.0"} 1' in lines
+    assert 'simulator_command_latency_seconds_sum{command="led_brightness"} 0.5' in lines
+    # Every metric has its HELP and TYPE lines before its samples
+    names = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    for line in lines:
+        if not line.startswith("#"):
+            assert any(line.startswith(name) for name in names)
+
+
+def test_merge_shards():
+    merged = merge_metrics([snapshot(1), snapshot(2)])
+    assert merged["messages"] == {"in": {"dump": 9}, "out": {"hello": 3}}
+    assert merged["publishQueue"] == {"depth": 3, "max": 2, "connections": 4}
+    assert merged["threads"] == 10
+    assert merged["callbacks"]['Led."quoted"']["count"] == 3
+    assert (merged["commands"]["led_brightness"]["count"], merged["commands"]["led_brightness"]["pending"]) == (3, 3)
+    assert "simulator_groups{state=\"auto\"} 3" in render_metrics(merged).splitlines()
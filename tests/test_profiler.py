@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.driver import error_management
+from network.profiler import HandlerProfiler, merge_reports, profiler
+
+
+class Device(object):
+
+    @error_management
+    def received(self, value):
+        return 10 // value
+
+
+def test_report():
+    handlers = HandlerProfiler()
+    handlers.enable()
+    assert handlers.since is not None
+    for seconds in [0.1, 0.3]:
+        handlers.record("Led.update", seconds)
+    handlers.record("Sensor.update", 0.5, failed=True)
+    report = handlers.report(top=1, sort="calls")
+    assert [handler["handler"] for handler in report["handlers"]] == ["Led.update"]
+    led = report["handlers"][0]
+    assert (led["calls"], led["max"], led["errors"]) == (2, 0.3, 0)
+    assert abs(led["total"] - 0.4) < 1e-9 and abs(led["mean"] - 0.2) < 1e-9
+    report = handlers.report(top=0, sort="errors")
+    assert [handler["handler"] for handler in report["handlers"]] == ["Sensor.update", "Led.update"]
+    handlers.reset()
+    assert handlers.report()["handlers"] == []
+    handlers.enable(False)
+    handlers.reset()
+    assert handlers.report() == {"enabled": False, "since": None, "handlers": []}
+
+
+def test_error_management_records_the_calls():
+    device = Device()
+    # Errors are logged, not raised, also when the profiler is off
+    assert device.received(0) is None
+    profiler.reset()
+    profiler.enable()
+    try:
+        assert device.received(2) == 5
+        assert device.received(0) is None
+        report = profiler.report(top=0)
+    finally:
+        profiler.enable(False)
+        profiler.reset()
+    handler = next(handler for handler in report["handlers"] if handler["handler"] == "Device.received")
+    assert (handler["calls"], handler["errors"]) == (2, 1)
+
+
+def test_merge_reports():
+    first = {"enabled": True, "since": 20, "handlers": [
+        {"handler": "Led.update", "calls": 2, "total": 0.4, "mean": 0.2, "max": 0.3, "errors": 0}]}
+    second = {"enabled": False, "since": None, "handlers": [
+        {"handler": "Led.update", "calls": 2, "total": 1.2, "mean": 0.6, "max": 1.0, "errors": 1},
+        {"handler": "Group.update", "calls": 1, "total": 0.1, "mean": 0.1, "max": 0.1, "errors": 0}]}
+    merged = merge_reports([first, second], top=1)
+    assert (merged["enabled"], merged["since"]) == (True, 20)
+    assert merged["handlers"] == [{"handler": "Led.update", "calls": 4, "total": 1.6, "mean": 0.4, "max": 1.0,
+                                   "errors": 1}]
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.recording import TrafficRecorder, TrafficReplayer, merge_recordings, read_records, recorder
+from network.transport import LoopbackTransport
+import pytest
+
+
+class Publisher(object):
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+        return self
+
+    def wait_for_publish(self):
+        pass
+
+
+def test_record_and_read(tmp_path):
+    path = str(tmp_path / "capture.rec")
+    traffic = TrafficRecorder()
+    traffic.start(path)
+    traffic.record("out", "/read/led/AB/status/dump", '{"brightness": 10}')
+    traffic.record("in", "/write/led/AB/base/setpoint", 20)
+    traffic.record("out", "/read/led/AB/setup/hello", None)
+    traffic.stop()
+    records = list(read_records(path))
+    assert [record[1:] for record in records] == [
+        ("out", "/read/led/AB/status/dump", b'{"brightness": 10}'),
+        ("in", "/write/led/AB/base/setpoint", b"20"),
+        ("out", "/read/led/AB/setup/hello", b"")
+    ]
+    assert records[0][0] <= records[1][0] <= records[2][0]
+    assert traffic.serialize()["records"] == 3
+    # A new recording is appended to the file
+    traffic.start(path)
+    traffic.record("out", "a", "b")
+    traffic.stop()
+    assert len(list(read_records(path))) == 4
+
+
+def test_truncated_and_invalid_files(tmp_path):
+    path = str(tmp_path / "capture.rec")
+    traffic = TrafficRecorder()
+    traffic.start(path)
+    traffic.record("out", "topic", "payload")
+    traffic.record("out", "topic", "payload")
+    traffic.stop()
+    with open(path, "rb") as stream:
+        data = stream.read()
+    with open(path, "wb") as stream:
+        stream.write(data[:-3])
+    assert len(list(read_records(path))) == 1
+    invalid = str(tmp_path / "invalid.rec")
+    with open(invalid, "wb") as stream:
+        stream.write(b"not a recording")
+    with pytest.raises(ValueError):
+        list(read_records(invalid))
+
+
+def test_loopback_traffic_is_recorded_and_replayed(tmp_path):
+    path = str(tmp_path / "capture.rec")
+    transport = LoopbackTransport()
+    subscriber = transport.client("subscriber")
+    subscriber.on_message = lambda client, userdata, message: None
+    subscriber.subscribe("/read/#")
+    recorder.start(path)
+    try:
+        for brightness in range(5):
+            transport.client("led").publish("/read/led/AB/status/dump", str(brightness))
+    finally:
+        recorder.stop()
+    records = list(read_records(path))
+    assert sorted(set(record[1] for record in records)) == ["in", "out"]
+    publisher = Publisher()
+    report = TrafficReplayer(publisher, speed=0).run(records)
+    # Only the published messages are replayed
+    assert publisher.published == [("/read/led/AB/status/dump", str(brightness).encode("utf-8"))
+                                   for brightness in range(5)]
+    assert report["messages"] == 5
+    assert report["bytes"] == 5
+
+
+def test_replay_keeps_the_spacing():
+    records = [(100.0, "out", "a", b"1"), (100.2, "out", "a", b"2"), (150.0, "out", "a", b"3")]
+    publisher = Publisher()
+    # The 50 s pause is shortened to 0.2 s, replayed twice faster
+    report = TrafficReplayer(publisher, speed=2, max_gap=0.2).run(records)
+    assert len(publisher.published) == 3
+    assert report["recordedSeconds"] == pytest.approx(0.4)
+    assert report["elapsed"] == pytest.approx(0.2, abs=0.1)
+
+
+def test_merge_recordings():
+    merged = merge_recordings([
+        {"recording": True, "file": "a.0", "records": 2, "bytes": 20, "since": 20},
+        {"recording": False, "file": "a.1", "records": 3, "bytes": 30, "since": None}
+    ])
+    assert merged == {"recording": True, "file": ["a.0", "a.1"], "records": 5, "bytes": 50, "since": 20}
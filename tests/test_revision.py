@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.revision import RevisionCounter, Versioned, revisions
+from network.snapshot import FleetSnapshot
+import json
+import threading
+
+
+class Entity(Versioned):
+
+    unversioned = frozenset(["cache"])
+
+    def __init__(self, mac):
+        self.mac = mac
+        self.brightness = 0
+
+    def serialize(self):
+        return {"mac": self.mac, "brightness": self.brightness}
+
+
+class Fleet(object):
+
+    def __init__(self, leds):
+        self.leds = leds
+
+    def list_leds(self):
+        return self.leds
+
+    def list_sensors(self):
+        return []
+
+    def list_blinds(self):
+        return []
+
+    def list_groups(self):
+        return []
+
+
+def test_counter_is_monotonic_across_threads():
+    counter = RevisionCounter()
+    seen = []
+
+    def bump():
+        revisions = [counter.next() for _ in range(10000)]
+        seen.append(revisions == sorted(revisions))
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == [True] * 4
+    assert counter.last == 40000
+
+
+def test_versioned_changes():
+    entity = Entity("AB")
+    revision = entity.revision
+    # Same value, unversioned and private attributes keep the revision
+    entity.brightness = 0
+    entity.cache = {}
+    entity._private = 1
+    assert entity.revision == revision
+    entity.brightness = 10
+    assert entity.revision > revision
+    assert revisions.last >= entity.revision
+    revision = entity.revision
+    entity.touch()
+    assert entity.revision > revision
+
+
+def test_snapshot_version():
+    leds = [Entity("AB"), Entity("CD")]
+    snapshot = FleetSnapshot(Fleet(leds))
+    version, body = snapshot.encoded()
+    assert json.loads(body)["leds"] == [led.serialize() for led in leds]
+    # Same version and body while nothing changed
+    assert snapshot.encoded() == (version, body)
+    leds[1].brightness = 50
+    new_version, new_body = snapshot.encoded()
+    assert new_version > version
+    assert json.loads(new_body)["leds"][1]["brightness"] == 50
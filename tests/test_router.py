@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.router import TopicRouter
+
+
+def handlers(router, topic):
+    return sorted(router.match(topic))
+
+
+def test_exact_filter():
+    router = TopicRouter()
+    router.add("/read/sensor/AB/status/dump", "dump")
+    assert handlers(router, "/read/sensor/AB/status/dump") == ["dump"]
+    assert handlers(router, "/read/sensor/CD/status/dump") == []
+    assert handlers(router, "/read/sensor/AB/status") == []
+
+
+def test_wildcards():
+    router = TopicRouter()
+    router.add("/read/+/+/setup/hello", "hello")
+    router.add("/write/group/1/#", "group")
+    assert handlers(router, "/read/led/AB/setup/hello") == ["hello"]
+    assert handlers(router, "/read/led/AB/setup/config") == []
+    assert handlers(router, "/write/group/1/config/setpoint") == ["group"]
+    # # also matches its parent level
+    assert handlers(router, "/write/group/1") == ["group"]
+    assert handlers(router, "/write/group/12/config/setpoint") == []
+
+
+def test_overlapping_filters():
+    router = TopicRouter()
+    router.add("a/#", "all")
+    router.add("a/+", "one")
+    router.add("a/b", "exact")
+    assert handlers(router, "a/b") == ["all", "exact", "one"]
+    assert handlers(router, "a/b/c") == ["all"]
+
+
+def test_remove_prunes():
+    router = TopicRouter()
+    router.add("a/b/c", "first")
+    router.add("a/b/c", "second")
+    router.remove("a/b/c", "first")
+    assert handlers(router, "a/b/c") == ["second"]
+    router.remove("a/b/c", "second")
+    assert handlers(router, "a/b/c") == []
+    assert router.root.children == {}
+    # Unknown filters are ignored
+    router.remove("x/y")
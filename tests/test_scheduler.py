@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.clock import VirtualClock
+from network.scheduler import Scheduler
+from network.engine import AsyncScheduler
+import pytest
+import threading
+import time
+
+
+# Entity recording the simulated time of its ticks, action(entity) being called on every tick
+class Ticker(object):
+
+    def __init__(self, clock, action=None):
+        self.clock = clock
+        self.action = action
+        self.ticks = []
+        self.lock = threading.Lock()
+
+    def tick(self):
+        with self.lock:
+            self.ticks.append(self.clock.time())
+        if self.action:
+            self.action(self)
+
+    def recorded(self):
+        with self.lock:
+            return list(self.ticks)
+
+
+def wait_ticks(entity, count, timeout=5):
+    deadline = time.time() + timeout
+    while len(entity.ticks) < count and time.time() < deadline:
+        time.sleep(0.001)
+    return entity.recorded()
+
+
+@pytest.fixture(params=["threads", "asyncio"])
+def lockstep(request):
+    # Not started: the tests register their entities first
+    clock = VirtualClock(start=1000)
+    if request.param == "threads":
+        scheduler = Scheduler(period=1, workers=2, clock=clock)
+    else:
+        scheduler = AsyncScheduler(period=1, clock=clock)
+    yield scheduler, clock
+    scheduler.stop()
+
+
+def test_lockstep_ticks_in_phase(lockstep):
+    scheduler, clock = lockstep
+    first, second = Ticker(clock), Ticker(clock)
+    scheduler.add(first)
+    scheduler.add(second)
+    scheduler.start()
+    ticks = wait_ticks(first, 20)[:20]
+    # One tick per simulated second, both entities at the same deadlines
+    assert ticks == [1000 + index for index in range(20)]
+    assert wait_ticks(second, 20)[:20] == ticks
+
+
+def test_remove(lockstep):
+    scheduler, clock = lockstep
+
+    def leave(entity):
+        if len(entity.ticks) == 5:
+            scheduler.remove(entity)
+
+    removed, kept = Ticker(clock, leave), Ticker(clock)
+    scheduler.add(removed)
+    scheduler.add(kept)
+    scheduler.start()
+    wait_ticks(kept, 20)
+    assert removed.recorded() == [1000, 1001, 1002, 1003, 1004]
+
+
+def test_add_again_ticks_once(lockstep):
+    scheduler, clock = lockstep
+
+    def restart(entity):
+        if len(entity.ticks) == 3:
+            # Removed then added before its next entry is dropped: still one tick per period
+            scheduler.remove(entity)
+            scheduler.add(entity)
+
+    entity = Ticker(clock, restart)
+    scheduler.add(entity)
+    scheduler.start()
+    ticks = wait_ticks(entity, 30)
+    # The add may tick once more at the deadline being ticked
+    later = ticks[4:]
+    assert len(later) >= 20
+    assert later == sorted(set(later))
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.led import Led
+from network.scheduler import Scheduler
+from network.shard import ShardCoordinator, merge_counters, shard_of_group, shard_of_mac
+from network.transport import LoopbackTransport
+from werkzeug.datastructures import ETags
+import threading
+
+
+# Shard answering its /v1/switch listing and ETag like the shard API
+class Shard(object):
+
+    def __init__(self, index, leds):
+        self.index = index
+        self.leds = leds
+        self.version = 1
+        self.fetched = 0
+
+    def conditional(self, path, etag):
+        if etag == str(self.version):
+            return 304, None, etag
+        self.fetched += 1
+        return 200, {"leds": list(self.leds), "sensors": [], "blinds": [], "groups": []}, str(self.version)
+
+
+def test_listing_etag_is_made_of_the_shard_ones():
+    shards = [Shard(0, [{"mac": "A"}]), Shard(1, [{"mac": "B"}])]
+    coordinator = ShardCoordinator(shards)
+    status, listing, etag = coordinator.conditional_listing(None)
+    assert status == 200
+    assert [led["mac"] for led in listing["leds"]] == ["A", "B"]
+    status, listing, same = coordinator.conditional_listing(ETags([etag]))
+    assert (status, listing, same) == (304, None, etag)
+    # Only the changed shard is fetched again
+    shards[1].leds.append({"mac": "C"})
+    shards[1].version += 1
+    status, listing, changed = coordinator.conditional_listing(ETags([etag]))
+    assert status == 200
+    assert changed != etag
+    assert [led["mac"] for led in listing["leds"]] == ["A", "B", "C"]
+    assert [shard.fetched for shard in shards] == [1, 2]
+
+
+# Shard whose listing and ETag change together: listing n has n leds
+class GrowingShard(object):
+
+    def __init__(self, index):
+        self.index = index
+        self.current = (0, [])
+
+    def grow(self):
+        version, leds = self.current
+        self.current = (version + 1, leds + [{"mac": "B" + str(version)}])
+
+    def conditional(self, path, etag):
+        version, leds = self.current
+        if etag == str(version):
+            return 304, None, etag
+        return 200, {"leds": leds}, str(version)
+
+
+def test_concurrent_listings():
+    shards = [Shard(0, [{"mac": "A"}]), GrowingShard(1)]
+    coordinator = ShardCoordinator(shards)
+    failures = []
+
+    def list_again():
+        for _ in range(50):
+            status, listing, etag = coordinator.conditional_listing(None)
+            # Every merged listing matches its ETag
+            if status != 200 or len(listing["leds"]) != 1 + int(etag.split(".")[1]):
+                failures.append((status, listing, etag))
+
+    threads = [threading.Thread(target=list_again) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(50):
+        shards[1].grow()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+
+
+# Shard process stand-in: the drivers are Led objects never started
+class DriverShard(object):
+
+    def __init__(self, index):
+        self.index = index
+        self.transport = LoopbackTransport()
+        self.drivers = {}
+
+    def add(self, mac):
+        self.drivers[mac] = Led("loopback", mac, 2.3, scheduler=Scheduler(), transport=self.transport)
+        return self.drivers[mac]
+
+    def call(self, command, *args):
+        if command == "has_driver":
+            return args[0] in self.drivers
+        if command == "unplug_driver":
+            driver = self.drivers.pop(args[0])
+            return "led", driver.state()
+        if command == "restore_driver":
+            return self.drivers[args[0]].restore(args[1])
+
+    def request(self, method, path, args=None, body=None):
+        if path == "/v1/led/bulk":
+            return 200, {"leds": [self.add(mac).serialize() for mac in body["macs"]]}
+        return 200, {}
+
+
+def test_move_carries_the_driver_state():
+    shards = [DriverShard(0), DriverShard(1)]
+    coordinator = ShardCoordinator(shards)
+    led = shards[0].add("AB12CD34EF56")
+    led.is_configured = True
+    led.i_max = 700
+    led.brightness = 42
+    led.reset_numbers = 3
+    expected = led.serialize()
+    assert coordinator.move("AB12CD34EF56", 1) is None
+    assert "AB12CD34EF56" not in shards[0].drivers
+    assert shards[1].drivers["AB12CD34EF56"].serialize() == expected
+    assert coordinator.owner("AB12CD34EF56") == 1
+
+
+def test_invalid_group():
+    coordinator = ShardCoordinator([DriverShard(0), DriverShard(1)])
+    for group_id in ["x", 1.5, True, [1]]:
+        for path in ["/v1/group/new", "/v1/group/add", "/v1/group/setpoint"]:
+            status, answer = coordinator.route("POST", path, {}, {"group": group_id, "mac": "AB12CD34EF56"})
+            assert status == 400
+            assert answer == {"Message": "Invalid group " + str(group_id)}
+    status, _ = coordinator.route("GET", "/v1/group/statistics", {"group": "x"}, None)
+    assert status == 400
+    assert coordinator.route("GET", "/v1/group/statistics", {"group": "3"}, None) == (200, {})
+
+
+def test_partitions():
+    assert shard_of_group(5, 4) == 1
+    assert shard_of_mac("AB12CD34EF56", 4) == shard_of_mac("AB12CD34EF56", 4) < 4
+
+
+def test_merge_counters():
+    merged = merge_counters([{"codec": "json", "encoded": 2, "encodeTime": 0.5, "flag": True},
+                             {"codec": "json", "encoded": 3, "encodeTime": 0.25, "flag": True}])
+    assert merged == {"codec": "json", "encoded": 5, "encodeTime": 0.75, "flag": True}
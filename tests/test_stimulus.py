@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.codec import default_codec
+from network.scheduler import Scheduler
+from network.sensor import Sensor
+from network.stimulus import LoadGenerator, create_pattern
+from network.transport import LoopbackTransport
+import types
+
+DUMPS = "/read/sensor/+/status/dump"
+
+
+def create_sensors(count, snapshot_period=0):
+    # Configured sensors on a scheduler never started: the tests tick them
+    transport = LoopbackTransport()
+    sensors = []
+    for i in range(count):
+        sensor = Sensor("loopback", "SENSOR00000" + str(i), 2.3, scheduler=Scheduler(), transport=transport,
+                        snapshot_period=snapshot_period)
+        sensor.start()
+        sensor.is_configured = True
+        sensors.append(sensor)
+    return transport, sensors
+
+
+def listen(transport):
+    # Last known dump of every sensor, the delta dumps being merged
+    dumps = {}
+
+    def received(client, userdata, message):
+        dump = default_codec.decode(message.payload)
+        dumps.setdefault(message.topic, {}).update(dump)
+
+    listener = transport.client("listener")
+    listener.on_message = received
+    listener.subscribe(DUMPS)
+    return dumps
+
+
+def test_patterns():
+    sensor = types.SimpleNamespace(mac="AB12CD34EF56")
+    step = create_pattern("step", {"low": 1, "high": 9, "at": 10, "period": 20, "rate": 5})
+    assert [step.value(sensor, elapsed) for elapsed in [0, 10, 19, 20, 35]] == [1, 9, 9, 1, 9]
+    ramp = create_pattern("ramp", {"start": 100, "stop": 200, "duration": 10})
+    assert [ramp.value(sensor, elapsed) for elapsed in [0, 5, 10, 60]] == [100, 150, 200, 200]
+    walk = create_pattern("randomWalk", {"start": 50, "step": 5, "minimum": 48, "maximum": 52})
+    values = [walk.value(sensor, 0) for _ in range(100)]
+    assert all(48 <= value <= 52 for value in values)
+
+
+def test_generator_sets_the_inputs():
+    transport, sensors = create_sensors(3)
+    dumps = listen(transport)
+    generator = LoadGenerator(sensors, "brightness", create_pattern("step", {"low": 7, "high": 7}), 300,
+                              duration=0.1, publish=True)
+    generator.start()
+    generator.join(5)
+    state = generator.serialize()
+    assert not state["running"]
+    assert 0 < state["events"] <= 31
+    assert state["messages"] == state["events"]
+    assert state["errors"] == 0
+    assert [sensor.brightness_raw for sensor in sensors] == [7, 7, 7]
+    assert len(dumps) == 3
+    assert all(dump["brightness"] == 7 for dump in dumps.values())
+
+
+def test_generator_and_ticks_publish_consistent_deltas():
+    transport, sensors = create_sensors(1, snapshot_period=1000)
+    sensor = sensors[0]
+    dumps = listen(transport)
+    pattern = create_pattern("randomWalk", {"start": 50, "step": 50, "minimum": 0, "maximum": 1000})
+    generator = LoadGenerator(sensors, "brightness", pattern, 20000, duration=0.3, publish=True)
+    generator.start()
+    # The ticks publish at the same time as the generator
+    while generator.is_alive():
+        sensor.tick()
+    sensor.tick()
+    assert generator.serialize()["messages"] > 0
+    assert dumps["/read/" + sensor.url_dump] == sensor.serialize()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.codec import default_codec
+from network.connection import ConnectionPool
+from network.led import Led
+from network.scheduler import Scheduler
+from network.store import CompactLed, LedStore
+from network.transport import LoopbackTransport
+
+# Identity fields: different for the two leds
+IDENTITY = ["mac", "initialSetupDate"]
+WRITES = [
+    ("/setup/config", {"iMax": 700, "group": 3, "thresoldLow": 5, "defaultBrightness": 30}),
+    ("/status/auto", "false"),
+    ("/base/setpointManual", "42"),
+    ("/config/thresoldHigh", "80"),
+    ("/config/watchdog", "12"),
+    ("/base/setpointManual", "95"),
+    ("/config/isBleEnabled", "true"),
+    ("/status/auto", "true"),
+    ("/base/setpoint", "3"),
+    ("/base/setpoint", "60")
+]
+
+
+def create_leds(snapshot_period=0):
+    # Both leds on the same pool, on a scheduler never started: the test ticks them
+    transport = LoopbackTransport()
+    pool = ConnectionPool("loopback", 1, transport)
+    pool.connect()
+    scheduler = Scheduler()
+    led = Led("loopback", "OBJECT000001", 2.3, pool=pool, scheduler=scheduler, transport=transport,
+              snapshot_period=snapshot_period)
+    store = LedStore(pool, scheduler, snapshot_period=snapshot_period)
+    compact = store.create("COMPACT00001", 2.3)
+    for driver in [led, compact]:
+        driver.start()
+    return transport, led, compact
+
+
+def listen(transport):
+    dumps = {}
+
+    def received(client, userdata, message):
+        mac = message.topic.split("/")[3]
+        dumps.setdefault(mac, []).append(without_identity(default_codec.decode(message.payload)))
+
+    listener = transport.client("listener")
+    listener.on_message = received
+    listener.subscribe("/read/led/+/status/dump")
+    return dumps
+
+
+def without_identity(dump):
+    return {key: value for key, value in dump.items() if key not in IDENTITY}
+
+
+def write(transport, driver, suffix, value):
+    payload = default_codec.encode(value) if isinstance(value, dict) else value
+    transport.client("switch").publish("/write/" + driver.base_topic + suffix, payload)
+
+
+def test_compact_led_behaves_like_led():
+    transport, led, compact = create_leds()
+    assert isinstance(compact, CompactLed)
+    assert without_identity(compact.serialize()) == without_identity(led.serialize())
+    for suffix, value in WRITES:
+        for driver in [led, compact]:
+            write(transport, driver, suffix, value)
+            driver.tick()
+        assert without_identity(compact.serialize()) == without_identity(led.serialize())
+    assert compact.serialize()["brightness"] == 60
+    assert compact.serialize()["isConfigured"] is True
+    # Back to automatic mode once the watchdog is over
+    write(transport, led, "/status/auto", "false")
+    write(transport, compact, "/status/auto", "false")
+    for _ in range(15):
+        led.tick()
+        compact.tick()
+    assert compact.auto is True
+    assert without_identity(compact.serialize()) == without_identity(led.serialize())
+    state = compact.state()
+    state.pop("initial_date")
+    assert state == {name: value for name, value in led.state().items() if name in state}
+
+
+def test_compact_led_delta_dumps():
+    transport, led, compact = create_leds(snapshot_period=4)
+    dumps = listen(transport)
+    for suffix, value in WRITES:
+        for driver in [led, compact]:
+            write(transport, driver, suffix, value)
+            driver.tick()
+            driver.tick()
+    assert len(dumps[led.mac]) > 4
+    assert dumps[compact.mac] == dumps[led.mac]
+
+
+def test_store_rows():
+    transport, led, compact = create_leds()
+    store = compact.store
+    other = store.create("COMPACT00002", 3.1)
+    assert (compact.slot, other.slot, store.size) == (0, 1, 2)
+    other.brightness = 12.7
+    # Integer columns truncate, the other leds are untouched
+    assert (other.brightness, compact.brightness) == (12, 0)
+    revision = other.revision
+    other.brightness = 12
+    assert other.revision == revision
+    other.brightness = 13
+    assert other.revision > revision
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.revision import Versioned
+from network.stream import EventStream, StreamClient
+
+
+class Led(Versioned):
+
+    def __init__(self, mac, group=0):
+        self.mac = mac
+        self.group = group
+        self.brightness = 0
+
+    def serialize(self):
+        return {"mac": self.mac, "group": self.group, "brightness": self.brightness}
+
+
+class Group(Versioned):
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.setpoint = 0
+
+    def serialize(self):
+        return {"group": self.group_id, "setpoint": self.setpoint}
+
+
+class Events(object):
+
+    def __init__(self):
+        self.listeners = []
+
+
+class Switch(object):
+
+    def __init__(self):
+        self.events = Events()
+        self.drivers = {"leds": {}, "sensors": {}, "blinds": {}}
+        self.groups = {}
+
+
+def create_stream(**filters):
+    switch = Switch()
+    stream = EventStream(switch)
+    client = stream.subscribe(StreamClient(**filters))
+    return switch, stream, client
+
+
+def test_reference_then_changes():
+    switch, stream, client = create_stream()
+    led = switch.drivers["leds"]["AB"] = Led("AB", 1)
+    group = switch.groups[1] = Group(1)
+    # The first collection is the reference state, not sent
+    stream.collect()
+    assert client.wait(0) == []
+    led.brightness = 30
+    group.setpoint = 40
+    stream.collect()
+    assert client.wait(0) == [
+        {"type": "led", "mac": "AB", "group": 1, "changes": {"brightness": 30}},
+        {"type": "group", "group": 1, "changes": {"setpoint": 40}}
+    ]
+    # Nothing changed
+    stream.collect()
+    assert client.wait(0) == []
+
+
+def test_pending_changes_are_merged():
+    switch, stream, client = create_stream()
+    led = switch.drivers["leds"]["AB"] = Led("AB")
+    stream.collect()
+    led.brightness = 10
+    stream.collect()
+    led.group = 2
+    stream.collect()
+    assert client.wait(0) == [{"type": "led", "mac": "AB", "group": 0, "changes": {"brightness": 10, "group": 2}}]
+
+
+def test_removed_events_keep_the_group():
+    switch, stream, client = create_stream(group=3)
+    switch.drivers["leds"]["AB"] = Led("AB", 3)
+    switch.drivers["leds"]["CD"] = Led("CD", 4)
+    switch.groups[3] = Group(3)
+    stream.collect()
+    del switch.drivers["leds"]["AB"]
+    del switch.drivers["leds"]["CD"]
+    del switch.groups[3]
+    stream.collect()
+    assert client.wait(0) == [
+        {"type": "led", "removed": True, "group": 3, "mac": "AB"},
+        {"type": "group", "removed": True, "group": 3}
+    ]
+
+
+def test_filters():
+    client = StreamClient(types=["led"], mac="AB")
+    assert client.accept({"type": "led", "mac": "AB"})
+    assert not client.accept({"type": "led", "mac": "CD"})
+    assert not client.accept({"type": "group", "group": 1})
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.blind import Blind
+from network.led import Led
+from network.scheduler import Scheduler
+from network.sensor import Sensor
+from network.switch import Switch
+from network.topology import TopologyBuilder, load_topology
+from network.transport import LoopbackTransport
+import json
+import pytest
+
+MODELS = {"led": Led, "sensor": Sensor, "blind": Blind}
+
+
+def create_builder(macs=None, shard=None):
+    # Scheduler never started: the drivers and groups do not tick
+    transport = LoopbackTransport()
+    scheduler = Scheduler()
+    switch = Switch("loopback", scheduler=scheduler, transport=transport)
+    plug = {"led": switch.plug_led, "sensor": switch.plug_sensor, "blind": switch.plug_blind}
+
+    def create_driver(driver_type, mac):
+        driver = MODELS[driver_type]("loopback", mac, 2.3, scheduler=scheduler, transport=transport)
+        plug[driver_type](driver)
+        return driver
+
+    options = {"shard": shard}
+    if macs is not None:
+        generated = iter(macs)
+        options["mac_generator"] = lambda: next(generated)
+    return switch, TopologyBuilder(switch, create_driver, **options)
+
+
+def test_build(tmp_path):
+    path = str(tmp_path / "building.json")
+    with open(path, "w") as stream:
+        json.dump({"leds": 2, "groups": [{"group": 1, "leds": 3, "sensors": ["AB12CD34EF56"], "blinds": 1,
+                                          "brightness": 500}]}, stream)
+    switch, builder = create_builder()
+    drivers = builder.build(load_topology(path))
+    assert len(drivers) == 7
+    assert len(switch.drivers["leds"]) == 5
+    group = switch.groups[1]
+    assert len(group.leds) == 3
+    assert list(group.sensors) == ["AB12CD34EF56"]
+    assert len(group.blinds) == 1
+    assert group.rules == {"presence": 600, "temperature": 200, "brightness": 500}
+
+
+def test_generated_macs_are_unique():
+    # The generator gives the same mac several times
+    switch, builder = create_builder(["MAC000000001", "MAC000000001", "AB12CD34EF56", "MAC000000002",
+                                      "MAC000000001", "MAC000000003"])
+    drivers = builder.build({"leds": 3, "sensors": ["AB12CD34EF56"]})
+    assert sorted(driver.mac for driver in drivers) == ["AB12CD34EF56", "MAC000000001", "MAC000000002",
+                                                        "MAC000000003"]
+    assert len(switch.drivers["leds"]) == 3
+
+
+def test_duplicated_macs():
+    switch, builder = create_builder()
+    with pytest.raises(ValueError):
+        builder.build({"leds": ["AB12CD34EF56"], "sensors": ["AB12CD34EF56"]})
+    with pytest.raises(ValueError):
+        builder.build({"groups": [{"group": 0, "leds": 1}]})
+
+
+def test_invalid_rules():
+    switch, builder = create_builder()
+    with pytest.raises(ValueError):
+        builder.build({"groups": [{"group": 1, "leds": 1, "brightness": "300"}]})
+    # Refused before any driver is created
+    assert not switch.drivers["leds"]
+
+
+def test_shard_part():
+    switch, builder = create_builder(shard=(1, 2))
+    drivers = builder.build({"leds": 4, "groups": [{"group": 1, "leds": 2}, {"group": 2, "leds": 2}]})
+    # Groups number % 2 == 1, and one led out of two without group
+    assert list(switch.groups) == [1]
+    assert len(drivers) == 4
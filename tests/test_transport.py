@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+# coding: utf-8
+
+from network.transport import LoopbackTransport
+
+DUMP = "/read/sensor/AB12CD34EF56/status/dump"
+DUMPS = "/read/sensor/+/status/dump"
+
+
+def test_loopback_delivers_once_per_client():
+    transport = LoopbackTransport()
+    client = transport.client("client")
+    received = []
+    client.on_message = lambda client, userdata, message: received.append(message.topic)
+    client.subscribe("/read/#")
+    client.subscribe(DUMPS)
+    client.subscribe(DUMPS)
+    other = transport.client("other")
+    other.on_message = lambda client, userdata, message: received.append("other")
+    other.subscribe(DUMPS)
+    transport.client("sensor").publish(DUMP, "{}")
+    assert sorted(received) == [DUMP, "other"]
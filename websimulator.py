@@ -1,15 +1,35 @@
 #!/usr/bin/python3
 # coding: utf-8
 
+import multiprocessing
+import os
 import sys
+import tempfile
 import time
 
 from network.led import Led
-from network.switch import Switch
+from network.switch import Switch, CATEGORIES
 from network.sensor import Sensor
 from network.blind import Blind
+from network.connection import ConnectionPool
+from network.scheduler import Scheduler
+from network.engine import AsyncScheduler, AsyncConnectionPool
+from network.clock import create_clock
+from network.codec import CODECS, create_codec
+from network.transport import TRANSPORTS, create_transport
+from network.starter import PacedStarter
+from network.topology import TopologyBuilder, load_topology
+from network.snapshot import FleetSnapshot
+from network.stream import EventStream, StreamClient, STREAM_TYPES
+from network.shard import ShardClient, ShardCoordinator, serve_shard
+from network.stimulus import FIELDS, PATTERNS, LoadGenerator, create_pattern, pattern_parameters
+from network.metrics import metrics, render_metrics
+from network.profiler import profiler, SORT_KEYS
+from network.recording import recorder
+from network.store import CompactLed, create_store
+from network.controller import create_controller, numpy
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flasgger import Swagger
 from flasgger.utils import swag_from
 
@@ -17,6 +37,13 @@ import string
 import random
 from log import logger
 import argparse
+import json
+
+try:
+    from cheroot import wsgi
+    from cheroot.ssl.builtin import BuiltinSSLAdapter
+except ImportError:
+    wsgi = None
 
 try:
     from http import HTTPStatus
@@ -26,8 +53,35 @@ except ImportError:
 def mac_generator(size=12, chars=string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))
 
+BOOLEANS = {"true": True, "1": True, "false": False, "0": False}
+
+def parse_bool(value):
+    # None when the query parameter is not a boolean
+    return BOOLEANS.get(value)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def valid_cursor(cursor):
+    # Cursor returned by the query: <category>:<mac>, or groups:<group number>
+    category, separator, key = cursor.partition(":")
+    if category not in CATEGORIES or not separator or not key:
+        return False
+    if category == "groups":
+        try:
+            int(key)
+        except ValueError:
+            return False
+    return True
+
 app = Flask(__name__)
 
+MAX_BULK_DRIVERS = 10000
+MAX_PAGE_SIZE = 1000
+MAX_STIMULUS_RATE = 100000
+STREAM_KEEPALIVE = 15
+METRICS_MIMETYPE = "text/plain; version=0.0.4"
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-b", "--broker",  type=str, default="127.0.0.1",
@@ -36,45 +90,145 @@ def main():
                         help="web port by default 80")
     parser.add_argument("-s", "--https",  dest='https', action='store_true',
                         help="allow https by default False")
+    parser.add_argument("-m", "--mqtt-pool",  type=int, default=0,
+                        help="number of MQTT connections shared by all the drivers, by default 0 (one connection per driver)")
+    parser.add_argument("-w", "--workers",  type=int, default=0,
+                        help="number of scheduler threads ticking drivers and groups, by default 0 (one thread per driver and group)")
+    parser.add_argument("-a", "--engine",  type=str, default="threads", choices=["threads", "asyncio"],
+                        help="simulation engine, asyncio runs the drivers, groups and MQTT connections (--mqtt-pool, at least 1) on one event loop, by default threads")
+    parser.add_argument("-x", "--speed",  type=float, default=1,
+                        help="simulation speed factor, 0 runs as fast as possible in lockstep (requires --workers), by default 1")
+    parser.add_argument("-d", "--delta-dump",  type=int, default=0,
+                        help="publish only the changed fields in the drivers dump with a full dump every N seconds, by default 0 (always full dump)")
+    parser.add_argument("-T", "--transport",  type=str, default="mqtt", choices=sorted(TRANSPORTS),
+                        help="message transport, loopback delivers the messages in memory without broker (the controller under test cannot see them), by default mqtt")
+    parser.add_argument("-c", "--codec",  type=str, default="json", choices=sorted(CODECS),
+                        help="payload encoding of the drivers telemetry and provisioning, by default json")
+    parser.add_argument("-r", "--connect-rate",  type=float, default=100,
+                        help="maximum number of drivers started per second by the bulk creation, by default 100")
+    parser.add_argument("-e", "--events-size",  type=int, default=10000,
+                        help="maximum number of diagnostic events kept in memory, by default 10000")
+    parser.add_argument("-S", "--server",  type=str, default="flask", choices=["flask", "cheroot"],
+                        help="HTTP server, cheroot is a thread pool server with keep-alive connections, by default flask (development server)")
+    parser.add_argument("-n", "--threads",  type=int, default=32,
+                        help="number of HTTP worker threads of the cheroot server (each stream client holds one), by default 32")
+    parser.add_argument("-k", "--shards",  type=int, default=0,
+                        help="number of worker processes sharing the drivers and groups (by group and mac), by default 0 (everything in this process)")
+    parser.add_argument("-t", "--topology",  type=str, default="",
+                        help="JSON or YAML description of the drivers, groups and rules created at startup")
+    parser.add_argument("-F", "--store",  type=str, default="objects", choices=["objects", "columnar"],
+                        help="led state storage, columnar keeps it in typed arrays (far less memory per led, requires --mqtt-pool and --workers or --engine asyncio), by default objects")
+    parser.add_argument("-G", "--controller",  type=str, default="groups", choices=["groups", "batch"],
+                        help="group control loop, batch advances all the groups in one NumPy pass per tick instead of a tick per group, by default groups")
+    parser.add_argument("-R", "--record",  type=str, default="",
+                        help="record the MQTT messages sent and received into this file (one file per shard, suffixed by its index), replayed by replay.py")
     args = parser.parse_args()
+    if args.speed <= 0 and args.workers <= 0 and args.engine == "threads":
+        parser.error("lockstep simulation (--speed 0) requires the scheduler (--workers)")
+    if args.server == "cheroot" and wsgi is None:
+        parser.error("cheroot package is required by --server cheroot")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if args.shards < 0:
+        parser.error("--shards must be positive")
+    if args.store == "columnar" and args.engine == "threads" and (args.workers <= 0 or args.mqtt_pool <= 0):
+        parser.error("the columnar store (--store columnar) requires the scheduler (--workers) and the connection pool (--mqtt-pool)")
+    if args.controller == "batch" and numpy is None:
+        parser.error("numpy package is required by --controller batch")
     logger.info("Broker address is %r", args.broker)
-    broker_address = args.broker
-    port = args.port
-    https = args.https
 
     logger.info("EnergieIP Simulator")
 
-    switch = Switch(broker_address)
+    if args.shards > 0:
+        start_shards(args)
+    else:
+        setup(args)
+    add_swagger()
+
+    if args.server == "cheroot":
+        serve(args.port, args.https, args.threads)
+    elif args.https:
+        app.run(host="0.0.0.0", port=args.port, ssl_context='adhoc')
+    else:
+        app.run(host="0.0.0.0", port=args.port)
+
+
+# Build the simulated fleet and its API routes, shard is (index, count) in a shard process
+def setup(args, shard=None):
+    broker_address = args.broker
+    clock = create_clock(args.speed)
+    codec = create_codec(args.codec)
+    transport = create_transport(args.transport)
+    if args.record:
+        recorder.start(args.record if shard is None else args.record + "." + str(shard[0]))
+
+    scheduler = None
+    pool = None
+    if args.engine == "asyncio":
+        scheduler = AsyncScheduler(clock=clock)
+        scheduler.start()
+        pool = AsyncConnectionPool(broker_address, max(1, args.mqtt_pool), scheduler, transport)
+        pool.connect()
+    else:
+        if args.workers > 0:
+            scheduler = Scheduler(workers=args.workers, clock=clock)
+            scheduler.start()
+        if args.mqtt_pool > 0:
+            pool = ConnectionPool(broker_address, args.mqtt_pool, transport)
+            pool.connect()
+
+    controller = create_controller(args.controller, scheduler, clock)
+    switch = Switch(broker_address, scheduler=scheduler, clock=clock, codec=codec,
+                    events_size=args.events_size, pool=pool, local_only=shard is not None, transport=transport,
+                    controller=controller)
+    if controller:
+        controller.start()
     switch.start()
+    snapshot = FleetSnapshot(switch)
+    stream = EventStream(switch)
+    stream.start()
 
-    swagger_config = {
-        'headers': [
-            ('Strict-Transport-Security', 'max-age=31536000; includeSubDomains'),
-            ('X-Content-Type-Options', 'nosniff'),
-            ('X-Frame-Options', 'SAMEORIGIN'),
-            ('X-XSS-Protection', '1; mode=block')
-        ],
-        'specs': [
-            {
-                'endpoint': 'apispec',
-                'route': '/apispec.json',
-                'rule_filter': lambda rule: True,
-                'model_filter': lambda tag: True,
-            }
-        ],
-        "static_url_path": "/flasgger_static",
-        'swagger_ui': True,
-        "specs_route": "/"
+    driver_options = {
+        "pool": pool,
+        "scheduler": scheduler,
+        "clock": clock,
+        "snapshot_period": args.delta_dump,
+        "codec": codec,
+        "tracer": switch.tracer,
+        "transport": transport
     }
-    Swagger(app,  template_file='swagger/api.json', config=swagger_config)
+
+    store = create_store(args.store, pool=pool, scheduler=scheduler, clock=clock, codec=codec,
+                         snapshot_period=args.delta_dump, tracer=switch.tracer)
+
+    starter = PacedStarter(args.connect_rate)
+    starter.start()
+
+    driver_models = {
+        "led": (Led, 2.3, switch.get_led, switch.plug_led),
+        "sensor": (Sensor, 2.3, switch.get_sensor, switch.plug_sensor),
+        "blind": (Blind, 3.1, switch.get_blind, switch.plug_blind)
+    }
+
+    def create_driver(driver_type, mac=None):
+        model, version, get_driver, plug_driver = driver_models[driver_type]
+        if not mac:
+            mac = mac_generator()
+            while get_driver(mac):
+                mac = mac_generator()
+        if driver_type == "led" and store:
+            driver = store.create(mac, version)
+        else:
+            driver = model(broker_address, mac, version, **driver_options)
+        plug_driver(driver)
+        return driver
+
+    if args.topology:
+        TopologyBuilder(switch, create_driver, shard=shard, mac_generator=mac_generator).build(load_topology(args.topology))
 
     @app.route('/v1/led/new', methods=['POST'])
     def led_new():
-        mac = mac_generator()
-        while switch.get_led(mac):
-            mac = mac_generator()
-        led = Led(broker_address, mac, 2.3)
-        switch.plug_led(led)
+        led = create_driver("led")
         led.start()
         return jsonify(led.serialize()), HTTPStatus.OK
 
@@ -116,21 +270,13 @@ def main():
 
     @app.route('/v1/sensor/new', methods=['POST'])
     def sensor_new():
-        mac = mac_generator()
-        while switch.get_sensor(mac):
-            mac = mac_generator()
-        sensor = Sensor(broker_address, mac, 2.3)
-        switch.plug_sensor(sensor)
+        sensor = create_driver("sensor")
         sensor.start()
         return jsonify(sensor.serialize()), HTTPStatus.OK
 
     @app.route('/v1/blind/new', methods=['POST'])
     def blind_new():
-        mac = mac_generator()
-        while switch.get_sensor(mac):
-            mac = mac_generator()
-        blind = Blind(broker_address, mac, 3.1)
-        switch.plug_blind(blind)
+        blind = create_driver("blind")
         blind.start()
         return jsonify(blind.serialize()), HTTPStatus.OK
 
@@ -215,6 +361,77 @@ def main():
             }
         return jsonify(error), HTTPStatus.BAD_REQUEST
 
+    @app.route('/v1/<driver_type>/bulk', methods=['POST'])
+    def driver_bulk(driver_type):
+        if driver_type not in driver_models:
+            error = {
+                "Message": "Unknow driver type " + driver_type
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        get_driver = driver_models[driver_type][2]
+        macs = request.json.get("macs", [])
+        if not isinstance(macs, list) or not all(isinstance(mac, str) for mac in macs):
+            error = {
+                "Message": "Macs must be a list of strings"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        count = request.json.get("count", len(macs))
+        prefix = request.json.get("macPrefix", "")
+        group_id = request.json.get("group", 0)
+        if not isinstance(prefix, str):
+            error = {
+                "Message": "Mac prefix must be a string"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if not isinstance(group_id, int) or isinstance(group_id, bool):
+            error = {
+                "Message": "Group must be an integer"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1 or count > MAX_BULK_DRIVERS:
+            error = {
+                "Message": "Count must be between 1 and " + str(MAX_BULK_DRIVERS)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if macs and len(macs) != count:
+            error = {
+                "Message": "Count does not match the number of macs"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if len(prefix) >= 12:
+            error = {
+                "Message": "Mac prefix must be shorter than 12 characters"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if group_id and not switch.get_group_id(group_id):
+            error = {
+                "Message": "Unknow group " + str(group_id)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if len(set(macs)) != len(macs):
+            error = {
+                "Message": "Duplicated macs"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        for mac in macs:
+            if get_driver(mac):
+                error = {
+                    "Message": "Driver " + mac + " already exists"
+                }
+                return jsonify(error), HTTPStatus.BAD_REQUEST
+        if not macs:
+            while len(macs) < count:
+                mac = prefix + mac_generator(12 - len(prefix))
+                if mac not in macs and not get_driver(mac):
+                    macs.append(mac)
+
+        drivers = [create_driver(driver_type, mac) for mac in macs]
+        if group_id:
+            for driver in drivers:
+                switch.add_driver_to_group(group_id, driver_type, driver.mac)
+        starter.add(drivers)
+        return jsonify({driver_type + "s": [driver.serialize() for driver in drivers]}), HTTPStatus.OK
+
     @app.route('/v1/debug/sensor/brightnessRaw', methods=['POST'])
     def debug_sensor_brightness():
         mac = request.json["mac"]
@@ -253,6 +470,85 @@ def main():
         sensor.temperature_raw = temperature
         return jsonify(sensor.serialize()), HTTPStatus.OK
 
+    stimuli = {}
+
+    @app.route('/v1/stimulus', methods=['POST'])
+    def stimulus_new():
+        pattern = request.json.get("pattern", "")
+        if pattern not in PATTERNS:
+            error = {
+                "Message": "Unknow pattern " + pattern
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        field = request.json.get("field", "presence" if pattern == "poisson" else "brightness")
+        if field not in FIELDS or (pattern == "poisson") != (field == "presence"):
+            error = {
+                "Message": "Invalid field " + field + " for pattern " + pattern
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        for key in ["rate", "duration"] + pattern_parameters(pattern):
+            if not is_number(request.json.get(key, 0)):
+                error = {
+                    "Message": key + " must be a number"
+                }
+                return jsonify(error), HTTPStatus.BAD_REQUEST
+        if not isinstance(request.json.get("publish", False), bool):
+            error = {
+                "Message": "publish must be a boolean"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        rate = request.json.get("rate", 1)
+        if rate <= 0 or rate > MAX_STIMULUS_RATE:
+            error = {
+                "Message": "Rate must be between 0 and " + str(MAX_STIMULUS_RATE)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if "group" in request.json:
+            group = switch.get_group_id(request.json["group"])
+            if not group:
+                error = {
+                    "Message": "Unknow group " + str(request.json["group"])
+                }
+                return jsonify(error), HTTPStatus.BAD_REQUEST
+            macs = list(group.sensors)
+        else:
+            macs = request.json.get("sensors", [sensor.mac for sensor in switch.list_sensors()])
+        sensors = []
+        for mac in macs:
+            sensor = switch.get_sensor(mac)
+            if not sensor:
+                error = {
+                    "Message": "Unknow sensor " + mac
+                }
+                return jsonify(error), HTTPStatus.BAD_REQUEST
+            sensors.append(sensor)
+        if not sensors:
+            error = {
+                "Message": "No sensor to stimulate"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        generator = LoadGenerator(sensors, field, create_pattern(pattern, request.json), rate,
+                                  duration=request.json.get("duration", 0),
+                                  publish=request.json.get("publish", False), clock=clock)
+        stimuli[generator.id] = generator
+        generator.start()
+        return jsonify(generator.serialize()), HTTPStatus.OK
+
+    @app.route('/v1/stimulus', methods=['GET'])
+    def stimulus_list():
+        return jsonify(stimuli=[generator.serialize() for generator in list(stimuli.values())]), HTTPStatus.OK
+
+    @app.route('/v1/stimulus/stop', methods=['POST'])
+    def stimulus_stop():
+        generator = stimuli.pop(request.json.get("id", ""), None)
+        if not generator:
+            error = {
+                "Message": "Unknow stimulus " + str(request.json.get("id"))
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        generator.stop()
+        return jsonify(generator.serialize()), HTTPStatus.OK
+
     @app.route('/v1/group/new', methods=['POST'])
     def group_new():
         group_id = request.json["group"]
@@ -306,14 +602,21 @@ def main():
                 return jsonify(error), HTTPStatus.BAD_REQUEST
             driver_blinds.append(s)
 
+        rules = {
+            "presence": request.json.get("presence", 600),
+            "temperature": request.json.get("temperature", 200),
+            "brightness": request.json.get("brightness", 300)
+        }
+        for rule_id, value in rules.items():
+            if not is_number(value):
+                error = {
+                    "Message": rule_id.capitalize() + " must be a number"
+                }
+                return jsonify(error), HTTPStatus.BAD_REQUEST
         resp = switch.create_group(driver_leds, network_sensors, driver_blinds, group_id)
         if resp:
-            presence = request.json.get("presence", 600)
-            switch.update_group_rules(group_id, "presence", presence)
-            temperature = request.json.get("temperature", 200)
-            switch.update_group_rules(group_id, "temperature", temperature)
-            brightness = request.json.get("brightness", 300)
-            switch.update_group_rules(group_id, "brightness", brightness)
+            for rule_id, value in rules.items():
+                switch.update_group_rules(group_id, rule_id, value)
             return jsonify(switch.get_group_id(group_id).serialize()), HTTPStatus.OK
         error = {
             "Message": "Goup " + str(group_id) + " already exists"
@@ -361,6 +664,11 @@ def main():
     def group_brightness():
         group_id = request.json["group"]
         brightness = request.json.get("brightness", 300)
+        if not is_number(brightness):
+            error = {
+                "Message": "Brightness must be a number"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
         resp = switch.update_group_rules(group_id, "brightness", brightness)
         if resp:
             return jsonify(switch.get_group_id(group_id).serialize()), HTTPStatus.OK
@@ -373,6 +681,11 @@ def main():
     def group_presence():
         group_id = request.json["group"]
         presence = request.json.get("presence", 600)
+        if not is_number(presence):
+            error = {
+                "Message": "Presence must be a number"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
         resp = switch.update_group_rules(group_id, "presence", presence)
         if resp:
             return jsonify(switch.get_group_id(group_id).serialize()), HTTPStatus.OK
@@ -385,6 +698,11 @@ def main():
     def group_temperature():
         group_id = request.json["group"]
         temperature = request.json.get("temperature", 200)
+        if not is_number(temperature):
+            error = {
+                "Message": "Temperature must be a number"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
         resp = switch.update_group_rules(group_id, "temperature", temperature)
         if resp:
             return jsonify(switch.get_group_id(group_id).serialize()), HTTPStatus.OK
@@ -442,26 +760,305 @@ def main():
         switch.set_group_setpoint(group_id, setpoint)
         return jsonify(), HTTPStatus.OK
 
+    @app.route('/v1/group/statistics', methods=['GET'])
+    def group_statistics():
+        group_id = request.args.get("group", type=int)
+        if group_id is None:
+            return jsonify(groups=[group.statistics() for group in switch.list_groups()]), HTTPStatus.OK
+        group = switch.get_group_id(group_id)
+        if not group:
+            error = {
+                "Message": "Unknow group " + str(group_id)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        return jsonify(group.statistics()), HTTPStatus.OK
+
     @app.route('/v1/switch', methods=['GET'])
     def list_drivers():
-        sensors = switch.list_sensors()
-        leds = switch.list_leds()
-        blinds = switch.list_blinds()
-        groups = switch.list_groups()
-        return jsonify(leds=[led.serialize() for led in leds],
-                       sensors=[sensor.serialize() for sensor in sensors],
-                       blinds=[blind.serialize() for blind in blinds],
-                       groups=[group.serialize() for group in groups]), HTTPStatus.OK
+        if request.args:
+            return query_drivers()
+        version, body = snapshot.encoded()
+        etag = str(version)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=HTTPStatus.NOT_MODIFIED)
+        else:
+            response = app.response_class(body, status=HTTPStatus.OK, mimetype="application/json")
+        response.set_etag(etag)
+        return response
+
+    @app.route('/v1/switch/latency', methods=['GET'])
+    def switch_latency():
+        return jsonify(switch.tracer.serialize()), HTTPStatus.OK
+
+    @app.route('/v1/switch/latency/reset', methods=['POST'])
+    def switch_latency_reset():
+        switch.tracer.reset()
+        return jsonify(), HTTPStatus.OK
+
+    @app.route('/v1/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(render_metrics(metrics.collect(switch)), mimetype=METRICS_MIMETYPE)
+
+    @app.route('/v1/debug/profiler', methods=['GET'])
+    def debug_profiler():
+        top = request.args.get("top", 20, type=int)
+        sort = request.args.get("sort", "total")
+        if top < 0 or sort not in SORT_KEYS:
+            error = {
+                "Message": "top must be positive and sort one of " + ", ".join(SORT_KEYS)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        return jsonify(profiler.report(top, sort)), HTTPStatus.OK
+
+    @app.route('/v1/debug/profiler', methods=['POST'])
+    def debug_profiler_setup():
+        settings = request.get_json(silent=True)
+        if not isinstance(settings, dict) or not isinstance(settings.get("enabled"), bool):
+            error = {
+                "Message": "enabled must be a boolean"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        if not isinstance(settings.get("reset", False), bool):
+            error = {
+                "Message": "reset must be a boolean"
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        profiler.enable(settings["enabled"])
+        if settings.get("reset", False):
+            profiler.reset()
+        return jsonify(profiler.report()), HTTPStatus.OK
+
+    @app.route('/v1/record', methods=['GET'])
+    def record_status():
+        return jsonify(recorder.serialize()), HTTPStatus.OK
+
+    @app.route('/v1/record', methods=['POST'])
+    def record_start():
+        path = request.json.get("file", "")
+        if not path:
+            return jsonify({"Message": "Missing recording file"}), HTTPStatus.BAD_REQUEST
+        try:
+            recorder.start(path)
+        except OSError as error:
+            return jsonify({"Message": "Cannot record into " + path + ": " + str(error)}), HTTPStatus.BAD_REQUEST
+        return jsonify(recorder.serialize()), HTTPStatus.OK
+
+    @app.route('/v1/record/stop', methods=['POST'])
+    def record_stop():
+        recorder.stop()
+        return jsonify(recorder.serialize()), HTTPStatus.OK
+
+    @app.route('/v1/debug/codec', methods=['GET'])
+    def debug_codec():
+        return jsonify(codec.serialize()), HTTPStatus.OK
+
+    def query_drivers():
+        categories = CATEGORIES
+        if "type" in request.args:
+            categories = [driver_type + "s" for driver_type in request.args["type"].split(",")]
+            for category in categories:
+                if category not in CATEGORIES:
+                    error = {
+                        "Message": "Unknow type " + category[:-1]
+                    }
+                    return jsonify(error), HTTPStatus.BAD_REQUEST
+        limit = request.args.get("limit", 100, type=int)
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            error = {
+                "Message": "Limit must be between 1 and " + str(MAX_PAGE_SIZE)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        filters = {}
+        for name in ["isConfigured", "auto"]:
+            if name in request.args:
+                filters[name] = parse_bool(request.args[name])
+                if filters[name] is None:
+                    error = {
+                        "Message": name + " must be true, false, 1 or 0"
+                    }
+                    return jsonify(error), HTTPStatus.BAD_REQUEST
+        cursor = request.args.get("cursor", "")
+        if cursor and not valid_cursor(cursor):
+            error = {
+                "Message": "Invalid cursor " + cursor
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        fields = None
+        if "fields" in request.args:
+            fields = request.args["fields"].split(",")
+        results, cursor = switch.query(categories=categories,
+                                       group=request.args.get("group", type=int),
+                                       is_configured=filters.get("isConfigured"),
+                                       auto=filters.get("auto"),
+                                       mac_prefix=request.args.get("mac", ""),
+                                       cursor=cursor,
+                                       limit=limit)
+        response = {"cursor": cursor}
+        for category, entities in results.items():
+            serialized = [entity.serialize() for entity in entities]
+            if fields:
+                serialized = [{field: entity[field] for field in fields if field in entity} for entity in serialized]
+            response[category] = serialized
+        return jsonify(response), HTTPStatus.OK
 
     @app.route('/v1/switch/diagnostic', methods=['GET'])
     def generate_diagnostic():
         diag = switch.get_diagnostic()
         return jsonify(config=diag["config"], events=diag['events']), HTTPStatus.OK
 
+    @app.route('/v1/switch/diagnostic/events', methods=['GET'])
+    def diagnostic_events():
+        limit = request.args.get("limit", 100, type=int)
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            error = {
+                "Message": "Limit must be between 1 and " + str(MAX_PAGE_SIZE)
+            }
+            return jsonify(error), HTTPStatus.BAD_REQUEST
+        events, cursor = switch.events.query(since=request.args.get("since", type=float),
+                                             until=request.args.get("until", type=float),
+                                             event_type=request.args.get("type"),
+                                             mac=request.args.get("mac"),
+                                             group=request.args.get("group", type=int),
+                                             cursor=request.args.get("cursor", 0, type=int),
+                                             limit=limit)
+        return jsonify(events=events, cursor=cursor), HTTPStatus.OK
+
+    @app.route('/v1/switch/stream', methods=['GET'])
+    def switch_stream():
+        types = None
+        if "type" in request.args:
+            types = request.args["type"].split(",")
+            for stream_type in types:
+                if stream_type not in STREAM_TYPES:
+                    error = {
+                        "Message": "Unknow type " + stream_type
+                    }
+                    return jsonify(error), HTTPStatus.BAD_REQUEST
+        client = stream.subscribe(StreamClient(types=types,
+                                               mac=request.args.get("mac"),
+                                               group=request.args.get("group", type=int)))
+
+        def generate():
+            try:
+                while True:
+                    events = client.wait(STREAM_KEEPALIVE)
+                    if not events:
+                        # Comment line keeping the connection open
+                        yield ": keepalive\n\n"
+                    for event in events:
+                        yield "event: " + event["type"] + "\ndata: " + json.dumps(event) + "\n\n"
+            finally:
+                stream.unsubscribe(client)
+
+        return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    return switch
+
+
+def add_swagger():
+    swagger_config = {
+        'headers': [
+            ('Strict-Transport-Security', 'max-age=31536000; includeSubDomains'),
+            ('X-Content-Type-Options', 'nosniff'),
+            ('X-Frame-Options', 'SAMEORIGIN'),
+            ('X-XSS-Protection', '1; mode=block')
+        ],
+        'specs': [
+            {
+                'endpoint': 'apispec',
+                'route': '/apispec.json',
+                'rule_filter': lambda rule: True,
+                'model_filter': lambda tag: True,
+            }
+        ],
+        "static_url_path": "/flasgger_static",
+        'swagger_ui': True,
+        "specs_route": "/"
+    }
+    Swagger(app,  template_file='swagger/api.json', config=swagger_config)
+
+
+def start_shards(args):
+    # The shard processes simulate the fleet, this process only routes the API requests
+    context = multiprocessing.get_context("spawn")
+    shards = []
+    for index in range(args.shards):
+        connection, child = context.Pipe()
+        process = context.Process(target=run_shard, args=(index, args, child), name="Shard" + str(index),
+                                  daemon=True)
+        process.start()
+        shards.append(ShardClient(index, process, connection))
+    coordinator = ShardCoordinator(shards)
+    logger.info("Fleet shared by %r shard processes", args.shards)
+
+    @app.before_request
+    def forward_request():
+        if not request.path.startswith("/v1/"):
+            return None
+        if request.path == "/v1/metrics":
+            return Response(render_metrics(coordinator.metrics()), mimetype=METRICS_MIMETYPE)
+        if request.path == "/v1/switch" and request.method == "GET" and not request.args:
+            status, answer, etag = coordinator.conditional_listing(request.if_none_match)
+            response = app.response_class(status=status) if status == HTTPStatus.NOT_MODIFIED else jsonify(answer)
+            response.status_code = status
+            if etag:
+                response.set_etag(etag)
+            return response
+        status, answer = coordinator.route(request.method, request.path, request.args.to_dict(),
+                                           request.get_json(silent=True))
+        return jsonify(answer), status
+
+    return coordinator
+
+
+def run_shard(index, args, connection):
+    switch = setup(args, shard=(index, args.shards))
+    client = app.test_client()
+    unplug = {Led: switch.unplug_led, CompactLed: switch.unplug_led, Sensor: switch.unplug_sensor, Blind: switch.unplug_blind}
+
+    def forward_request(method, path, query, body, headers=None):
+        response = client.open(path, method=method, query_string=query, json=body, headers=headers)
+        return response.status_code, response.get_data(as_text=True), response.get_etag()[0]
+
+    def has_driver(mac):
+        return switch.get_driver(mac) is not None
+
+    def unplug_driver(mac):
+        # Only the drivers without group can move to another shard
+        driver = switch.get_driver(mac)
+        if not driver or driver.group != 0:
+            return None
+        driver.stop()
+        unplug[type(driver)](driver)
+        return driver.base_topic.split("/")[0], driver.state()
+
+    def restore_driver(mac, state):
+        switch.get_driver(mac).restore(state)
+
+    serve_shard(connection, {
+        "request": forward_request,
+        "has_driver": has_driver,
+        "unplug_driver": unplug_driver,
+        "restore_driver": restore_driver,
+        "metrics": lambda: metrics.collect(switch)
+    })
+    # The coordinator is gone: the simulation threads never end on their own
+    logger.info("Shard %r stopped", index)
+    os._exit(0)
+
+
+
+def serve(port, https, threads):
+    server = wsgi.Server(("0.0.0.0", int(port)), app, numthreads=threads, server_name="sol200-simulator")
     if https:
-        app.run(host="0.0.0.0", port=port, ssl_context='adhoc')
-    else:
-        app.run(host="0.0.0.0", port=port)
+        # Same self-signed certificate as the adhoc context of the development server
+        from werkzeug.serving import make_ssl_devcert
+        certificate, key = make_ssl_devcert(os.path.join(tempfile.mkdtemp(), "simulator"), host="localhost")
+        server.ssl_adapter = BuiltinSSLAdapter(certificate, key)
+    logger.info("Serving on port %r with %r threads", port, threads)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file